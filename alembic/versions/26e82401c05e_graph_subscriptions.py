@@ -0,0 +1,41 @@
+"""graph subscriptions
+
+Revision ID: 26e82401c05e
+Revises: 8ab90eb24d4c
+Create Date: 2026-10-18 10:25:52.497810
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '26e82401c05e'
+down_revision: Union[str, Sequence[str], None] = '8ab90eb24d4c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "graph_subscriptions",
+        sa.Column("id", sa.String(), nullable=False),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("resource", sa.String(), nullable=False),
+        sa.Column("client_state", sa.String(length=128), nullable=False),
+        sa.Column("expires_at", sa.DateTime(), nullable=False),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_graph_subscriptions_email"), "graph_subscriptions", ["email"], unique=False)
+    op.create_index(op.f("ix_graph_subscriptions_expires_at"), "graph_subscriptions", ["expires_at"], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_graph_subscriptions_expires_at"), table_name="graph_subscriptions")
+    op.drop_index(op.f("ix_graph_subscriptions_email"), table_name="graph_subscriptions")
+    op.drop_table("graph_subscriptions")
@@ -0,0 +1,48 @@
+"""outbox jobs
+
+Revision ID: 825ea2780b0c
+Revises: cf657a8733ed
+Create Date: 2026-10-18 10:22:58.192211
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '825ea2780b0c'
+down_revision: Union[str, Sequence[str], None] = 'cf657a8733ed'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "outbox_jobs",
+        sa.Column("id", sa.String(length=36), nullable=False),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("op", sa.String(length=16), nullable=False),
+        sa.Column("event_id", sa.String(), nullable=True),
+        sa.Column("payload", sa.Text(), nullable=True),
+        sa.Column("status", sa.String(length=16), nullable=False),
+        sa.Column("attempts", sa.Integer(), nullable=False),
+        sa.Column("last_error", sa.Text(), nullable=True),
+        sa.Column("result", sa.Text(), nullable=True),
+        sa.Column("next_attempt_at", sa.DateTime(), nullable=False),
+        sa.Column("locked_until", sa.DateTime(), nullable=True),
+        sa.Column("created_at", sa.DateTime(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_outbox_jobs_email"), "outbox_jobs", ["email"], unique=False)
+    op.create_index("ix_outbox_jobs_status_next_attempt_at", "outbox_jobs", ["status", "next_attempt_at"], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_outbox_jobs_status_next_attempt_at", table_name="outbox_jobs")
+    op.drop_index(op.f("ix_outbox_jobs_email"), table_name="outbox_jobs")
+    op.drop_table("outbox_jobs")
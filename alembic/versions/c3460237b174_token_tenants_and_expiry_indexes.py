@@ -0,0 +1,48 @@
+"""token tenants and expiry indexes
+
+Revision ID: c3460237b174
+Revises: f532c749ddb9
+Create Date: 2026-10-18 10:40:47.764528
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c3460237b174'
+down_revision: Union[str, Sequence[str], None] = 'f532c749ddb9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    with op.batch_alter_table("tokens") as batch_op:
+        batch_op.add_column(sa.Column("tenant_id", sa.String(length=64), nullable=True))
+        batch_op.add_column(sa.Column("user_id", sa.String(length=64), nullable=True))
+        # Encrypted values are longer than the tokens themselves
+        batch_op.alter_column("access_token", type_=sa.Text(), existing_nullable=False)
+        batch_op.alter_column("refresh_token", type_=sa.Text(), existing_nullable=True)
+    # Built without locking writes on Postgres; large tables take a while
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_tokens_expires_at_id", "tokens", ["expires_at", "id"], unique=False, postgresql_concurrently=True
+        )
+        op.create_index(
+            "ix_tokens_tenant_id_expires_at_id", "tokens", ["tenant_id", "expires_at", "id"],
+            unique=False, postgresql_concurrently=True,
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_tokens_tenant_id_expires_at_id", table_name="tokens")
+    op.drop_index("ix_tokens_expires_at_id", table_name="tokens")
+    with op.batch_alter_table("tokens") as batch_op:
+        batch_op.alter_column("refresh_token", type_=sa.String(), existing_nullable=True)
+        batch_op.alter_column("access_token", type_=sa.String(), existing_nullable=False)
+        batch_op.drop_column("user_id")
+        batch_op.drop_column("tenant_id")
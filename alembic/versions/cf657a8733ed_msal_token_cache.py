@@ -0,0 +1,39 @@
+"""msal token cache
+
+Revision ID: cf657a8733ed
+Revises: a0bde32d2edb
+Create Date: 2026-10-18 10:16:34.857072
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'cf657a8733ed'
+down_revision: Union[str, Sequence[str], None] = 'a0bde32d2edb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "msal_token_caches",
+        sa.Column("id", sa.Integer(), nullable=False),
+        sa.Column("email", sa.String(), nullable=False),
+        sa.Column("cache_blob", sa.Text(), nullable=False),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_msal_token_caches_id"), "msal_token_caches", ["id"], unique=False)
+    op.create_index(op.f("ix_msal_token_caches_email"), "msal_token_caches", ["email"], unique=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f("ix_msal_token_caches_email"), table_name="msal_token_caches")
+    op.drop_index(op.f("ix_msal_token_caches_id"), table_name="msal_token_caches")
+    op.drop_table("msal_token_caches")
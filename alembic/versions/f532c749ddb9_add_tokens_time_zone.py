@@ -0,0 +1,29 @@
+"""add tokens time_zone
+
+Revision ID: f532c749ddb9
+Revises: 26e82401c05e
+Create Date: 2026-10-18 10:33:25.621387
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f532c749ddb9'
+down_revision: Union[str, Sequence[str], None] = '26e82401c05e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column("tokens", sa.Column("time_zone", sa.String(length=64), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("tokens") as batch_op:
+        batch_op.drop_column("time_zone")
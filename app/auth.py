@@ -1,48 +1,174 @@
-from msal import ConfidentialClientApplication
+import asyncio
+import importlib
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from msal import ConfidentialClientApplication, SerializableTokenCache
 from urllib.parse import urlencode
 from app.config import CLIENT_ID, CLIENT_SECRET, AUTHORITY, SCOPES,REDIRECT_URI
+from app.config import MSAL_MAX_WORKERS, MSAL_MAX_CONCURRENCY, MSAL_TIMEOUT_SECONDS, MSAL_HTTP_CLIENT
+from app.telemetry import observe
+
+logger = logging.getLogger(__name__)
+
+# Authority discovery responses, shared by every per-user app so that
+# building one does not repeat the discovery round trips
+_http_cache = {}
+
+
+@lru_cache(maxsize=1)
+def _http_client():
+    if not MSAL_HTTP_CLIENT:
+        return None
+    module_name, factory = MSAL_HTTP_CLIENT.split(":", 1)
+    return getattr(importlib.import_module(module_name), factory)()
+
+
+def build_msal_app(token_cache: SerializableTokenCache = None) -> ConfidentialClientApplication:
+    return ConfidentialClientApplication(
+        client_id=CLIENT_ID,
+        authority=AUTHORITY,
+        client_credential=CLIENT_SECRET,
+        token_cache=token_cache,
+        http_cache=_http_cache,
+        http_client=_http_client(),
+    )
+
+
+# The shared app for calls without a per-user cache. Built on first use:
+# constructing it runs authority discovery, which needs the network.
+_app = None
+_app_lock = threading.Lock()
+
+
+def get_msal_app() -> ConfidentialClientApplication:
+    global _app
+    if _app is None:
+        with _app_lock:
+            if _app is None:
+                _app = build_msal_app()
+    return _app
 
-app = ConfidentialClientApplication(
-    client_id=CLIENT_ID,
-    authority=AUTHORITY,
-    client_credential=CLIENT_SECRET,
-)
 
 def get_auth_url():
+    # offline_access is what gets us a refresh token; MSAL adds it itself on
+    # the token calls but the authorize URL is built by hand
+    scopes = SCOPES + [scope for scope in ["offline_access"] if scope not in SCOPES]
     params = {
         "client_id": CLIENT_ID,
         "response_type": "code",
         "redirect_uri": REDIRECT_URI,  
         "response_mode": "query",
-        "scope": "User.Read Calendars.ReadWrite offline_access",
+        "scope": " ".join(scopes),
         "prompt": "select_account"
         #  "prompt": "login",  # force login every time
         # "login_hint": "xyz@example.com",
     }
-    print("111111111111111",CLIENT_ID)
-    print("2222222222222222",CLIENT_SECRET)
-    return f"https://login.microsoftonline.com/common/oauth2/v2.0/authorize?{urlencode(params)}"
+    logger.debug("Building auth URL for client %s", CLIENT_ID)
+    return f"{AUTHORITY}/oauth2/v2.0/authorize?{urlencode(params)}"
 
-def get_token_by_auth_code(code: str):
-    result = app.acquire_token_by_authorization_code(
+def get_token_by_auth_code(code: str, token_cache: SerializableTokenCache = None):
+    client = build_msal_app(token_cache) if token_cache is not None else get_msal_app()
+    result = client.acquire_token_by_authorization_code(
         code,
         scopes=SCOPES,
         redirect_uri=REDIRECT_URI
     )
     if "access_token" not in result:
-        print("ERROR IN TOKEN RESPONSE:", result)  # 👈 Add this
+        logger.error("Error in token response: %s", result.get("error_description") or result.get("error"))
     return result
 
 
 
-def refresh_access_token(refresh_token: str):
+def refresh_access_token(refresh_token: str, token_cache: SerializableTokenCache = None):
     """
     Acquires a new access token using a refresh token.
     """
-    result = app.acquire_token_by_refresh_token(
+    client = build_msal_app(token_cache) if token_cache is not None else get_msal_app()
+    result = client.acquire_token_by_refresh_token(
         refresh_token=refresh_token,
         scopes=SCOPES
     )
     if "access_token" not in result:
-        print("ERROR REFRESHING TOKEN:", result)
-    return result
\ No newline at end of file
+        logger.error("Error refreshing token: %s", result.get("error_description") or result.get("error"))
+    return result
+
+
+def acquire_token_silent(email: str, token_cache: SerializableTokenCache, min_validity_seconds: int = 0):
+    """
+    Returns a token from the user's MSAL cache, redeeming the cached refresh
+    token only when the cached access token expires within
+    min_validity_seconds. None if the cache has no account for the user.
+    """
+    client = build_msal_app(token_cache)
+    accounts = client.get_accounts(username=email)
+    if not accounts:
+        return None
+    result = client.acquire_token_silent(SCOPES, account=accounts[0])
+    if result and result.get("expires_in", 0) <= min_validity_seconds:
+        result = client.acquire_token_silent(SCOPES, account=accounts[0], force_refresh=True)
+    return result
+
+
+# --- Non-blocking wrappers used by the API ---
+# MSAL's HTTP calls are synchronous, so they run on a dedicated, bounded
+# thread pool instead of the event loop or the default executor.
+_executor = ThreadPoolExecutor(max_workers=MSAL_MAX_WORKERS, thread_name_prefix="msal")
+_semaphore = asyncio.Semaphore(MSAL_MAX_CONCURRENCY)
+
+
+async def _run_msal(func, *args, **kwargs):
+    async with _semaphore:
+        loop = asyncio.get_running_loop()
+        started = time.perf_counter()
+        status = "ok"
+        try:
+            result = await asyncio.wait_for(
+                loop.run_in_executor(_executor, partial(func, *args, **kwargs)),
+                timeout=MSAL_TIMEOUT_SECONDS,
+            )
+            if isinstance(result, dict) and "error" in result:
+                status = "error"
+            return result
+        except asyncio.TimeoutError:
+            status = "timeout"
+            logger.warning("MSAL call %s timed out after %ss", func.__name__, MSAL_TIMEOUT_SECONDS)
+            # Same shape as an MSAL error so callers handle it the same way
+            return {"error": "timeout", "error_description": "Timed out waiting for Azure AD"}
+        finally:
+            observe(
+                "upstream_request_duration_seconds", time.perf_counter() - started,
+                upstream="azure_ad", route=func.__name__, status=status,
+            )
+
+
+async def get_token_by_auth_code_async(code: str, token_cache: SerializableTokenCache = None):
+    return await _run_msal(get_token_by_auth_code, code, token_cache)
+
+
+async def refresh_access_token_async(refresh_token: str, token_cache: SerializableTokenCache = None):
+    return await _run_msal(refresh_access_token, refresh_token, token_cache)
+
+
+async def acquire_token_silent_async(email: str, token_cache: SerializableTokenCache, min_validity_seconds: int = 0):
+    return await _run_msal(acquire_token_silent, email, token_cache, min_validity_seconds)
+
+
+async def warm_up() -> bool:
+    """
+    Builds the shared MSAL app off the event loop, so the first sign-in does
+    not wait for authority discovery. A failure is logged and the app is
+    built again on first use.
+    """
+    try:
+        await asyncio.get_running_loop().run_in_executor(_executor, get_msal_app)
+        return True
+    except Exception as exc:
+        logger.warning("MSAL warm-up failed, building on first use: %s", exc)
+        return False
+
+
+def shutdown_executor():
+    _executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,224 @@
+import asyncio
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.config import AVAILABILITY_CACHE_TTL_SECONDS, AVAILABILITY_WINDOW_DAYS, AVAILABILITY_CACHE_MAX_ENTRIES
+from app.event_store import event_store, event_bounds
+from app.graph_api import get_schedule
+from app.timezones import parse_graph_datetime
+
+# getSchedule statuses that do not block a slot
+FREE_STATUSES = {"free", "workingElsewhere"}
+
+
+class IntervalIndex:
+    """
+    Busy time as merged, sorted, non-overlapping intervals in two parallel
+    arrays of epoch seconds. Lookups are a bisect plus a short scan.
+    """
+
+    __slots__ = ("starts", "ends")
+
+    def __init__(self, intervals: Iterable[Tuple[float, float]] = ()):
+        self.starts: List[float] = []
+        self.ends: List[float] = []
+        for start, end in sorted(i for i in intervals if i[1] > i[0]):
+            if self.ends and start <= self.ends[-1]:
+                if end > self.ends[-1]:
+                    self.ends[-1] = end
+            else:
+                self.starts.append(start)
+                self.ends.append(end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    @classmethod
+    def union(cls, indexes: Iterable["IntervalIndex"]) -> "IntervalIndex":
+        return cls(pair for index in indexes for pair in zip(index.starts, index.ends))
+
+    def conflicts(self, start: float, end: float) -> List[Tuple[float, float]]:
+        found = []
+        j = bisect_right(self.ends, start)
+        while j < len(self.starts) and self.starts[j] < end:
+            found.append((self.starts[j], self.ends[j]))
+            j += 1
+        return found
+
+    def is_free(self, start: float, end: float) -> bool:
+        j = bisect_right(self.ends, start)
+        return j >= len(self.starts) or self.starts[j] >= end
+
+    def free_slots(self, start: float, end: float, duration: float, count: int) -> List[Tuple[float, float]]:
+        """
+        The first `count` free slots of `duration` seconds between start and end.
+        """
+        slots = []
+        cursor = start
+        j = bisect_right(self.ends, cursor)
+        while len(slots) < count and cursor + duration <= end:
+            if j < len(self.starts) and self.starts[j] <= cursor:
+                cursor = self.ends[j]
+                j += 1
+                continue
+            gap_end = min(self.starts[j], end) if j < len(self.starts) else end
+            while len(slots) < count and cursor + duration <= gap_end:
+                slots.append((cursor, cursor + duration))
+                cursor += duration
+            if j >= len(self.starts):
+                break
+            cursor = max(cursor, self.ends[j])
+            j += 1
+        return slots
+
+
+def _epoch(value: datetime) -> float:
+    return value.timestamp()
+
+
+def _from_epoch(value: float) -> str:
+    return datetime.fromtimestamp(value, timezone.utc).isoformat()
+
+
+def _utc_string(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S")
+
+
+def _unknown(indexes: Dict[str, Optional[IntervalIndex]]) -> List[str]:
+    return [attendee for attendee, index in indexes.items() if index is None]
+
+
+class AvailabilityService:
+    """
+    Caches one IntervalIndex per (organizer, attendee) for a window of
+    AVAILABILITY_WINDOW_DAYS. The organizer's own busy time comes from the
+    event store; other attendees come from one getSchedule call per miss.
+    An attendee whose schedule Graph could not read is unknown, not free,
+    and is asked for again next time.
+    """
+
+    def __init__(self, ttl_seconds: int = AVAILABILITY_CACHE_TTL_SECONDS, max_entries: int = AVAILABILITY_CACHE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        # (organizer, attendee) -> (index, window_start, window_end, fetched_at)
+        self._indexes: "OrderedDict[Tuple[str, str], tuple]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key, start: float, end: float):
+        entry = self._indexes.get(key)
+        if entry is None:
+            return None
+        index, window_start, window_end, fetched_at = entry
+        if time.monotonic() - fetched_at > self.ttl_seconds or start < window_start or end > window_end:
+            return None
+        self._indexes.move_to_end(key)
+        return index
+
+    def _store(self, key, index: IntervalIndex, window_start: float, window_end: float):
+        self._indexes[key] = (index, window_start, window_end, time.monotonic())
+        self._indexes.move_to_end(key)
+        while len(self._indexes) > self.max_entries:
+            self._indexes.popitem(last=False)
+
+    def invalidate(self, organizer: str, attendee: str = None):
+        """
+        Drops cached indexes for an organizer, or for one of their attendees.
+        """
+        if attendee is not None:
+            self._indexes.pop((organizer, attendee.lower()), None)
+            return
+        for key in [key for key in self._indexes if key[0] == organizer]:
+            del self._indexes[key]
+
+    def invalidate_mailbox(self, email: str):
+        """
+        Drops every cached index of `email`'s calendar, whoever the organizer.
+        """
+        email = email.lower()
+        for key in [key for key in self._indexes if key[1] == email]:
+            del self._indexes[key]
+
+    async def indexes(
+        self, organizer: str, access_token: str, attendees: List[str], start: datetime, end: datetime
+    ) -> Dict[str, Optional[IntervalIndex]]:
+        """
+        One index per attendee (lowercased), None for those whose schedule is unknown.
+        """
+        window_start = start
+        window_end = max(end, start + timedelta(days=AVAILABILITY_WINDOW_DAYS))
+        result, missing = {}, []
+        for attendee in dict.fromkeys(a.lower() for a in attendees):
+            index = self._cached((organizer, attendee), _epoch(start), _epoch(end))
+            if index is None:
+                self.misses += 1
+                missing.append(attendee)
+            else:
+                self.hits += 1
+                result[attendee] = index
+
+        if organizer.lower() in missing:
+            # The organizer's own calendar is already mirrored locally
+            missing.remove(organizer.lower())
+            await event_store.ensure_fresh(organizer, access_token, window_start, window_end)
+            busy = []
+            for event in event_store.list(organizer, window_start, window_end):
+                if event.get("isCancelled") or event.get("showAs", "busy") in FREE_STATUSES:
+                    continue
+                event_start, event_end = event_bounds(event)
+                busy.append((_epoch(event_start), _epoch(event_end)))
+            index = IntervalIndex(busy)
+            self._store((organizer, organizer.lower()), index, _epoch(window_start), _epoch(window_end))
+            result[organizer.lower()] = index
+
+        chunks = [missing[i:i + 20] for i in range(0, len(missing), 20)]
+        schedules = await asyncio.gather(*(
+            get_schedule(access_token, chunk, _utc_string(window_start), _utc_string(window_end)) for chunk in chunks
+        ))
+        for attendee in missing:
+            result[attendee] = None
+        for schedule in (item for chunk in schedules for item in chunk):
+            attendee = schedule["scheduleId"].lower()
+            if schedule.get("error"):
+                # e.g. a mailbox outside the tenant or one we may not read
+                result[attendee] = None
+                continue
+            index = IntervalIndex(
+                (
+                    _epoch(parse_graph_datetime(item["start"]["dateTime"], item["start"].get("timeZone", "UTC"))),
+                    _epoch(parse_graph_datetime(item["end"]["dateTime"], item["end"].get("timeZone", "UTC"))),
+                )
+                for item in schedule.get("scheduleItems", [])
+                if item.get("status") not in FREE_STATUSES
+            )
+            self._store((organizer, attendee), index, _epoch(window_start), _epoch(window_end))
+            result[attendee] = index
+        return result
+
+    async def check(self, organizer: str, access_token: str, attendees: List[str], start: datetime, end: datetime) -> dict:
+        indexes = await self.indexes(organizer, access_token, attendees, start, end)
+        conflicts = {}
+        for attendee, index in indexes.items():
+            found = index.conflicts(_epoch(start), _epoch(end)) if index is not None else []
+            if found:
+                conflicts[attendee] = [{"start": _from_epoch(s), "end": _from_epoch(e)} for s, e in found]
+        unknown = _unknown(indexes)
+        return {"free": not conflicts and not unknown, "conflicts": conflicts, "unknown": unknown}
+
+    async def find_slots(self, organizer: str, access_token: str, attendees: List[str], start: datetime, end: datetime, duration: timedelta, count: int) -> dict:
+        """
+        Slots free for every attendee whose schedule is known; the others are listed under "unknown".
+        """
+        indexes = await self.indexes(organizer, access_token, attendees, start, end)
+        combined = IntervalIndex.union(index for index in indexes.values() if index is not None)
+        slots = combined.free_slots(_epoch(start), _epoch(end), duration.total_seconds(), count)
+        return {"slots": [{"start": _from_epoch(s), "end": _from_epoch(e)} for s, e in slots], "unknown": _unknown(indexes)}
+
+    def stats(self) -> dict:
+        return {"entries": len(self._indexes), "hits": self.hits, "misses": self.misses}
+
+
+availability = AvailabilityService()
@@ -0,0 +1,57 @@
+from typing import Optional
+
+from sqlalchemy.types import Text, TypeDecorator
+
+from app.config import TOKEN_ENCRYPTION_KEYS
+
+# Marks encrypted values; rows written before encryption was enabled lack it
+PREFIX = "enc:"
+
+
+def _build_fernet(keys):
+    if not keys:
+        return None
+    try:
+        from cryptography.fernet import Fernet, MultiFernet
+    except ImportError as e:
+        raise RuntimeError("TOKEN_ENCRYPTION_KEYS is set but the `cryptography` package is not installed") from e
+    return MultiFernet([Fernet(key) for key in keys])
+
+
+_fernet = _build_fernet(TOKEN_ENCRYPTION_KEYS)
+
+
+def enabled() -> bool:
+    return _fernet is not None
+
+
+def encrypt(value: Optional[str]) -> Optional[str]:
+    if value is None or _fernet is None:
+        return value
+    return PREFIX + _fernet.encrypt(value.encode()).decode()
+
+
+def decrypt(value: Optional[str]) -> Optional[str]:
+    if value is None or not value.startswith(PREFIX):
+        return value
+    if _fernet is None:
+        raise RuntimeError("Found an encrypted token but TOKEN_ENCRYPTION_KEYS is not set")
+    return _fernet.decrypt(value[len(PREFIX):].encode()).decode()
+
+
+class EncryptedText(TypeDecorator):
+    """
+    Text column encrypted with the first TOKEN_ENCRYPTION_KEYS key. Reads
+    accept any configured key and plain text, so keys can be rotated and
+    encryption turned on without rewriting the table first; rewriting a row (see
+    app.token_store.reencrypt_tokens) moves it to the current key.
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return encrypt(value)
+
+    def process_result_value(self, value, dialect):
+        return decrypt(value)
@@ -1,10 +1,56 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime
-from sqlalchemy.orm import declarative_base, sessionmaker
-from app.config import DATABASE_URL  # Ensure this exists and is correct
+from sqlalchemy import Column, Integer, String, DateTime, Text, Index, UniqueConstraint
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base
+from app.crypto import EncryptedText
+from app.config import (  # Ensure this exists and is correct
+    DATABASE_URL,
+    ASYNC_DATABASE_URL,
+    DB_POOL_SIZE,
+    DB_MAX_OVERFLOW,
+    DB_POOL_PRE_PING,
+    DB_POOL_RECYCLE,
+    DB_ECHO,
+)
 
-# Step 1: Set up SQLAlchemy engine and session
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def _async_url(url: str) -> str:
+    """
+    Maps a sync SQLAlchemy URL (as used by Alembic) to its async driver.
+    """
+    if url.startswith("postgresql://") or url.startswith("postgresql+psycopg2://"):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url.split("://", 1)[1]
+    return url
+
+
+ASYNC_URL = ASYNC_DATABASE_URL or _async_url(DATABASE_URL)
+IS_SQLITE = ASYNC_URL.startswith("sqlite")
+
+# Step 1: Set up the async SQLAlchemy engine and session
+engine_options = {"echo": DB_ECHO, "pool_pre_ping": DB_POOL_PRE_PING}
+if not IS_SQLITE:
+    engine_options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_recycle=DB_POOL_RECYCLE)
+
+# Created on first use (or by init_db at startup) rather than at import, so
+# importing the models does not load the driver or build a pool
+_engine = None
+_session_factory = None
+
+
+def get_engine():
+    global _engine, _session_factory
+    if _engine is None:
+        _engine = create_async_engine(ASYNC_URL, **engine_options)
+        _session_factory = async_sessionmaker(
+            bind=_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False
+        )
+    return _engine
+
+
+def AsyncSessionLocal() -> AsyncSession:
+    get_engine()
+    return _session_factory()
 
 # Step 2: Define the Base class for ORM models
 Base = declarative_base()
@@ -15,28 +61,108 @@ class Token(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True, nullable=False)
-    access_token = Column(String, nullable=False)
-    refresh_token = Column(String, nullable=True)
+    # Azure AD tenant (tid) and user object id (oid) from the ID token
+    tenant_id = Column(String(64), nullable=True)
+    user_id = Column(String(64), nullable=True)
+    access_token = Column(EncryptedText, nullable=False)
+    refresh_token = Column(EncryptedText, nullable=True)
     expires_at = Column(DateTime, nullable=False)
+    # Preferred time zone for events without one, IANA or Windows name
+    time_zone = Column(String(64), nullable=True)
+
+    __table_args__ = (
+        # Keyset scans over expiring tokens, overall and per tenant
+        Index("ix_tokens_expires_at_id", "expires_at", "id"),
+        Index("ix_tokens_tenant_id_expires_at_id", "tenant_id", "expires_at", "id"),
+    )
+
+
+class MsalTokenCache(Base):
+    """
+    Serialized MSAL token cache, one partition per user.
+    """
+    __tablename__ = "msal_token_caches"
+
+    id = Column(Integer, primary_key=True, index=True)
+    email = Column(String, unique=True, index=True, nullable=False)
+    cache_blob = Column(EncryptedText, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+
+class OutboxJob(Base):
+    """
+    Event write accepted by the API and performed later by an outbox worker.
+    """
+    __tablename__ = "outbox_jobs"
+
+    id = Column(String(36), primary_key=True)
+    email = Column(String, index=True, nullable=False)
+    op = Column(String(16), nullable=False)  # create, update or delete
+    event_id = Column(String, nullable=True)
+    payload = Column(Text, nullable=True)  # Graph request body as JSON
+    status = Column(String(16), nullable=False, default="pending")  # pending, running, succeeded, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text, nullable=True)
+    result = Column(Text, nullable=True)  # Graph response body as JSON
+    next_attempt_at = Column(DateTime, nullable=False)
+    locked_until = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    updated_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (Index("ix_outbox_jobs_status_next_attempt_at", "status", "next_attempt_at"),)
+
+
+class IdempotencyKey(Base):
+    """
+    Response stored for an Idempotency-Key, replayed on client retries.
+    """
+    __tablename__ = "idempotency_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    email = Column(String, nullable=False)
+    key = Column(String(255), nullable=False)
+    request_hash = Column(String(64), nullable=False)
+    status_code = Column(Integer, nullable=False)
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+    expires_at = Column(DateTime, index=True, nullable=False)
+
+    __table_args__ = (UniqueConstraint("email", "key", name="uq_idempotency_keys_email_key"),)
+
+
+class GraphSubscription(Base):
+    """
+    Graph change-notification subscription on a user's events.
+    """
+    __tablename__ = "graph_subscriptions"
+
+    id = Column(String, primary_key=True)  # Graph subscription id
+    email = Column(String, index=True, nullable=False)
+    resource = Column(String, nullable=False)
+    client_state = Column(String(128), nullable=False)
+    expires_at = Column(DateTime, index=True, nullable=False)
+    created_at = Column(DateTime, nullable=False)
+
 
 # Optional: Dependency override for FastAPI (if using)
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
-
-# Step 4: Run table creation if script is run directly
-# def create_db_and_tables():
-#     print("Attempting to create database tables...")
-#     try:
-#         print("Model registered:", Token.__tablename__)
-#         print("Known tables before creation:", Base.metadata.tables.keys())
-#         Base.metadata.create_all(bind=engine)
-#         print("✅ Tables created successfully.")
-#     except Exception as e:
-#         print(f"❌ Error creating tables: {e}")
-
-# if __name__ == "__main__":
-#     create_db_and_tables()
+
+
+async def init_db():
+    """
+    Creates the engine, and the tables for local SQLite runs. Postgres is
+    managed by Alembic.
+    """
+    engine = get_engine()
+    if IS_SQLITE:
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+
+
+async def close_db():
+    global _engine, _session_factory
+    if _engine is not None:
+        await _engine.dispose()
+        _engine = _session_factory = None
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Dict, Iterable, NamedTuple, Optional
+from urllib.parse import quote
+
+from app.config import (
+    ATTENDEE_CACHE_MAX_ENTRIES,
+    ATTENDEE_CACHE_TTL_SECONDS,
+    ATTENDEE_DENIED_TTL_SECONDS,
+    ATTENDEE_NEGATIVE_TTL_SECONDS,
+)
+from app.graph_api import batch
+from app.throttling import token_identity
+
+logger = logging.getLogger(__name__)
+
+
+class DirectoryEntry(NamedTuple):
+    """
+    What the directory knows about an attendee address. `found` is None
+    when the lookup could not be made (no permission, Graph unavailable).
+    """
+    address: str
+    name: Optional[str]
+    found: Optional[bool]
+
+
+SOURCES = ("users", "people")
+# Statuses meaning the token lacks the scope; they will not change per address
+DENIED_STATUSES = (401, 403)
+
+
+def _lookup_request(source: str, address: str) -> dict:
+    if source == "users":
+        escaped = address.replace("'", "''")
+        user_filter = quote(f"mail eq '{escaped}' or userPrincipalName eq '{escaped}'")
+        return {"method": "GET", "url": f"/users?$filter={user_filter}&$select=displayName,mail,userPrincipalName&$top=1"}
+    search = quote(f'"{address}"')
+    return {"method": "GET", "url": f"/me/people?$search={search}&$select=displayName,scoredEmailAddresses&$top=5"}
+
+
+def _entry(address: str, responses: Dict[str, dict]) -> DirectoryEntry:
+    """
+    Reads the responses of the sources that were asked (source -> batch
+    response); a source that was not asked leaves "not found" open.
+    """
+    users, people = responses.get("users") or {}, responses.get("people") or {}
+    if users.get("status") == 200:
+        for user in (users.get("body") or {}).get("value") or []:
+            return DirectoryEntry(address, user.get("displayName") or address, True)
+    if people.get("status") == 200:
+        for person in (people.get("body") or {}).get("value") or []:
+            # $search is fuzzy; only an exact address match counts
+            addresses = {(item.get("address") or "").lower() for item in person.get("scoredEmailAddresses") or []}
+            if address in addresses:
+                return DirectoryEntry(address, person.get("displayName") or address, True)
+    if all((responses.get(source) or {}).get("status") in (200, 404) for source in SOURCES):
+        return DirectoryEntry(address, None, False)
+    return DirectoryEntry(address, None, None)
+
+
+class AttendeeResolver:
+    """
+    Looks attendee addresses up in the organizer's directory (/users) and
+    people list (/me/people), behind an LRU cache keyed by tenant and
+    address. Addresses that neither knows are cached for a shorter
+    negative TTL. A source Graph refuses for lack of a scope is skipped for
+    the tenant for `denied_ttl_seconds`, and what cannot be settled without
+    it is cached like a miss; other failed lookups are not cached. All
+    misses of a call go to Graph in one $batch, and concurrent calls
+    missing the same address share its lookup.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = ATTENDEE_CACHE_MAX_ENTRIES,
+        ttl_seconds: int = ATTENDEE_CACHE_TTL_SECONDS,
+        negative_ttl_seconds: int = ATTENDEE_NEGATIVE_TTL_SECONDS,
+        denied_ttl_seconds: int = ATTENDEE_DENIED_TTL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.negative_ttl = timedelta(seconds=negative_ttl_seconds)
+        self.denied_ttl_seconds = denied_ttl_seconds
+        self._denied: Dict[tuple, float] = {}  # (tenant, source) -> until, monotonic clock
+        self._entries = OrderedDict()  # (tenant, address) -> (DirectoryEntry, valid_until)
+        self._lock = Lock()
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.lookups = 0
+        self.lookup_errors = 0
+        self.evictions = 0
+        self.denials = 0
+
+    def _sources(self, tenant: str) -> list:
+        now = time.monotonic()
+        return [source for source in SOURCES if self._denied.get((tenant, source), 0.0) <= now]
+
+    def _get(self, key: tuple) -> Optional[DirectoryEntry]:
+        now = datetime.utcnow()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                return None
+            entry, valid_until = cached
+            if now >= valid_until:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            if entry.found:
+                self.hits += 1
+            else:
+                self.negative_hits += 1
+            return entry
+
+    def _set(self, key: tuple, entry: DirectoryEntry):
+        valid_until = datetime.utcnow() + (self.ttl if entry.found else self.negative_ttl)
+        with self._lock:
+            self._entries[key] = (entry, valid_until)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    async def _lookup(self, access_token: str, tenant: str, addresses: list, futures: Dict[tuple, asyncio.Future]):
+        self.lookups += 1
+        sources = self._sources(tenant)
+        entries = {address: DirectoryEntry(address, None, None) for address in addresses}
+        denied = len(sources) < len(SOURCES)
+        try:
+            requests = [_lookup_request(source, address) for address in addresses for source in sources]
+            responses = iter(await batch(access_token, requests))
+            by_address = {address: {source: next(responses) for source in sources} for address in addresses}
+            for source in sources:
+                if any(found[source].get("status") in DENIED_STATUSES for found in by_address.values()):
+                    logger.info("Graph refused %s lookups for tenant %s; skipping them for %ss", source, tenant, self.denied_ttl_seconds)
+                    self._denied[(tenant, source)] = time.monotonic() + self.denied_ttl_seconds
+                    self.denials += 1
+                    denied = True
+            for address in addresses:
+                entries[address] = _entry(address, by_address[address])
+        except Exception as e:
+            logger.warning("Attendee lookup failed: %s", e)
+            denied = False
+        finally:
+            # Also on cancellation, so that callers sharing the lookup are not left waiting
+            if any(entry.found is None for entry in entries.values()):
+                self.lookup_errors += 1
+            for address, entry in entries.items():
+                key = (tenant, address)
+                if entry.found is not None or denied:
+                    self._set(key, entry)
+                self._in_flight.pop(key, None)
+                futures[key].set_result(entry)
+
+    async def resolve(self, access_token: str, addresses: Iterable[str]) -> Dict[str, DirectoryEntry]:
+        """
+        Returns a DirectoryEntry per address (keyed as given), making at
+        most one $batch call for the addresses not cached.
+        """
+        _, tenant = token_identity(access_token)
+        addresses = list(dict.fromkeys(addresses))
+        keys = {address: (tenant, address.strip().lower()) for address in addresses}
+        if not self._sources(tenant):
+            return {address: DirectoryEntry(key[1], None, None) for address, key in keys.items()}
+        found: Dict[tuple, DirectoryEntry] = {}
+        waiting: Dict[tuple, asyncio.Future] = {}
+        missing: Dict[tuple, asyncio.Future] = {}
+        for key in dict.fromkeys(keys.values()):
+            entry = self._get(key)
+            if entry is not None:
+                found[key] = entry
+            elif key in self._in_flight:
+                waiting[key] = self._in_flight[key]
+            else:
+                self.misses += 1
+                missing[key] = self._in_flight[key] = asyncio.get_running_loop().create_future()
+        if missing:
+            await self._lookup(access_token, tenant, [key[1] for key in missing], missing)
+            found.update((key, future.result()) for key, future in missing.items())
+        for key, future in waiting.items():
+            found[key] = await asyncio.shield(future)
+        return {address: found[key] for address, key in keys.items()}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        return {
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": int(self.ttl.total_seconds()),
+            "negative_ttl_seconds": int(self.negative_ttl.total_seconds()),
+            "hits": self.hits,
+            "negative_hits": self.negative_hits,
+            "misses": self.misses,
+            "lookups": self.lookups,
+            "lookup_errors": self.lookup_errors,
+            "evictions": self.evictions,
+            "denials": self.denials,
+            "denied_sources": sorted(f"{tenant}:{source}" for (tenant, source), until in self._denied.items() if until > time.monotonic()),
+        }
+
+
+attendee_resolver = AttendeeResolver()
@@ -0,0 +1,141 @@
+import hashlib
+import json
+from collections import OrderedDict
+from threading import Lock
+from typing import Dict, Optional, Tuple
+
+from app.config import EVENT_VERSION_CACHE_MAX_ENTRIES, EVENT_VERSION_TTL_SECONDS
+from app.serialization import dumps
+from app import shared_state
+
+# Fields build_update_payload writes; each is replaced whole by a PATCH
+UPDATE_FIELDS = ("subject", "body", "start", "end", "recurrence")
+# Fields Graph validates against each other; one is never sent without the rest
+_LINKED = ("start", "end")
+
+
+def _digest(value) -> str:
+    # Stable across processes, unlike hash(), so records can be shared
+    return hashlib.blake2b(dumps(value), digest_size=16).hexdigest()
+
+
+def _field_hashes(payload: dict) -> Dict[str, str]:
+    return {name: _digest(payload[name]) for name in UPDATE_FIELDS if name in payload}
+
+
+class WrittenEvents:
+    """
+    What was last written to each event through this service: the
+    @odata.etag Graph returned and a digest per update field of the values
+    sent. Records live in an in-process LRU and, with distributed shared
+    state, in the shared store so that every worker sees them.
+
+    A record only describes the event while it still carries that etag,
+    which this service cannot see on its own (Outlook and other clients
+    edit events too). Updates are therefore only diffed when the client
+    sends If-Match with the recorded etag; Graph enforces that precondition
+    on the PATCH.
+    """
+
+    def __init__(self, max_entries: int = EVENT_VERSION_CACHE_MAX_ENTRIES, ttl_seconds: int = EVENT_VERSION_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # (email, event_id) -> (etag, {field: digest})
+        self._lock = Lock()
+        self.unchanged = 0
+        self.partial = 0
+        self.full = 0
+        self.fields_skipped = 0
+
+    def _remember_local(self, key: tuple, entry: tuple):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def _load(self, email: str, event_id: str) -> Optional[tuple]:
+        with self._lock:
+            entry = self._entries.get((email, event_id))
+        if entry is not None or not shared_state.state.distributed:
+            return entry
+        raw = await shared_state.state.get(f"event_version:{email}:{event_id}")
+        if raw is None:
+            return None
+        etag, hashes = json.loads(raw)
+        entry = (etag, hashes)
+        self._remember_local((email, event_id), entry)
+        return entry
+
+    async def remember(self, email: str, event: dict, payload: dict, partial: bool = False):
+        """
+        Records a successful create or PATCH: `event` is Graph's response,
+        `payload` what was sent. A `partial` payload only replaces the
+        fields it carries.
+        """
+        etag = event.get("@odata.etag")
+        if not etag or "id" not in event:
+            return
+        hashes = {}
+        if partial:
+            previous = await self._load(email, event["id"])
+            if previous is not None:
+                hashes.update(previous[1])
+        hashes.update(_field_hashes(payload))
+        entry = (etag, hashes)
+        self._remember_local((email, event["id"]), entry)
+        if shared_state.state.distributed:
+            await shared_state.state.set(f"event_version:{email}:{event['id']}", json.dumps(entry), self.ttl_seconds)
+
+    async def diff(self, email: str, event_id: str, payload: dict, if_match: str = None, current_etag: str = None) -> dict:
+        """
+        Returns what an update has to send: only the fields that differ
+        from the recorded write when the client's `if_match` is the
+        recorded etag (empty if nothing differs), otherwise the whole
+        payload. `current_etag`, e.g. from the event store, newer than
+        `if_match` means the event has moved on and nothing is skipped.
+        """
+        entry = None
+        if if_match is not None and current_etag in (None, if_match):
+            entry = await self._load(email, event_id)
+        if entry is None or entry[0] != if_match:
+            self.full += 1
+            return payload
+        hashes = entry[1]
+        changed = {name for name, value in payload.items() if hashes.get(name) != _digest(value)}
+        if changed & set(_LINKED):
+            changed.update(name for name in _LINKED if name in payload)
+        changes = {name: value for name, value in payload.items() if name in changed}
+        self.fields_skipped += len(payload) - len(changes)
+        if changes:
+            self.partial += 1
+        else:
+            self.unchanged += 1
+        return changes
+
+    async def forget(self, email: str, event_id: str):
+        with self._lock:
+            self._entries.pop((email, event_id), None)
+        if shared_state.state.distributed:
+            await shared_state.state.delete(f"event_version:{email}:{event_id}")
+
+    def forget_user(self, email: str):
+        # Shared records are left to expire; they only apply with a matching If-Match
+        with self._lock:
+            for key in [key for key in self._entries if key[0] == email]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        return {
+            "size": size,
+            "max_entries": self.max_entries,
+            "unchanged": self.unchanged,
+            "partial": self.partial,
+            "full": self.full,
+            "fields_skipped": self.fields_skipped,
+        }
+
+
+written_events = WrittenEvents()
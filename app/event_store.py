@@ -0,0 +1,182 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+from app.config import (
+    EVENT_SYNC_INTERVAL_SECONDS,
+    EVENT_SYNC_WINDOW_PAST_DAYS,
+    EVENT_SYNC_WINDOW_FUTURE_DAYS,
+    EVENT_STORE_MAX_USERS,
+)
+from app.graph_api import list_events_delta
+from app.recurrence import expand
+from app.timezones import event_bounds
+
+
+def _iso(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+class UserCalendar:
+    def __init__(self):
+        self.events: Dict[str, dict] = {}
+        # Series masters by id; calendarView only returns their instances
+        self.series: Dict[str, dict] = {}
+        self.delta_link: Optional[str] = None
+        self.window_start: Optional[datetime] = None
+        self.window_end: Optional[datetime] = None
+        self.synced_at = 0.0
+        self.lock = asyncio.Lock()
+
+    def covers(self, start: datetime, end: datetime) -> bool:
+        return self.window_start is not None and self.window_start <= start and end <= self.window_end
+
+
+class EventStore:
+    """
+    Per-user local copy of the calendar, kept current with calendarView/delta.
+
+    Reads are served from memory. A sync runs only when the copy is older
+    than EVENT_SYNC_INTERVAL_SECONDS and then transfers just the changes.
+    """
+
+    def __init__(self, max_users: int = EVENT_STORE_MAX_USERS, sync_interval: int = EVENT_SYNC_INTERVAL_SECONDS):
+        self.max_users = max_users
+        self.sync_interval = sync_interval
+        self._calendars: "OrderedDict[str, UserCalendar]" = OrderedDict()
+        self.full_syncs = 0
+        self.delta_syncs = 0
+        self.changes_applied = 0
+
+    def _calendar(self, email: str) -> UserCalendar:
+        calendar = self._calendars.get(email)
+        if calendar is None:
+            calendar = self._calendars[email] = UserCalendar()
+            while len(self._calendars) > self.max_users:
+                self._calendars.popitem(last=False)
+        self._calendars.move_to_end(email)
+        return calendar
+
+    async def sync(self, email: str, access_token: str, start: datetime = None, end: datetime = None):
+        """
+        Brings the user's store up to date. A requested range outside the
+        current window widens the window and forces a full sync.
+        """
+        calendar = self._calendar(email)
+        async with calendar.lock:
+            if start is not None and end is not None and not calendar.covers(start, end):
+                now = datetime.now(timezone.utc)
+                calendar.window_start = min(start, calendar.window_start or start, now - timedelta(days=EVENT_SYNC_WINDOW_PAST_DAYS))
+                calendar.window_end = max(end, calendar.window_end or end, now + timedelta(days=EVENT_SYNC_WINDOW_FUTURE_DAYS))
+                calendar.delta_link = None
+            elif calendar.window_start is None:
+                now = datetime.now(timezone.utc)
+                calendar.window_start = now - timedelta(days=EVENT_SYNC_WINDOW_PAST_DAYS)
+                calendar.window_end = now + timedelta(days=EVENT_SYNC_WINDOW_FUTURE_DAYS)
+
+            if calendar.delta_link:
+                try:
+                    changes, delta_link = await list_events_delta(access_token, delta_link=calendar.delta_link)
+                    self.delta_syncs += 1
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code != 410:
+                        raise
+                    # Delta token expired, start over
+                    calendar.delta_link = None
+
+            if not calendar.delta_link:
+                changes, delta_link = await list_events_delta(
+                    access_token, start=_iso(calendar.window_start), end=_iso(calendar.window_end)
+                )
+                calendar.events.clear()
+                calendar.series.clear()
+                self.full_syncs += 1
+
+            for change in changes:
+                if "@removed" in change:
+                    calendar.events.pop(change["id"], None)
+                    calendar.series.pop(change["id"], None)
+                else:
+                    calendar.events[change["id"]] = change
+                    if change.get("seriesMasterId"):
+                        # The series may have changed; fetch the master again when needed
+                        calendar.series.pop(change["seriesMasterId"], None)
+            self.changes_applied += len(changes)
+            calendar.delta_link = delta_link
+            calendar.synced_at = time.monotonic()
+
+    async def ensure_fresh(self, email: str, access_token: str, start: datetime = None, end: datetime = None, force: bool = False):
+        calendar = self._calendar(email)
+        stale = time.monotonic() - calendar.synced_at > self.sync_interval
+        if force or stale or calendar.delta_link is None or (
+            start is not None and end is not None and not calendar.covers(start, end)
+        ):
+            await self.sync(email, access_token, start, end)
+
+    def list(self, email: str, start: datetime = None, end: datetime = None) -> List[dict]:
+        calendar = self._calendar(email)
+        results = []
+        for event in calendar.events.values():
+            if start is not None or end is not None:
+                event_start, event_end = event_bounds(event)
+                if start is not None and event_end <= start:
+                    continue
+                if end is not None and event_start >= end:
+                    continue
+            results.append(event)
+        results.sort(key=lambda event: event_bounds(event)[0])
+        return results
+
+    def has(self, email: str) -> bool:
+        return email in self._calendars
+
+    def get(self, email: str, event_id: str) -> Optional[dict]:
+        calendar = self._calendars.get(email)
+        if calendar is None:
+            return None
+        return calendar.events.get(event_id) or calendar.series.get(event_id)
+
+    def upsert(self, email: str, event: dict):
+        calendar = self._calendars.get(email)
+        if calendar is None or not event.get("id"):
+            return
+        if event.get("type") == "seriesMaster":
+            calendar.series[event["id"]] = event
+        else:
+            calendar.events[event["id"]] = {**calendar.events.get(event["id"], {}), **event}
+
+    def occurrences(self, email: str, master: dict, start: datetime, end: datetime):
+        """
+        Lazily expands a series master over [start, end), using the synced
+        instances of the series for the part of the range the store covers.
+        """
+        calendar = self._calendar(email)
+        instances = [event for event in calendar.events.values() if event.get("seriesMasterId") == master.get("id")]
+        covered = (calendar.window_start, calendar.window_end) if calendar.delta_link else None
+        return expand(master, start, end, instances, covered)
+
+    def remove(self, email: str, event_id: str):
+        calendar = self._calendars.get(email)
+        if calendar is not None:
+            calendar.events.pop(event_id, None)
+            calendar.series.pop(event_id, None)
+
+    def forget(self, email: str):
+        self._calendars.pop(email, None)
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self._calendars),
+            "events": sum(len(calendar.events) for calendar in self._calendars.values()),
+            "series": sum(len(calendar.series) for calendar in self._calendars.values()),
+            "full_syncs": self.full_syncs,
+            "delta_syncs": self.delta_syncs,
+            "changes_applied": self.changes_applied,
+        }
+
+
+event_store = EventStore()
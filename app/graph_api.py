@@ -1,31 +1,455 @@
+import asyncio
+import importlib.util
+import time
+import uuid
+from typing import AsyncContextManager, AsyncIterator, Awaitable, Callable, List, Optional, Tuple
+
 import httpx
-from app.config import GRAPH_API_ENDPOINT
+from app.config import (
+    GRAPH_API_ENDPOINT,
+    GRAPH_MAX_CONNECTIONS,
+    GRAPH_MAX_KEEPALIVE_CONNECTIONS,
+    GRAPH_KEEPALIVE_EXPIRY,
+    GRAPH_HTTP2,
+    GRAPH_CONNECT_TIMEOUT,
+    GRAPH_POOL_TIMEOUT,
+    GRAPH_ROUTE_TIMEOUTS,
+    GRAPH_DEFAULT_TIMEOUT,
+    GRAPH_BATCH_SIZE,
+    GRAPH_BATCH_CONCURRENCY,
+    EVENT_SYNC_PAGE_SIZE,
+    GRAPH_MAX_RETRIES,
+)
+from app.throttling import (
+    CircuitOpenError,
+    breaker_for,
+    backoff_delay,
+    metrics as throttle_metrics,
+    parse_retry_after,
+    rate_limiter,
+    token_identity,
+)
+from app.scheduler import SchedulerFullError
+from app.serialization import dumps, loads, parse_graph_json
+from app.telemetry import observe, span
 
-async def create_event(access_token: str, event_data: dict):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    async with httpx.AsyncClient() as client:
-        response = await client.post(
-            f"{GRAPH_API_ENDPOINT}/me/events",
-            json=event_data,
-            headers=headers
+# Statuses Graph uses for throttling and transient failures
+RETRY_STATUSES = {429, 503, 504}
+# Errors raised before the request reached Graph, so retrying cannot duplicate a write
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+
+
+def _with_transaction_id(event_data: dict) -> dict:
+    """
+    A 503/504 can come after Graph created the event, so creates are only
+    retried with a transactionId, which makes Graph drop the second one.
+    Callers with their own (idempotency keys, outbox jobs, ICS UIDs) keep it.
+    """
+    if event_data.get("transactionId"):
+        return event_data
+    return {**event_data, "transactionId": str(uuid.uuid4())}
+
+
+class PreconditionFailedError(Exception):
+    """
+    Raised when Graph refuses a conditional write because the event has
+    changed since the etag it was given.
+    """
+
+    def __init__(self, event_id: str):
+        super().__init__(f"Event {event_id} has changed")
+        self.event_id = event_id
+
+
+# One pooled client for the whole process, opened/closed by the app lifespan
+_client: Optional[httpx.AsyncClient] = None
+_in_flight = 0
+_total_requests = 0
+
+
+def _route_timeout(route: str) -> httpx.Timeout:
+    read = GRAPH_ROUTE_TIMEOUTS.get(route, GRAPH_DEFAULT_TIMEOUT)
+    return httpx.Timeout(read, connect=GRAPH_CONNECT_TIMEOUT, pool=GRAPH_POOL_TIMEOUT)
+
+
+async def start_client() -> httpx.AsyncClient:
+    """
+    Creates the shared Graph client. HTTP/2 is only enabled when requested
+    and the optional `h2` package is installed.
+    """
+    global _client
+    if _client is None:
+        http2 = GRAPH_HTTP2 and importlib.util.find_spec("h2") is not None
+        _client = httpx.AsyncClient(
+            http2=http2,
+            limits=httpx.Limits(
+                max_connections=GRAPH_MAX_CONNECTIONS,
+                max_keepalive_connections=GRAPH_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=GRAPH_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(GRAPH_DEFAULT_TIMEOUT, connect=GRAPH_CONNECT_TIMEOUT, pool=GRAPH_POOL_TIMEOUT),
         )
-        return response.json()
+    return _client
 
-async def update_event(access_token: str, event_id: str, event_data: dict):
+
+async def close_client():
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def get_client() -> httpx.AsyncClient:
+    if _client is None:
+        raise RuntimeError("Graph client is not started. Call start_client() during app startup.")
+    return _client
+
+
+def pool_stats() -> dict:
+    """
+    Returns connection pool utilization for the shared Graph client.
+    """
+    stats = {
+        "started": _client is not None,
+        "max_connections": GRAPH_MAX_CONNECTIONS,
+        "max_keepalive_connections": GRAPH_MAX_KEEPALIVE_CONNECTIONS,
+        "in_flight_requests": _in_flight,
+        "total_requests": _total_requests,
+        "open_connections": 0,
+        "idle_connections": 0,
+        "http2_connections": 0,
+    }
+    # httpx does not expose pool state publicly, so read it from httpcore
+    pool = getattr(getattr(_client, "_transport", None), "_pool", None)
+    for conn in getattr(pool, "connections", []):
+        stats["open_connections"] += 1
+        if conn.is_idle():
+            stats["idle_connections"] += 1
+        if getattr(conn, "_connection", None) is not None and "HTTP2" in type(conn._connection).__name__:
+            stats["http2_connections"] += 1
+    if stats["max_connections"]:
+        stats["utilization"] = round((stats["open_connections"] - stats["idle_connections"]) / stats["max_connections"], 4)
+    return stats
+
+
+async def _send(route: str, method: str, url: str, headers: dict, **kwargs) -> httpx.Response:
+    global _in_flight, _total_requests
+    _in_flight += 1
+    _total_requests += 1
+    started = time.perf_counter()
+    status = "error"
+    try:
+        response = await get_client().request(method, url, headers=headers, timeout=_route_timeout(route), **kwargs)
+        status = str(response.status_code)
+        return response
+    finally:
+        _in_flight -= 1
+        observe("upstream_request_duration_seconds", time.perf_counter() - started, upstream="graph", route=route, status=status)
+
+
+async def _request(
+    route: str, method: str, url: str, access_token: str, extra_headers: dict = None, max_retries: int = None, **kwargs
+) -> httpx.Response:
+    """
+    Sends one Graph request through the rate limiter and the route's circuit
+    breaker. 429/503/504 and connection failures are retried with jittered
+    backoff, honoring Retry-After, up to `max_retries` (GRAPH_MAX_RETRIES by
+    default) times. Once retries run out, the last response is returned as-is.
+    """
+    if max_retries is None:
+        max_retries = GRAPH_MAX_RETRIES
     headers = {"Authorization": f"Bearer {access_token}"}
-    async with httpx.AsyncClient() as client:
-        response = await client.patch(
-            f"{GRAPH_API_ENDPOINT}/me/events/{event_id}",
-            json=event_data,
-            headers=headers
-        )
-        return response.json()
+    if extra_headers:
+        headers.update(extra_headers)
+    if "json" in kwargs:
+        # Encoded once with the fast encoder and reused across retries
+        kwargs["content"] = dumps(kwargs.pop("json"))
+        headers["Content-Type"] = "application/json"
+    user, tenant = token_identity(access_token)
+    breaker = breaker_for(route)
+
+    attempt = 0
+    while True:
+        try:
+            breaker.allow(route)
+        except CircuitOpenError:
+            throttle_metrics.circuit_rejections += 1
+            raise
+        try:
+            throttle_metrics.rate_limit_wait_seconds += await rate_limiter.acquire(user, tenant)
+            response = await _send(route, method, url, headers, **kwargs)
+        except RETRY_ERRORS:
+            breaker.record_failure()
+            if attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt)
+        except httpx.HTTPError:
+            breaker.record_failure()
+            raise
+        except BaseException:
+            # Cancelled (the client went away) or failed on our side; says
+            # nothing about Graph, but must not leave a trial open forever
+            breaker.abandon()
+            raise
+        else:
+            if response.status_code >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()
+            if response.status_code not in RETRY_STATUSES:
+                return response
+            throttle_metrics.record_throttle(route)
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if response.status_code == 429 and retry_after:
+                # Hold back this user's other requests too, not just this one
+                rate_limiter.throttled(user, retry_after)
+            if attempt >= max_retries:
+                return response
+            delay = retry_after if retry_after is not None else backoff_delay(attempt)
+
+        throttle_metrics.record_retry(route, delay)
+        await asyncio.sleep(delay)
+        attempt += 1
+
+
+async def create_event(access_token: str, event_data: dict):
+    response = await _request(
+        "create_event", "POST", f"{GRAPH_API_ENDPOINT}/me/events", access_token, json=_with_transaction_id(event_data)
+    )
+    with span("response_parse"):
+        return parse_graph_json(response.content)
+
+async def update_event(access_token: str, event_id: str, event_data: dict, etag: str = None):
+    """
+    PATCHes the event. With `etag` Graph only applies the change while the
+    event still has that etag; otherwise PreconditionFailedError.
+    """
+    response = await _request(
+        "update_event", "PATCH", f"{GRAPH_API_ENDPOINT}/me/events/{event_id}", access_token,
+        extra_headers={"If-Match": etag} if etag else None, json=event_data,
+    )
+    if response.status_code == 412:
+        raise PreconditionFailedError(event_id)
+    with span("response_parse"):
+        return parse_graph_json(response.content)
 
 async def delete_event(access_token: str, event_id: str):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    async with httpx.AsyncClient() as client:
-        response = await client.delete(
-            f"{GRAPH_API_ENDPOINT}/me/events/{event_id}",
-            headers=headers
+    response = await _request(
+        "delete_event", "DELETE", f"{GRAPH_API_ENDPOINT}/me/events/{event_id}", access_token
+    )
+    return response.status_code == 204
+
+
+async def get_event(access_token: str, event_id: str):
+    response = await _request(
+        "get_event", "GET", f"{GRAPH_API_ENDPOINT}/me/events/{event_id}", access_token
+    )
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return parse_graph_json(response.content)
+
+async def iter_events(
+    token_provider: Callable[[], Awaitable[str]], start: str = None, end: str = None
+) -> AsyncIterator[List[dict]]:
+    """
+    Yields the user's events one page at a time: calendarView instances
+    when start/end (ISO 8601, UTC) are given, otherwise /me/events (single
+    events and series masters). The token is fetched for every page, so a
+    long iteration keeps going across a refresh.
+    """
+    if start and end:
+        url, params = f"{GRAPH_API_ENDPOINT}/me/calendarView", {"startDateTime": start, "endDateTime": end}
+    else:
+        url, params = f"{GRAPH_API_ENDPOINT}/me/events", None
+    while url:
+        response = await _request(
+            "list_events", "GET", url, await token_provider(), params=params,
+            extra_headers={"Prefer": f"odata.maxpagesize={EVENT_SYNC_PAGE_SIZE}"},
+        )
+        response.raise_for_status()
+        page = loads(response.content)
+        yield page.get("value", [])
+        url, params = page.get("@odata.nextLink"), None
+
+async def list_events_delta(
+    access_token: str, start: str = None, end: str = None, delta_link: str = None
+) -> Tuple[List[dict], str]:
+    """
+    Pages through calendarView/delta and returns (changes, deltaLink).
+
+    Pass start/end (ISO 8601, UTC) for the initial sync, or the deltaLink of
+    the previous sync to fetch only what changed since. Removed events come
+    back with an "@removed" annotation. A 410 means the delta link expired
+    and a full sync is needed.
+    """
+    if delta_link:
+        url, params = delta_link, None
+    else:
+        url, params = f"{GRAPH_API_ENDPOINT}/me/calendarView/delta", {"startDateTime": start, "endDateTime": end}
+
+    changes = []
+    while True:
+        response = await _request(
+            "list_events", "GET", url, access_token, params=params,
+            extra_headers={"Prefer": f"odata.maxpagesize={EVENT_SYNC_PAGE_SIZE}"},
+        )
+        response.raise_for_status()
+        page = loads(response.content)
+        changes.extend(page.get("value", []))
+        if "@odata.nextLink" in page:
+            url, params = page["@odata.nextLink"], None
+            continue
+        return changes, page.get("@odata.deltaLink")
+
+
+async def get_schedule(access_token: str, schedules: List[str], start: str, end: str, interval: int = 30) -> List[dict]:
+    """
+    Free/busy for up to 20 mailboxes via calendar/getSchedule. Times are UTC.
+    """
+    response = await _request(
+        "get_schedule", "POST", f"{GRAPH_API_ENDPOINT}/me/calendar/getSchedule", access_token,
+        json={
+            "schedules": schedules,
+            "startTime": {"dateTime": start, "timeZone": "UTC"},
+            "endTime": {"dateTime": end, "timeZone": "UTC"},
+            "availabilityViewInterval": interval,
+        },
+        extra_headers={"Prefer": 'outlook.timezone="UTC"'},
+    )
+    response.raise_for_status()
+    return loads(response.content).get("value", [])
+
+
+async def create_subscription(
+    access_token: str, resource: str, notification_url: str, expiration: str, client_state: str
+) -> dict:
+    """
+    Subscribes to created/updated/deleted notifications on `resource`.
+    Lifecycle notifications go to the same URL.
+    """
+    response = await _request(
+        "subscriptions", "POST", f"{GRAPH_API_ENDPOINT}/subscriptions", access_token,
+        json={
+            "changeType": "created,updated,deleted",
+            "notificationUrl": notification_url,
+            "lifecycleNotificationUrl": notification_url,
+            "resource": resource,
+            "expirationDateTime": expiration,
+            "clientState": client_state,
+        },
+    )
+    response.raise_for_status()
+    return loads(response.content)
+
+
+async def renew_subscription(access_token: str, subscription_id: str, expiration: str) -> Optional[dict]:
+    """
+    Extends a subscription. Returns None when Graph no longer knows it.
+    """
+    response = await _request(
+        "subscriptions", "PATCH", f"{GRAPH_API_ENDPOINT}/subscriptions/{subscription_id}", access_token,
+        json={"expirationDateTime": expiration},
+    )
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+    return loads(response.content)
+
+
+async def delete_subscription(access_token: str, subscription_id: str) -> bool:
+    response = await _request(
+        "subscriptions", "DELETE", f"{GRAPH_API_ENDPOINT}/subscriptions/{subscription_id}", access_token
+    )
+    return response.status_code in (204, 404)
+
+
+async def _send_batch(access_token: str, chunk: List[dict]) -> List[dict]:
+    """
+    Sends one $batch without retrying it: batch() retries throttled
+    sub-requests itself, so a throttled or unreachable $batch is answered
+    per sub-request and retried there, within the same budget.
+    """
+    try:
+        response = await _request(
+            "batch", "POST", f"{GRAPH_API_ENDPOINT}/$batch", access_token, max_retries=0, json={"requests": chunk}
         )
-        return response.status_code == 204
+    except RETRY_ERRORS as e:
+        return [{"id": req["id"], "status": 503, "body": {"error": {"message": str(e)}}} for req in chunk]
+    except httpx.HTTPError as e:
+        return [{"id": req["id"], "status": 502, "body": {"error": {"message": str(e)}}} for req in chunk]
+    if response.status_code != 200:
+        body = loads(response.content) if response.headers.get("content-type", "").startswith("application/json") else None
+        headers = {"Retry-After": response.headers["Retry-After"]} if "Retry-After" in response.headers else {}
+        return [{"id": req["id"], "status": response.status_code, "headers": headers, "body": body} for req in chunk]
+    return loads(response.content).get("responses", [])
+
+
+async def batch(
+    access_token: str,
+    requests: List[dict],
+    slot: Callable[[int], AsyncContextManager] = None,
+    concurrency: int = GRAPH_BATCH_CONCURRENCY,
+) -> List[dict]:
+    """
+    Sends Graph sub-requests through JSON $batch, GRAPH_BATCH_SIZE per batch,
+    with at most `concurrency` batches in flight. Writes pass `slot`, called
+    with a batch's size, e.g. a write_scheduler slot: each batch is sent
+    inside its own, and a batch the scheduler turns away answers 429.
+
+    Each request is {"method", "url", "body"?} with a URL relative to the
+    Graph version root (e.g. "/me/events"). Returns one {"status", "headers",
+    "body"} response per request, in the same order.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    chunks = []
+    for start in range(0, len(requests), GRAPH_BATCH_SIZE):
+        chunk = []
+        for index, req in enumerate(requests[start:start + GRAPH_BATCH_SIZE], start):
+            sub_request = {"id": str(index), "method": req["method"], "url": req["url"]}
+            if req.get("body") is not None:
+                # Set once here, so resends of a create carry the same transactionId
+                is_create = req["method"] == "POST" and req["url"] == "/me/events"
+                sub_request["body"] = _with_transaction_id(req["body"]) if is_create else req["body"]
+                sub_request["headers"] = {"Content-Type": "application/json"}
+            chunk.append(sub_request)
+        chunks.append(chunk)
+
+    async def _run(chunk):
+        async with semaphore:
+            if slot is None:
+                return await _send_batch(access_token, chunk)
+            try:
+                async with slot(len(chunk)):
+                    return await _send_batch(access_token, chunk)
+            except SchedulerFullError as e:
+                error = {"error": {"code": "TooManyRequests", "message": str(e)}}
+                headers = {"Retry-After": str(e.retry_after)}
+                return [{"id": req["id"], "status": 429, "headers": headers, "body": error} for req in chunk]
+
+    responses = {}
+    for chunk_responses in await asyncio.gather(*(_run(chunk) for chunk in chunks)):
+        for item in chunk_responses:
+            responses[item["id"]] = item
+
+    # Sub-requests are throttled individually; resend just those
+    by_id = {sub_request["id"]: sub_request for chunk in chunks for sub_request in chunk}
+    for attempt in range(GRAPH_MAX_RETRIES):
+        throttled = [by_id[key] for key, item in responses.items() if item.get("status") in RETRY_STATUSES and key in by_id]
+        if not throttled:
+            break
+        delays = [parse_retry_after((responses[sub["id"]].get("headers") or {}).get("Retry-After")) for sub in throttled]
+        delay = max((d for d in delays if d is not None), default=backoff_delay(attempt))
+        throttle_metrics.record_throttle("batch")
+        throttle_metrics.record_retry("batch", delay)
+        await asyncio.sleep(delay)
+        retry_chunks = [throttled[i:i + GRAPH_BATCH_SIZE] for i in range(0, len(throttled), GRAPH_BATCH_SIZE)]
+        for chunk_responses in await asyncio.gather(*(_run(chunk) for chunk in retry_chunks)):
+            for item in chunk_responses:
+                responses[item["id"]] = item
+
+    results = []
+    for index in range(len(requests)):
+        item = responses.get(str(index), {"status": 502, "body": {"error": {"message": "Missing response in batch"}}})
+        results.append({"status": item.get("status"), "headers": item.get("headers", {}), "body": item.get("body")})
+    return results
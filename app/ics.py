@@ -0,0 +1,461 @@
+import asyncio
+import codecs
+import logging
+import re
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from app.config import ICS_IMPORT_CHUNK_SIZE, ICS_IMPORT_MAX_IN_FLIGHT, ICS_IMPORT_MAX_ERRORS, ICS_MAX_LINE_LENGTH
+from app.graph_api import batch
+from app.recurrence import WEEKDAYS
+from app.scheduler import write_scheduler
+from app.serialization import dumps
+from app.timezones import resolve_zone, validate_zone
+
+logger = logging.getLogger(__name__)
+
+# iCalendar day codes in WEEKDAYS order
+ICAL_DAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+# BYSETPOS / BYDAY ordinal <-> Graph recurrencePattern index
+ICAL_POSITIONS = {1: "first", 2: "second", 3: "third", 4: "fourth", -1: "last"}
+GRAPH_POSITIONS = {name: position for position, name in ICAL_POSITIONS.items()}
+
+_DURATION = re.compile(r"^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+
+# An iCalendar content line: name, then ;PARAM=value pairs, then :value
+Property = Tuple[str, Dict[str, str], str]
+
+
+class LineTooLongError(ValueError):
+    """
+    Raised when an upload has a line longer than ICS_MAX_LINE_LENGTH.
+    import_calendar attaches the summary of what was imported before it.
+    """
+
+    def __init__(self, limit: int):
+        super().__init__(f"iCalendar line longer than {limit} characters")
+        self.limit = limit
+        self.summary: Optional[dict] = None
+
+
+# --- Parsing ---
+
+async def _lines(chunks: AsyncIterable[bytes], max_length: int = ICS_MAX_LINE_LENGTH) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = ""
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        for line in lines:
+            line = line.rstrip("\r")
+            if len(line) > max_length:
+                raise LineTooLongError(max_length)
+            yield line
+        # The rest of a line still arriving; it may end in the \r of a CRLF
+        if len(buffer) > max_length + 1:
+            raise LineTooLongError(max_length)
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer.rstrip("\r")
+
+
+async def _unfolded_lines(chunks: AsyncIterable[bytes], max_length: int = ICS_MAX_LINE_LENGTH) -> AsyncIterator[str]:
+    """
+    Decodes an upload chunk by chunk and yields its logical (unfolded)
+    lines, none longer than `max_length`.
+    """
+    current = None
+    async for line in _lines(chunks, max_length):
+        if line[:1] in (" ", "\t") and current is not None:
+            current += line[1:]
+            if len(current) > max_length:
+                raise LineTooLongError(max_length)
+            continue
+        if current is not None:
+            yield current
+        current = line
+    if current is not None:
+        yield current
+
+
+def _split_property(line: str) -> Property:
+    in_quotes = False
+    for position, char in enumerate(line):
+        if char == '"':
+            in_quotes = not in_quotes
+        elif char == ":" and not in_quotes:
+            head, value = line[:position], line[position + 1:]
+            break
+    else:
+        head, value = line, ""
+    name, *params = head.split(";")
+    parameters = {}
+    for param in params:
+        key, _, param_value = param.partition("=")
+        parameters[key.upper()] = param_value.strip('"')
+    return name.upper(), parameters, value
+
+
+async def parse_events(chunks: AsyncIterable[bytes]) -> AsyncIterator[List[Property]]:
+    """
+    Yields the properties of each VEVENT in an iCalendar stream as soon as
+    its END:VEVENT arrives. Nested components (VALARM) are skipped.
+    """
+    event = None
+    depth = 0
+    async for line in _unfolded_lines(chunks):
+        if not line:
+            continue
+        name, params, value = _split_property(line)
+        if name == "BEGIN":
+            if value.upper() == "VEVENT" and event is None:
+                event, depth = [], 0
+            elif event is not None:
+                depth += 1
+        elif name == "END":
+            if event is None:
+                continue
+            if depth:
+                depth -= 1
+            elif value.upper() == "VEVENT":
+                yield event
+                event = None
+        elif event is not None and not depth:
+            event.append((name, params, value))
+
+
+def _unescape(value: str) -> str:
+    return re.sub(r"\\([\\;,nN])", lambda m: "\n" if m.group(1) in "nN" else m.group(1), value)
+
+
+def _parse_time(params: Dict[str, str], value: str, default_zone: str) -> Tuple[datetime, str, bool]:
+    """
+    Returns (wall time, time zone, all day) for a DTSTART/DTEND value.
+    """
+    if params.get("VALUE", "").upper() == "DATE" or len(value) == 8:
+        return datetime.strptime(value[:8], "%Y%m%d"), default_zone, True
+    if value.endswith("Z"):
+        return datetime.strptime(value[:15], "%Y%m%dT%H%M%S"), "UTC", False
+    time_zone = params.get("TZID") or default_zone
+    try:
+        validate_zone(time_zone)
+    except ValueError:
+        # A custom VTIMEZONE name; read it as the importer's zone
+        time_zone = default_zone
+    return datetime.strptime(value[:15], "%Y%m%dT%H%M%S"), time_zone, False
+
+
+def _parse_duration(value: str) -> timedelta:
+    match = _DURATION.match(value.strip())
+    if match is None:
+        raise ValueError(f"Invalid DURATION: {value}")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    duration = timedelta(
+        weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0), minutes=int(minutes or 0), seconds=int(seconds or 0)
+    )
+    return -duration if sign == "-" else duration
+
+
+def _by_day(value: str) -> Tuple[Optional[int], str]:
+    match = re.match(r"^([+-]?\d+)?([A-Z]{2})$", value.strip().upper())
+    if match is None or match.group(2) not in ICAL_DAYS:
+        raise ValueError(f"Invalid BYDAY: {value}")
+    return (int(match.group(1)) if match.group(1) else None), WEEKDAYS[ICAL_DAYS.index(match.group(2))]
+
+
+def rrule_to_recurrence(rrule: str, start: datetime, time_zone: str) -> dict:
+    """
+    Maps an RRULE to a Graph patternedRecurrence. Rules Graph cannot
+    express (BYHOUR, several BYMONTHDAY values, ...) raise ValueError.
+    """
+    parts = dict(part.split("=", 1) for part in rrule.upper().split(";") if "=" in part)
+    unsupported = set(parts) - {"FREQ", "INTERVAL", "COUNT", "UNTIL", "BYDAY", "BYMONTHDAY", "BYMONTH", "BYSETPOS", "WKST"}
+    if unsupported:
+        raise ValueError(f"Unsupported RRULE parts: {', '.join(sorted(unsupported))}")
+    frequency = parts.get("FREQ")
+    pattern = {"interval": int(parts.get("INTERVAL", "1"))}
+    days = [_by_day(day) for day in parts["BYDAY"].split(",")] if "BYDAY" in parts else []
+    position = int(parts["BYSETPOS"]) if "BYSETPOS" in parts else next((n for n, _ in days if n is not None), None)
+    if "BYMONTHDAY" in parts and "," in parts["BYMONTHDAY"]:
+        raise ValueError("Only one BYMONTHDAY value is supported")
+
+    if frequency == "DAILY":
+        pattern["type"] = "daily"
+    elif frequency == "WEEKLY":
+        pattern["type"] = "weekly"
+        pattern["daysOfWeek"] = [day for _, day in days] or [WEEKDAYS[start.weekday()]]
+        if "WKST" in parts:
+            pattern["firstDayOfWeek"] = WEEKDAYS[ICAL_DAYS.index(parts["WKST"])]
+    elif frequency in ("MONTHLY", "YEARLY"):
+        yearly = frequency == "YEARLY"
+        if yearly:
+            pattern["month"] = int(parts.get("BYMONTH", start.month))
+        if days:
+            if position not in ICAL_POSITIONS:
+                raise ValueError(f"Unsupported BYDAY/BYSETPOS position: {position}")
+            pattern["type"] = "relativeYearly" if yearly else "relativeMonthly"
+            pattern["daysOfWeek"] = [day for _, day in days]
+            pattern["index"] = ICAL_POSITIONS[position]
+        else:
+            pattern["type"] = "absoluteYearly" if yearly else "absoluteMonthly"
+            pattern["dayOfMonth"] = int(parts.get("BYMONTHDAY", start.day))
+    else:
+        raise ValueError(f"Unsupported RRULE FREQ: {frequency}")
+
+    range_ = {"startDate": start.date().isoformat(), "recurrenceTimeZone": time_zone}
+    if "COUNT" in parts:
+        range_.update(type="numbered", numberOfOccurrences=int(parts["COUNT"]))
+    elif "UNTIL" in parts:
+        range_.update(type="endDate", endDate=datetime.strptime(parts["UNTIL"][:8], "%Y%m%d").date().isoformat())
+    else:
+        range_["type"] = "noEnd"
+    return {"pattern": pattern, "range": range_}
+
+
+def to_graph_payload(properties: List[Property], default_zone: str, namespace: str) -> dict:
+    """
+    Graph event body for a VEVENT. The UID becomes the transactionId, so
+    importing the same file twice does not duplicate events.
+    """
+    values = {}
+    attendees = []
+    for name, params, value in properties:
+        if name == "ATTENDEE":
+            address = value[7:] if value.lower().startswith("mailto:") else value
+            attendees.append({
+                "emailAddress": {"address": address, "name": params.get("CN", address)},
+                "type": "optional" if params.get("ROLE", "").upper() == "OPT-PARTICIPANT" else "required",
+            })
+        else:
+            values.setdefault(name, (params, value))
+    if "RECURRENCE-ID" in values:
+        raise ValueError("Modified occurrences (RECURRENCE-ID) cannot be imported on their own")
+    if "DTSTART" not in values:
+        raise ValueError("VEVENT has no DTSTART")
+
+    start, time_zone, all_day = _parse_time(*values["DTSTART"], default_zone)
+    if "DTEND" in values:
+        end, end_zone, _ = _parse_time(*values["DTEND"], default_zone)
+    else:
+        end_zone = time_zone
+        duration = _parse_duration(values["DURATION"][1]) if "DURATION" in values else timedelta(days=1 if all_day else 0)
+        end = start + duration
+    if end_zone != time_zone:
+        end = end.replace(tzinfo=resolve_zone(end_zone)).astimezone(resolve_zone(time_zone)).replace(tzinfo=None)
+
+    payload = {
+        "subject": _unescape(values.get("SUMMARY", ({}, ""))[1]),
+        "body": {"contentType": "text", "content": _unescape(values.get("DESCRIPTION", ({}, ""))[1])},
+        "start": {"dateTime": start.isoformat(), "timeZone": time_zone},
+        "end": {"dateTime": end.isoformat(), "timeZone": time_zone},
+        "isAllDay": all_day,
+        "attendees": attendees,
+    }
+    if "LOCATION" in values:
+        payload["location"] = {"displayName": _unescape(values["LOCATION"][1])}
+    if "RRULE" in values:
+        payload["recurrence"] = rrule_to_recurrence(values["RRULE"][1], start, time_zone)
+    if "UID" in values:
+        payload["transactionId"] = str(uuid.uuid5(uuid.NAMESPACE_URL, f"ics:{namespace}:{values['UID'][1]}"))
+    return payload
+
+
+# --- Writing ---
+
+CALENDAR_HEADER = "BEGIN:VCALENDAR\r\nVERSION:2.0\r\nPRODID:-//ms-calendar-app//EN\r\nCALSCALE:GREGORIAN\r\n"
+CALENDAR_FOOTER = "END:VCALENDAR\r\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,").replace("\r\n", "\\n").replace("\n", "\\n")
+
+
+def _fold(line: str) -> str:
+    """
+    Splits a content line into 75-octet pieces, as RFC 5545 requires.
+    """
+    encoded = line.encode()
+    if len(encoded) <= 75:
+        return line + "\r\n"
+    pieces = []
+    limit = 75
+    while encoded:
+        cut = min(limit, len(encoded))
+        # Do not split a UTF-8 sequence
+        while cut < len(encoded) and (encoded[cut] & 0xC0) == 0x80:
+            cut -= 1
+        pieces.append(encoded[:cut].decode())
+        encoded = encoded[cut:]
+        limit = 74
+    return "\r\n ".join(pieces) + "\r\n"
+
+
+def _format_time(name: str, value: dict, all_day: bool) -> str:
+    moment = datetime.fromisoformat(value["dateTime"][:19])
+    if all_day:
+        return f"{name};VALUE=DATE:{moment:%Y%m%d}"
+    time_zone = value.get("timeZone") or "UTC"
+    if time_zone.upper() in ("UTC", "ETC/UTC"):
+        return f"{name}:{moment:%Y%m%dT%H%M%S}Z"
+    return f"{name};TZID={time_zone}:{moment:%Y%m%dT%H%M%S}"
+
+
+def recurrence_to_rrule(recurrence: dict) -> str:
+    pattern, range_ = recurrence.get("pattern") or {}, recurrence.get("range") or {}
+    kind = pattern.get("type", "daily")
+    frequency = {"daily": "DAILY", "weekly": "WEEKLY"}.get(kind) or ("YEARLY" if kind.endswith("Yearly") else "MONTHLY")
+    parts = [f"FREQ={frequency}", f"INTERVAL={pattern.get('interval') or 1}"]
+    days = [ICAL_DAYS[WEEKDAYS.index(day.lower())] for day in pattern.get("daysOfWeek") or []]
+    if kind.endswith("Yearly"):
+        parts.append(f"BYMONTH={pattern.get('month')}")
+    if kind in ("absoluteMonthly", "absoluteYearly"):
+        parts.append(f"BYMONTHDAY={pattern.get('dayOfMonth')}")
+    elif days:
+        parts.append(f"BYDAY={','.join(days)}")
+        if kind.startswith("relative"):
+            parts.append(f"BYSETPOS={GRAPH_POSITIONS.get((pattern.get('index') or 'first').lower(), 1)}")
+    if pattern.get("firstDayOfWeek"):
+        parts.append(f"WKST={ICAL_DAYS[WEEKDAYS.index(pattern['firstDayOfWeek'].lower())]}")
+    if range_.get("type") == "numbered":
+        parts.append(f"COUNT={range_.get('numberOfOccurrences')}")
+    elif range_.get("type") == "endDate" and range_.get("endDate"):
+        parts.append(f"UNTIL={range_['endDate'].replace('-', '')}T235959Z")
+    return ";".join(parts)
+
+
+def to_vevent(event: dict, stamp: str) -> str:
+    all_day = bool(event.get("isAllDay"))
+    lines = [
+        "BEGIN:VEVENT",
+        f"UID:{event.get('iCalUId') or event.get('id')}",
+        f"DTSTAMP:{stamp}",
+        _format_time("DTSTART", event["start"], all_day),
+        _format_time("DTEND", event["end"], all_day),
+        f"SUMMARY:{_escape(event.get('subject') or '')}",
+    ]
+    description = event.get("bodyPreview")
+    if description:
+        lines.append(f"DESCRIPTION:{_escape(description)}")
+    location = (event.get("location") or {}).get("displayName")
+    if location:
+        lines.append(f"LOCATION:{_escape(location)}")
+    if event.get("recurrence"):
+        lines.append(f"RRULE:{recurrence_to_rrule(event['recurrence'])}")
+    for attendee in event.get("attendees") or []:
+        address = (attendee.get("emailAddress") or {}).get("address")
+        if address:
+            # Parameter values cannot contain double quotes
+            name = ((attendee.get("emailAddress") or {}).get("name") or address).replace('"', "'")
+            role = "OPT-PARTICIPANT" if attendee.get("type") == "optional" else "REQ-PARTICIPANT"
+            lines.append(f'ATTENDEE;CN="{name}";ROLE={role}:mailto:{address}')
+    lines.append("END:VEVENT")
+    return "".join(_fold(line) for line in lines)
+
+
+def ics_chunk(events: Iterable[dict]) -> bytes:
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    return "".join(to_vevent(event, stamp) for event in events).encode()
+
+
+# --- Import and export ---
+
+def _graph_error(response: dict) -> str:
+    body = response.get("body")
+    if isinstance(body, dict) and isinstance(body.get("error"), dict):
+        return f"{response.get('status')}: {body['error'].get('message') or body['error'].get('code')}"
+    return f"Graph returned {response.get('status')}"
+
+
+async def import_calendar(
+    email: str,
+    chunks: AsyncIterable[bytes],
+    default_zone: str,
+    token_provider: Callable[[str], Awaitable[str]],
+    on_created: Callable[[dict], None] = None,
+) -> dict:
+    """
+    Creates the events of an iCalendar upload while it is still arriving.
+    Events go out ICS_IMPORT_CHUNK_SIZE at a time through $batch; with
+    ICS_IMPORT_MAX_IN_FLIGHT chunks pending, reading the upload waits, so
+    memory stays bounded whatever the file size.
+    """
+    summary = {"events": 0, "imported": 0, "failed": 0, "errors": []}
+    slots = asyncio.Semaphore(ICS_IMPORT_MAX_IN_FLIGHT)
+    pending = set()
+
+    def _fail(position: int, uid: Optional[str], message: str):
+        summary["failed"] += 1
+        if len(summary["errors"]) < ICS_IMPORT_MAX_ERRORS:
+            summary["errors"].append({"event": position, "uid": uid, "error": message})
+
+    async def _send(items):
+        try:
+            token = await token_provider(email)
+            responses = await batch(
+                token,
+                [{"method": "POST", "url": "/me/events", "body": payload} for _, _, payload in items],
+                # Waits its turn behind other users' writes instead of failing
+                slot=lambda cost: write_scheduler.slot(email, cost=cost, wait=True),
+            )
+        except Exception as e:
+            logger.warning("ICS import batch for %s failed: %s", email, e)
+            for position, uid, _ in items:
+                _fail(position, uid, str(e))
+            return
+        finally:
+            slots.release()
+        for (position, uid, _), response in zip(items, responses):
+            if response["status"] in (200, 201):
+                summary["imported"] += 1
+                if on_created is not None:
+                    on_created(response["body"])
+            else:
+                _fail(position, uid, _graph_error(response))
+
+    async def _flush(items):
+        await slots.acquire()
+        task = asyncio.ensure_future(_send(items))
+        pending.add(task)
+        task.add_done_callback(pending.discard)
+
+    items = []
+    try:
+        async for properties in parse_events(chunks):
+            summary["events"] += 1
+            uid = next((value for name, _, value in properties if name == "UID"), None)
+            try:
+                items.append((summary["events"], uid, to_graph_payload(properties, default_zone, email)))
+            except ValueError as e:
+                _fail(summary["events"], uid, str(e))
+                continue
+            if len(items) >= ICS_IMPORT_CHUNK_SIZE:
+                await _flush(items)
+                items = []
+        if items:
+            await _flush(items)
+    except LineTooLongError as e:
+        # Filled in by the chunks still in flight before it propagates
+        e.summary = summary
+        raise
+    finally:
+        await asyncio.gather(*pending, return_exceptions=True)
+    return summary
+
+
+async def export_calendar(pages: AsyncIterator[List[dict]], format: str) -> AsyncIterator[bytes]:
+    """
+    Streams pages of Graph events as iCalendar or NDJSON, one page in
+    memory at a time.
+    """
+    if format == "ics":
+        yield CALENDAR_HEADER.encode()
+    try:
+        async for page in pages:
+            yield ics_chunk(page) if format == "ics" else b"".join(dumps(event) + b"\n" for event in page)
+    except Exception as e:
+        # Headers are gone already; the client sees a truncated file
+        logger.error("Calendar export failed mid-stream: %s", e)
+        raise
+    if format == "ics":
+        yield CALENDAR_FOOTER.encode()
@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import json
+import logging
+import uuid
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Awaitable, Callable, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import IDEMPOTENCY_TTL_SECONDS, IDEMPOTENCY_CACHE_MAX_ENTRIES, IDEMPOTENCY_LOCK_SECONDS
+from app.db import IdempotencyKey
+from app import shared_state
+
+logger = logging.getLogger(__name__)
+
+MAX_KEY_LENGTH = 255
+# How often a request waits to see whether another worker finished the same key
+PEER_POLL_SECONDS = 0.2
+
+
+def request_fingerprint(*parts) -> str:
+    """
+    Stable hash of the parts of a request that decide its outcome.
+    """
+    canonical = json.dumps(parts, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+def transaction_id(email: str, key: str) -> str:
+    """
+    Graph transactionId for a keyed create. Graph ignores a second create
+    with the same transactionId, which covers retries that race the first
+    request or land on another process.
+    """
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"idempotency:{email}:{key}"))
+
+
+class IdempotencyStore:
+    """
+    Remembers the response to each (email, Idempotency-Key) for the TTL,
+    in an LRU in front of the shared state and the idempotency_keys table.
+    Concurrent requests with the same key wait for the first one, in this
+    process through a future and across workers through a shared lock.
+    """
+
+    purge_every = 1000
+
+    def __init__(self, max_entries: int = IDEMPOTENCY_CACHE_MAX_ENTRIES, ttl_seconds: int = IDEMPOTENCY_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self._entries = OrderedDict()  # (email, key) -> (request_hash, status_code, body, expires_at)
+        self._lock = Lock()
+        self._in_flight = {}
+        self._saves = 0
+        self.replays = 0
+        self.misses = 0
+        self.mismatches = 0
+
+    def _cached(self, cache_key, now: datetime):
+        with self._lock:
+            entry = self._entries.get(cache_key)
+            if entry is None:
+                return None
+            if now >= entry[3]:
+                del self._entries[cache_key]
+                return None
+            self._entries.move_to_end(cache_key)
+            return entry
+
+    def _remember(self, cache_key, entry):
+        with self._lock:
+            self._entries[cache_key] = entry
+            self._entries.move_to_end(cache_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    async def _load(self, db: AsyncSession, email: str, key: str, now: datetime):
+        row = (await db.execute(
+            select(IdempotencyKey.request_hash, IdempotencyKey.status_code, IdempotencyKey.response, IdempotencyKey.expires_at)
+            .where(IdempotencyKey.email == email, IdempotencyKey.key == key, IdempotencyKey.expires_at > now)
+        )).first()
+        # Do not hold the pooled connection across the Graph call
+        await db.rollback()
+        if row is None:
+            return None
+        entry = (row.request_hash, row.status_code, json.loads(row.response), row.expires_at)
+        self._remember((email, key), entry)
+        return entry
+
+    async def _load_shared(self, email: str, key: str, now: datetime):
+        if not shared_state.state.distributed:
+            return None
+        raw = await shared_state.state.get(f"idempotency:{email}:{key}")
+        if raw is None:
+            return None
+        request_hash, status_code, body, expires_at = json.loads(raw)
+        entry = (request_hash, status_code, body, datetime.fromisoformat(expires_at))
+        if now >= entry[3]:
+            return None
+        self._remember((email, key), entry)
+        return entry
+
+    async def _find(self, db: AsyncSession, email: str, key: str):
+        now = datetime.utcnow()
+        return (
+            self._cached((email, key), now)
+            or await self._load_shared(email, key, now)
+            or await self._load(db, email, key, now)
+        )
+
+    async def _save(self, db: AsyncSession, email: str, key: str, entry):
+        request_hash, status_code, body, expires_at = entry
+        now = datetime.utcnow()
+        if shared_state.state.distributed:
+            await shared_state.state.set(
+                f"idempotency:{email}:{key}",
+                json.dumps([request_hash, status_code, body, expires_at.isoformat()]),
+                (expires_at - now).total_seconds(),
+            )
+        self._saves += 1
+        try:
+            # An expired record for the same key would trip the unique constraint
+            expired = IdempotencyKey.expires_at <= now
+            if self._saves % self.purge_every != 0:
+                expired = expired & (IdempotencyKey.email == email) & (IdempotencyKey.key == key)
+            await db.execute(delete(IdempotencyKey).where(expired))
+            db.add(IdempotencyKey(
+                email=email,
+                key=key,
+                request_hash=request_hash,
+                status_code=status_code,
+                response=json.dumps(body),
+                created_at=now,
+                expires_at=expires_at,
+            ))
+            await db.commit()
+        except IntegrityError:
+            # Another process stored the same key first; Graph deduplicated the create
+            await db.rollback()
+            logger.info("Idempotency key for %s was stored concurrently", email)
+
+    async def run(
+        self,
+        db: AsyncSession,
+        email: str,
+        key: str,
+        request_hash: str,
+        call: Callable[[], Awaitable[Tuple[int, dict, bool]]],
+    ) -> Tuple[int, dict, bool]:
+        """
+        Returns (status_code, body, replayed). `call` performs the request
+        and returns (status_code, body, store); only results with store set
+        are remembered, so failed attempts can be retried with the same key.
+        """
+        if len(key) > MAX_KEY_LENGTH:
+            raise HTTPException(status_code=400, detail=f"Idempotency-Key must be at most {MAX_KEY_LENGTH} characters")
+        cache_key = (email, key)
+        lock_name = f"idempotency:{email}:{key}"
+        lock = None
+        deadline = None
+        while True:
+            entry = await self._find(db, email, key)
+            if entry is not None:
+                if entry[0] != request_hash:
+                    self.mismatches += 1
+                    raise HTTPException(status_code=422, detail="Idempotency-Key was already used with a different request")
+                self.replays += 1
+                return entry[1], entry[2], True
+            pending = self._in_flight.get(cache_key)
+            if pending is not None:
+                await asyncio.shield(pending)
+                continue
+            # Another worker may be running the same key; wait for its result
+            lock = await shared_state.acquire_lock(lock_name, IDEMPOTENCY_LOCK_SECONDS)
+            if lock is not None:
+                break
+            deadline = deadline or asyncio.get_running_loop().time() + IDEMPOTENCY_LOCK_SECONDS
+            if asyncio.get_running_loop().time() >= deadline:
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is still in progress")
+            await asyncio.sleep(PEER_POLL_SECONDS)
+
+        self.misses += 1
+        done = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = done
+        try:
+            status_code, body, store = await call()
+            if store:
+                entry = (request_hash, status_code, body, datetime.utcnow() + self.ttl)
+                self._remember(cache_key, entry)
+                await self._save(db, email, key, entry)
+            return status_code, body, False
+        finally:
+            del self._in_flight[cache_key]
+            done.set_result(None)
+            await shared_state.release_lock(lock_name, lock)
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        return {
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl_seconds": int(self.ttl.total_seconds()),
+            "in_flight": len(self._in_flight),
+            "replays": self.replays,
+            "misses": self.misses,
+            "mismatches": self.mismatches,
+        }
+
+
+idempotency = IdempotencyStore()
@@ -1,38 +1,243 @@
-from datetime import datetime, timedelta
 import time
+
+_import_started = time.perf_counter()
+
+from contextlib import asynccontextmanager, contextmanager
+from datetime import datetime, timedelta, timezone
+import asyncio
+import logging
+from itertools import islice
 from fastapi import FastAPI, Header, Request, HTTPException, Depends, Query
-from fastapi.responses import JSONResponse, RedirectResponse
-from app.auth import get_auth_url, get_token_by_auth_code, refresh_access_token
-from app.graph_api import create_event, update_event, delete_event
-from app.models import EventRequest
-from typing import Optional
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse, Response, StreamingResponse
+from app.auth import get_auth_url, get_token_by_auth_code_async, shutdown_executor, warm_up as warm_up_msal
+from app.msal_cache import save_cache, delete_cache
+from msal import SerializableTokenCache
+from app.graph_api import PreconditionFailedError, create_event, update_event, delete_event, get_event, iter_events, batch, start_client, close_client, pool_stats
+from app.models import EventRequest, EventBatchRequest, AvailabilityRequest, FreeSlotsRequest, TimeZoneRequest
+from app.payloads import build_event_payload, build_update_payload
+from typing import Dict, List, Literal, Optional
 
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from app.db import Token
-from app.db import get_db
-from app.services import get_email_from_id_token
+from app.db import AsyncSessionLocal, get_db, init_db, close_db
+from app.outbox import enqueue, get_job, job_status, outbox
+from app.idempotency import idempotency, request_fingerprint, transaction_id
+from app.subscriptions import subscription_info, subscriptions
+from app.serialization import json_response
+from app.ics import LineTooLongError, export_calendar, import_calendar
+from app.services import get_email_from_id_token, get_ids_from_id_token
+from app.token_cache import forget_token, lookup_token, remember_token, token_cache
+from app import shared_state
+from app.token_refresh import TokenRefreshScheduler, refresh_user_token, schedule_refresh
+from app.config import EXPIRATION_BUFFER_SECONDS, DEFAULT_TIME_ZONE, TELEMETRY_ENABLED, ATTENDEE_RESOLUTION_ENABLED, get_settings
+from app.logging_config import setup_logging
+from app.telemetry import TelemetryMiddleware, render_prometheus, span
+from app.availability import availability
+from app.directory import attendee_resolver
+from app.throttling import CircuitOpenError, stats as throttling_stats
+from app.scheduler import SchedulerFullError, write_scheduler
+from app.event_store import event_store
+from app.event_diff import written_events
+from app.timezones import parse_query_datetime, parse_graph_datetime, validate_zone
+import httpx
+
+setup_logging()
+logger = logging.getLogger(__name__)
+
+# Where startup time goes, in milliseconds: importing this module, each
+# lifespan step, and the total until the app serves requests
+startup_report = {"import_ms": round((time.perf_counter() - _import_started) * 1000, 1), "steps": {}}
+
+
+@contextmanager
+def _startup_step(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_report["steps"][name] = round((time.perf_counter() - started) * 1000, 1)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    started = time.perf_counter()
+    settings = get_settings()
+    startup_report["steps"] = {}
+    with _startup_step("shared_state"):
+        await shared_state.start()
+    with _startup_step("database"):
+        await init_db()
+    # Keep one warm, pooled Graph client for the lifetime of the app
+    with _startup_step("graph_client"):
+        await start_client()
+    with _startup_step("background_jobs"):
+        refresh_scheduler.start()
+        outbox.start(_background_token)
+        subscriptions.start(_background_token)
+    # Authority discovery can take seconds or fail offline; it must not hold up readiness
+    msal_warm_up = asyncio.create_task(warm_up_msal()) if settings.msal_warm_up else None
+    startup_report["ready_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    for name in settings.problems():
+        logger.warning("%s is not set; sign-in will fail", name)
+    logger.info(
+        "Ready in %.1f ms (import %.1f ms; %s)", startup_report["ready_ms"], startup_report["import_ms"],
+        ", ".join(f"{name} {ms} ms" for name, ms in startup_report["steps"].items()),
+    )
+    try:
+        yield
+    finally:
+        if msal_warm_up is not None:
+            msal_warm_up.cancel()
+        await subscriptions.stop()
+        await outbox.stop()
+        await refresh_scheduler.stop()
+        await close_client()
+        await close_db()
+        await shared_state.close()
+        shutdown_executor()
+
+
+refresh_scheduler = TokenRefreshScheduler(buffer_seconds=EXPIRATION_BUFFER_SECONDS)
+
+
+# email -> Token.time_zone (None when the user has not set one)
+_user_time_zones: Dict[str, Optional[str]] = {}
+
+
+def _forget_user_locally(email: str):
+    token_cache.invalidate(email)
+    event_store.forget(email)
+    availability.invalidate(email)
+    _user_time_zones.pop(email, None)
+    written_events.forget_user(email)
+
+
+shared_state.on_invalidate("user", _forget_user_locally)
+shared_state.on_invalidate("time_zone", lambda email: _user_time_zones.pop(email, None))
+
+
+async def _background_token(email: str) -> str:
+    async with AsyncSessionLocal() as db:
+        return await get_user_token(email, db)
+
+
+app = FastAPI(lifespan=lifespan)
+if TELEMETRY_ENABLED:
+    app.add_middleware(TelemetryMiddleware)
 
-app = FastAPI()
-token_store = {}
-  # In production, use a DB or encrypted store
-EXPIRATION_BUFFER_SECONDS = 300
+
+@app.exception_handler(CircuitOpenError)
+async def circuit_open_handler(request: Request, exc: CircuitOpenError):
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Microsoft Graph is temporarily unavailable. Please retry later."},
+        headers={"Retry-After": str(max(1, int(exc.retry_after)))},
+    )
+
+
+@app.exception_handler(SchedulerFullError)
+async def scheduler_full_handler(request: Request, exc: SchedulerFullError):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": "Too many event writes in progress for this user. Please retry later."},
+        headers={"Retry-After": str(max(1, int(exc.retry_after)))},
+    )
 
 
 @app.get("/")
 def root():
     return {"message": "Microsoft Calendar Integration using FastAPI"}
 
+@app.get("/stats/startup")
+def startup_stats():
+    return startup_report
+
+@app.get("/stats/graph")
+def graph_stats():
+    return pool_stats()
+
+@app.get("/stats/scheduler")
+def scheduler_stats():
+    return write_scheduler.stats()
+
+@app.get("/stats/throttling")
+def graph_throttling_stats():
+    return throttling_stats()
+
+@app.get("/stats/token-cache")
+def token_cache_stats():
+    return token_cache.stats()
+
+@app.get("/stats/event-store")
+def event_store_stats():
+    return event_store.stats()
+
+@app.get("/stats/availability")
+def availability_stats():
+    return availability.stats()
+
+@app.get("/stats/attendees")
+def attendee_stats():
+    return attendee_resolver.stats()
+
+@app.get("/stats/event-versions")
+def event_version_stats():
+    return written_events.stats()
+
+@app.get("/stats/outbox")
+def outbox_stats():
+    return outbox.stats()
+
+@app.get("/stats/idempotency")
+def idempotency_stats():
+    return idempotency.stats()
+
+@app.get("/stats/subscriptions")
+def subscription_stats():
+    return subscriptions.stats()
+
+def _metric_samples():
+    """
+    Gauges and counters from the stats endpoints, in Prometheus form.
+    """
+    samples = []
+    graph = pool_stats()
+    for key in ("in_flight_requests", "open_connections", "idle_connections", "http2_connections"):
+        samples.append((f"graph_pool_{key}", "gauge", {}, graph[key]))
+    samples.append(("graph_requests_total", "counter", {}, graph["total_requests"]))
+    for key, value in token_cache.stats().items():
+        if isinstance(value, (int, float)):
+            samples.append((f"token_cache_{key}", "gauge", {}, value))
+    throttling = throttling_stats()
+    for route, count in throttling["throttle_events"].items():
+        samples.append(("graph_throttle_events_total", "counter", {"route": route}, count))
+    for route, count in throttling["retries"].items():
+        samples.append(("graph_retries_total", "counter", {"route": route}, count))
+    samples.append(("graph_circuit_rejections_total", "counter", {}, throttling["circuit_rejections"]))
+    for route, circuit in throttling["circuits"].items():
+        samples.append(("graph_circuit_open", "gauge", {"route": route}, int(circuit["state"] != "closed")))
+    for key, value in event_store.stats().items():
+        if isinstance(value, (int, float)):
+            samples.append((f"event_store_{key}", "gauge", {}, value))
+    return samples
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(render_prometheus(_metric_samples()), media_type="text/plain; version=0.0.4")
+
 @app.get("/auth/login")
 def login():
     auth_url = get_auth_url()
     return RedirectResponse(auth_url)
 
 @app.get("/callback")
-def auth_callback(code: str, db: Session = Depends(get_db)):
+async def auth_callback(code: str, db: AsyncSession = Depends(get_db)):
     if not code:
         raise HTTPException(status_code=400, detail="Missing auth code")
 
-    result = get_token_by_auth_code(code)
+    msal_cache = SerializableTokenCache()
+    result = await get_token_by_auth_code_async(code, msal_cache)
     if "access_token" not in result:
         raise HTTPException(status_code=400, detail="Authentication failed")
 
@@ -42,147 +247,523 @@ def auth_callback(code: str, db: Session = Depends(get_db)):
     if not email:
         raise HTTPException(status_code=400, detail="Could not retrieve email from token.")
 
+    tenant_id, user_id = get_ids_from_id_token(id_token)
+
     # Calculate expiration time
     expires_in = result.get("expires_in", 3600)
     expires_at = datetime.utcnow() + timedelta(seconds=expires_in)
 
     # Check if user already exists in DB
-    db_token = db.query(Token).filter(Token.email == email).first()
+    db_token = (await db.execute(select(Token).where(Token.email == email))).scalars().first()
 
     if db_token:
         # Update existing token
         db_token.access_token = result["access_token"]
         db_token.refresh_token = result.get("refresh_token")
         db_token.expires_at = expires_at
+        db_token.tenant_id = tenant_id
+        db_token.user_id = user_id
     else:
         # Create new token entry
         db_token = Token(
             email=email,
             access_token=result["access_token"],
             refresh_token=result.get("refresh_token"),
-            expires_at=expires_at
+            expires_at=expires_at,
+            tenant_id=tenant_id,
+            user_id=user_id,
         )
         db.add(db_token)
     
-    db.commit()
-    db.refresh(db_token)
+    await db.commit()
+    await forget_token(email)
+    await save_cache(email, msal_cache)
 
     return {"message": f"Authentication successful for {email}!"}
 
 # --- UPDATED HELPER FUNCTION WITH REFRESH LOGIC ---
-def get_user_token(email: str, db: Session) -> str:
+async def get_user_token(email: str, db: AsyncSession) -> str:
     if not email:
         raise HTTPException(status_code=401, detail="Email header missing")
 
-    db_token = db.query(Token).filter(Token.email == email).first()
+    cached_token = await lookup_token(email)
+    if cached_token:
+        return cached_token
+
+    with span("db_token_lookup"):
+        db_token = (
+            await db.execute(
+                select(Token.access_token, Token.refresh_token, Token.expires_at).where(Token.email == email)
+            )
+        ).first()
+        # End the read transaction so the pooled connection is not held while
+        # this request waits on a refresh or on Graph
+        await db.rollback()
     if not db_token:
         raise HTTPException(status_code=404, detail="User not found or not authenticated. Please login.")
 
     # --- TOKEN REFRESH LOGIC ---
-    if datetime.utcnow() > db_token.expires_at:
-        print(f"Token for {email} has expired. Attempting to refresh.")
+    now = datetime.utcnow()
+    if now > db_token.expires_at:
+        logger.info("Token for %s has expired. Attempting to refresh.", email)
         if not db_token.refresh_token:
             raise HTTPException(status_code=401, detail="Token expired and no refresh token available. Please login again.")
+        # Concurrent callers for the same user share a single refresh
+        return await refresh_user_token(email)
 
-        new_token_result = refresh_access_token(db_token.refresh_token)
-        
-        if "access_token" not in new_token_result:
-            # If refresh fails, user must re-authenticate
-            raise HTTPException(status_code=401, detail="Could not refresh token. Please login again.")
-
-        # Update the database with the new token information
-        db_token.access_token = new_token_result['access_token']
-        # Some flows provide a new refresh token, some don't. Update if available.
-        if 'refresh_token' in new_token_result:
-            db_token.refresh_token = new_token_result['refresh_token']
-        db_token.expires_at = datetime.utcnow() + timedelta(seconds=new_token_result['expires_in'])
-        
-        db.commit()
-        print(f"Token for {email} refreshed successfully.")
-        return db_token.access_token
+    if now > db_token.expires_at - timedelta(seconds=EXPIRATION_BUFFER_SECONDS) and db_token.refresh_token:
+        # Still valid, but refresh ahead of expiry without making this request wait
+        schedule_refresh(email)
 
+    await remember_token(email, db_token.access_token, db_token.expires_at)
     return db_token.access_token
 
-# Helper to get a fresh token when needed
-# def get_valid_access_token():
-#     """
-#     Retrieves a valid access token.
-#     If the current token is expired or about to expire, it refreshes it.
-#     Otherwise, it returns the existing token.
-#     """
-#     user_token = token_store.get("user")
-#     if not user_token or "refresh_token" not in user_token:
-#         raise HTTPException(status_code=401, detail="User not authenticated or no refresh token found.")
-
-#     # Check if the token is expired or within the buffer period
-#     if time.time() > user_token.get("expires_at", 0) - EXPIRATION_BUFFER_SECONDS:
-#         print("Token expired or nearing expiration. Refreshing...")
-#         refreshed_result = refresh_access_token(user_token["refresh_token"])
-        
-#         if "access_token" in refreshed_result:
-#             # Update the entire token in the store with new values
-#             new_expires_at = time.time() + refreshed_result["expires_in"]
-#             user_token["access_token"] = refreshed_result["access_token"]
-#             user_token["expires_at"] = new_expires_at
-#             # Microsoft sometimes provides a new refresh token
-#             user_token["refresh_token"] = refreshed_result.get("refresh_token", user_token["refresh_token"])
-            
-#             return user_token["access_token"]
-#         else:
-#             # If refresh fails, the user needs to log in again
-#             print("ERROR: Could not refresh token.", refreshed_result.get("error_description"))
-#             # Clear the invalid token from the store
-#             token_store.clear()
-#             raise HTTPException(status_code=401, detail="Could not refresh token. Please re-authenticate.")
-#     else:
-#         # Token is still valid, return it
-#         print("Token is still valid.")
-#         return user_token["access_token"]
+async def _user_time_zone(email: str, db: AsyncSession) -> str:
+    """
+    The user's preferred time zone, or DEFAULT_TIME_ZONE.
+    """
+    if email not in _user_time_zones:
+        _user_time_zones[email] = (await db.execute(select(Token.time_zone).where(Token.email == email))).scalar()
+        await db.rollback()
+    return _user_time_zones[email] or DEFAULT_TIME_ZONE
+
+def _parse_range(start_time: str, end_time: str, time_zone: str = DEFAULT_TIME_ZONE):
+    try:
+        start_at = parse_graph_datetime(start_time, time_zone)
+        end_at = parse_graph_datetime(end_time, time_zone)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start_time and end_time must be ISO 8601 datetimes")
+    if end_at <= start_at:
+        raise HTTPException(status_code=400, detail="end_time must be after start_time")
+    return start_at, end_at
+
+async def _availability_call(coro):
+    try:
+        return await coro
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=502, detail=f"Availability lookup failed: {e.response.status_code}")
+
+@app.post("/availability/check")
+async def availability_check_endpoint(request: AvailabilityRequest, email: str = Header(...), db: AsyncSession = Depends(get_db)):
+    start_at, end_at = _parse_range(request.start_time, request.end_time, request.time_zone or await _user_time_zone(email, db))
+    token = await get_user_token(email, db)
+    attendees = request.attendees + ([email] if request.include_organizer else [])
+    return await _availability_call(availability.check(email, token, attendees, start_at, end_at))
+
+@app.post("/availability/slots")
+async def availability_slots_endpoint(request: FreeSlotsRequest, email: str = Header(...), db: AsyncSession = Depends(get_db)):
+    start_at, end_at = _parse_range(request.start_time, request.end_time, request.time_zone or await _user_time_zone(email, db))
+    token = await get_user_token(email, db)
+    attendees = request.attendees + ([email] if request.include_organizer else [])
+    return await _availability_call(availability.find_slots(
+        email, token, attendees, start_at, end_at, timedelta(minutes=request.duration_minutes), request.count
+    ))
+
+async def _attendee_names(token: str, events: List[EventRequest], validate: bool) -> Dict[str, str]:
+    """
+    Display names for the attendees of `events`, from the directory cache.
+    With `validate`, attendees neither the directory nor the organizer's
+    people list knows are rejected with 422.
+    """
+    addresses = [att.email for event in events for att in event.attendees or []]
+    if not addresses or not ATTENDEE_RESOLUTION_ENABLED:
+        return {}
+    with span("attendee_resolve"):
+        entries = await attendee_resolver.resolve(token, addresses)
+    if validate:
+        unknown = [address for address, entry in entries.items() if entry.found is False]
+        if unknown:
+            raise HTTPException(status_code=422, detail={"message": "Unknown attendees", "attendees": unknown})
+    return {address: entry.name for address, entry in entries.items() if entry.name}
+
+def _accepted_body(job) -> dict:
+    return {"job_id": job.id, "status": job.status, "status_url": f"/jobs/{job.id}"}
+
+def _accepted(job) -> JSONResponse:
+    return JSONResponse(status_code=202, content=_accepted_body(job), headers={"Location": f"/jobs/{job.id}"})
+
+async def _create_event(event: EventRequest, email: str, token: str, check_availability: bool, async_mode: bool, db: AsyncSession, graph_transaction_id: str = None, validate_attendees: bool = False):
+    time_zone = await _user_time_zone(email, db)
+    if check_availability:
+        start_at, end_at = _parse_range(event.start_time, event.end_time, event.time_zone or time_zone)
+        attendees = [att.email for att in event.attendees] + [email]
+        availability_result = await _availability_call(availability.check(email, token, attendees, start_at, end_at))
+        if not availability_result["free"]:
+            message = "Time slot is not free" if availability_result["conflicts"] else "Could not check every attendee's schedule"
+            raise HTTPException(status_code=409, detail={
+                "message": message, "conflicts": availability_result["conflicts"], "unknown": availability_result["unknown"],
+            })
+
+    names = await _attendee_names(token, [event], validate_attendees)
+    with span("payload_build"):
+        event_payload = build_event_payload(event, time_zone, names)
+    if graph_transaction_id:
+        event_payload["transactionId"] = graph_transaction_id
+    if async_mode:
+        return 202, _accepted_body(await enqueue(db, email, "create", payload=event_payload))
+    async with write_scheduler.slot(email):
+        result = await create_event(token, event_payload)
+    if "id" in result:
+        await written_events.remember(email, result, event_payload)
+        event_store.upsert(email, result)
+        availability.invalidate(email, email)
+    return 200, result
 
 @app.post("/event/create")
-async def create_event_endpoint(event: EventRequest, email: str = Header(...), db: Session = Depends(get_db)):
-    token = get_user_token(email, db)
-    # The rest of your function remains the same...
-    event_payload = {
-        "subject": event.subject,
-        "body": {"contentType": "HTML", "content": event.content or ""},
-        "start": {"dateTime": event.start_time, "timeZone": "Asia/Kolkata"},
-        "end": {"dateTime": event.end_time, "timeZone": "Asia/Kolkata"},
-        "isOnlineMeeting": event.is_online_meeting,
-        "attendees": [{"emailAddress": {"address": att.email, "name": att.email}, "type": "required"} for att in event.attendees]
-    }
-    result = await create_event(token, event_payload)
-    return result
+async def create_event_endpoint(
+    event: EventRequest,
+    email: str = Header(...),
+    check_availability: bool = Query(False, description="Reject with 409 if the organizer or an attendee is busy"),
+    async_mode: bool = Query(False, description="Queue the write and return 202 with a job id"),
+    validate_attendees: bool = Query(False, description="Reject with 422 if an attendee is not in the directory or the organizer's people"),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    db: AsyncSession = Depends(get_db),
+):
+    token = await get_user_token(email, db)
+    replayed = False
+    if idempotency_key is None:
+        status_code, body = await _create_event(
+            event, email, token, check_availability, async_mode, db, validate_attendees=validate_attendees
+        )
+    else:
+        async def _call():
+            status_code, body = await _create_event(
+                event, email, token, check_availability, async_mode, db, transaction_id(email, idempotency_key),
+                validate_attendees,
+            )
+            # Graph errors are not remembered, so the client can retry them
+            return status_code, body, status_code == 202 or "id" in body
+
+        fingerprint = request_fingerprint(event.model_dump(mode="json"), check_availability, async_mode, validate_attendees)
+        status_code, body, replayed = await idempotency.run(db, email, idempotency_key, fingerprint, _call)
+
+    headers = {}
+    if status_code == 202:
+        headers["Location"] = body["status_url"]
+    if replayed:
+        headers["Idempotent-Replayed"] = "true"
+    return json_response(body, status_code=status_code, headers=headers)
+
+def _etag_headers(event: dict) -> dict:
+    etag = event.get("@odata.etag") if isinstance(event, dict) else None
+    return {"ETag": etag} if etag else {}
 
 @app.patch("/event/update/{event_id}")
-async def update_event_endpoint(event_id: str, event: EventRequest, email: str = Header(...), db: Session = Depends(get_db)):
-    token = get_user_token(email, db)
-    # The rest of your function remains the same...
-    update_payload = {
-        "subject": event.subject,
-        "body": {"contentType": "HTML", "content": event.content or ""},
-        "start": {"dateTime": event.start_time, "timeZone": "Asia/Kolkata"},
-        "end": {"dateTime": event.end_time, "timeZone": "Asia/Kolkata"}
-    }
-    result = await update_event(token, event_id, update_payload)
-    return result
+async def update_event_endpoint(
+    event_id: str,
+    event: EventRequest,
+    email: str = Header(...),
+    async_mode: bool = Query(False, description="Queue the write and return 202 with a job id"),
+    if_match: Optional[str] = Header(None, alias="If-Match"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Updates the event. With If-Match (the ETag of GET /events/{event_id} or
+    of the last update), Graph applies it only if the event has not changed
+    since, else 412; and if that ETag is the one this service last wrote,
+    only the changed fields are sent, or nothing at all.
+    """
+    token = await get_user_token(email, db)
+    time_zone = await _user_time_zone(email, db)
+    with span("payload_build"):
+        update_payload = build_update_payload(event, time_zone)
+    if async_mode:
+        await written_events.forget(email, event_id)
+        return _accepted(await enqueue(db, email, "update", event_id=event_id, payload=update_payload))
+
+    stored = event_store.get(email, event_id)
+    changes = await written_events.diff(email, event_id, update_payload, if_match, (stored or {}).get("@odata.etag"))
+    if not changes:
+        # The client holds the version last written here and asks for it again
+        current = stored if stored is not None else {"id": event_id, "@odata.etag": if_match}
+        return json_response(current, headers={"ETag": if_match})
+
+    try:
+        async with write_scheduler.slot(email):
+            result = await update_event(token, event_id, changes, if_match)
+    except PreconditionFailedError:
+        await written_events.forget(email, event_id)
+        raise HTTPException(status_code=412, detail="The event has changed since it was read")
+    if "id" in result:
+        await written_events.remember(email, result, changes, partial=changes is not update_payload)
+        event_store.upsert(email, result)
+        availability.invalidate(email, email)
+    return json_response(result, headers=_etag_headers(result))
 
 @app.delete("/event/delete/{event_id}")
-async def delete_event_endpoint(event_id: str, email: str = Header(...), db: Session = Depends(get_db)):
-    token = get_user_token(email, db)
-    success = await delete_event(token, event_id)
+async def delete_event_endpoint(
+    event_id: str,
+    email: str = Header(...),
+    async_mode: bool = Query(False, description="Queue the delete and return 202 with a job id"),
+    db: AsyncSession = Depends(get_db),
+):
+    token = await get_user_token(email, db)
+    if async_mode:
+        return _accepted(await enqueue(db, email, "delete", event_id=event_id))
+    async with write_scheduler.slot(email):
+        success = await delete_event(token, event_id)
+    await written_events.forget(email, event_id)
     if success:
+        event_store.remove(email, event_id)
+        availability.invalidate(email, email)
         return {"message": "Event deleted successfully"}
     else:
         raise HTTPException(status_code=400, detail="Failed to delete event")
 
+@app.get("/user/time-zone")
+async def get_time_zone_endpoint(email: str = Header(...), db: AsyncSession = Depends(get_db)):
+    return {"time_zone": await _user_time_zone(email, db), "default": _user_time_zones.get(email) is None}
+
+@app.put("/user/time-zone")
+async def set_time_zone_endpoint(request: TimeZoneRequest, email: str = Header(...), db: AsyncSession = Depends(get_db)):
+    """
+    Sets the time zone used for this user's events that do not name one.
+    """
+    db_token = (await db.execute(select(Token).where(Token.email == email))).scalars().first()
+    if db_token is None:
+        raise HTTPException(status_code=404, detail="User not found or not authenticated. Please login.")
+    db_token.time_zone = request.time_zone
+    await db.commit()
+    _user_time_zones[email] = request.time_zone
+    shared_state.broadcast("time_zone", email)
+    return {"time_zone": request.time_zone, "default": False}
+
+@app.get("/jobs/{job_id}")
+async def job_status_endpoint(job_id: str, email: str = Header(...), db: AsyncSession = Depends(get_db)):
+    job = await get_job(db, email, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_status(job)
+
+@app.get("/events")
+async def list_events_endpoint(
+    start: Optional[str] = Query(None, description="ISO 8601, naive values are UTC"),
+    end: Optional[str] = Query(None, description="ISO 8601, naive values are UTC"),
+    refresh: bool = False,
+    email: str = Header(...),
+    db: AsyncSession = Depends(get_db),
+):
+    try:
+        start_at = parse_query_datetime(start) if start else None
+        end_at = parse_query_datetime(end) if end else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be ISO 8601 datetimes")
+
+    token = await get_user_token(email, db)
+    try:
+        await event_store.ensure_fresh(email, token, start_at, end_at, force=refresh)
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=502, detail=f"Calendar sync failed: {e.response.status_code}")
+    return json_response({"value": event_store.list(email, start_at, end_at)})
+
+@app.post("/events/import")
+async def import_events_endpoint(
+    request: Request,
+    time_zone: Optional[str] = Query(None, description="Zone for floating times; defaults to the user's time zone"),
+    email: str = Header(...),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Imports an iCalendar (.ics) upload, streamed as the request body.
+    """
+    if time_zone is not None:
+        try:
+            validate_zone(time_zone)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    await get_user_token(email, db)
+    default_zone = time_zone or await _user_time_zone(email, db)
+    try:
+        summary = await import_calendar(
+            email, request.stream(), default_zone, _background_token, lambda event: event_store.upsert(email, event)
+        )
+    except LineTooLongError as e:
+        # Events before the line may have been created already
+        raise HTTPException(status_code=413, detail={"message": str(e), **e.summary})
+    finally:
+        availability.invalidate(email, email)
+    return summary
+
+@app.get("/events/export")
+async def export_events_endpoint(
+    format: Literal["ics", "ndjson"] = Query("ics"),
+    start: Optional[str] = Query(None, description="ISO 8601; with end, exports calendarView instances"),
+    end: Optional[str] = Query(None, description="ISO 8601; without start/end, exports events and series masters"),
+    email: str = Header(...),
+    db: AsyncSession = Depends(get_db),
+):
+    if (start is None) != (end is None):
+        raise HTTPException(status_code=400, detail="start and end must be given together")
+    try:
+        start_at = parse_query_datetime(start) if start else None
+        end_at = parse_query_datetime(end) if end else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be ISO 8601 datetimes")
+
+    await get_user_token(email, db)
+    # Long exports can outlive the access token; each page asks for it again
+    pages = iter_events(
+        lambda: _background_token(email),
+        start_at.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ") if start_at else None,
+        end_at.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ") if end_at else None,
+    )
+    if format == "ics":
+        media_type, filename = "text/calendar; charset=utf-8", "calendar.ics"
+    else:
+        media_type, filename = "application/x-ndjson", "calendar.ndjson"
+    return StreamingResponse(
+        export_calendar(pages, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/events/{event_id}")
+async def get_event_endpoint(event_id: str, email: str = Header(...), db: AsyncSession = Depends(get_db)):
+    token = await get_user_token(email, db)
+    try:
+        await event_store.ensure_fresh(email, token)
+        event = event_store.get(email, event_id)
+        if event is None:
+            # Outside the synced window, ask Graph directly
+            event = await get_event(token, event_id)
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=502, detail=f"Calendar sync failed: {e.response.status_code}")
+    if event is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    event_store.upsert(email, event)
+    return json_response(event, headers=_etag_headers(event))
+
+@app.get("/events/{event_id}/occurrences")
+async def list_occurrences_endpoint(
+    event_id: str,
+    start: str = Query(..., description="ISO 8601, naive values are UTC"),
+    end: str = Query(..., description="ISO 8601, naive values are UTC"),
+    limit: int = Query(100, gt=0, le=1000),
+    email: str = Header(...),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Occurrences of a recurring series between start and end, expanded
+    locally from the cached series master.
+    """
+    try:
+        start_at, end_at = parse_query_datetime(start), parse_query_datetime(end)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="start and end must be ISO 8601 datetimes")
+    if end_at <= start_at:
+        raise HTTPException(status_code=400, detail="end must be after start")
+
+    token = await get_user_token(email, db)
+    try:
+        await event_store.ensure_fresh(email, token)
+        master = event_store.get(email, event_id)
+        if master is not None and master.get("seriesMasterId"):
+            # An occurrence id; expand its series
+            master = event_store.get(email, master["seriesMasterId"]) or await get_event(token, master["seriesMasterId"])
+        elif master is None:
+            master = await get_event(token, event_id)
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=502, detail=f"Calendar sync failed: {e.response.status_code}")
+    if master is None:
+        raise HTTPException(status_code=404, detail="Event not found")
+    if not master.get("recurrence"):
+        raise HTTPException(status_code=400, detail="Event is not a recurring series")
+    event_store.upsert(email, master)
+
+    with span("recurrence_expand"):
+        try:
+            occurrences = list(islice(event_store.occurrences(email, master, start_at, end_at), limit))
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+    return json_response({"value": occurrences})
+
+@app.post("/events/batch")
+async def batch_events_endpoint(
+    batch_request: EventBatchRequest,
+    email: str = Header(...),
+    validate_attendees: bool = Query(False, description="Reject with 422 if an attendee of a create is not in the directory or the organizer's people"),
+    db: AsyncSession = Depends(get_db),
+):
+    token = await get_user_token(email, db)
+    time_zone = await _user_time_zone(email, db)
+    # One lookup for the attendees of every create in the batch
+    names = await _attendee_names(
+        token, [operation.event for operation in batch_request.operations if operation.op == "create"], validate_attendees
+    )
+    requests = []
+    for operation in batch_request.operations:
+        if operation.op == "create":
+            requests.append({"method": "POST", "url": "/me/events", "body": build_event_payload(operation.event, time_zone, names)})
+        elif operation.op == "update":
+            requests.append({"method": "PATCH", "url": f"/me/events/{operation.event_id}", "body": build_update_payload(operation.event, time_zone)})
+        else:
+            requests.append({"method": "DELETE", "url": f"/me/events/{operation.event_id}"})
+
+    # One scheduler slot per $batch, so the chunks run in parallel within the user's share
+    responses = await batch(token, requests, slot=lambda cost: write_scheduler.slot(email, cost=cost))
+    availability.invalidate(email, email)
+    results = []
+    for index, (operation, response) in enumerate(zip(batch_request.operations, responses)):
+        if response["status"] == 204 and operation.op == "delete":
+            event_store.remove(email, operation.event_id)
+            await written_events.forget(email, operation.event_id)
+        elif response["status"] in (200, 201) and isinstance(response["body"], dict):
+            await written_events.remember(email, response["body"], requests[index]["body"])
+            event_store.upsert(email, response["body"])
+        results.append({
+            "index": index,
+            "op": operation.op,
+            "event_id": operation.event_id or (response["body"] or {}).get("id"),
+            "status": response["status"],
+            "success": response["status"] is not None and 200 <= response["status"] < 300,
+            "body": response["body"],
+        })
+    return json_response({"results": results})
+
+
+@app.post("/subscriptions")
+async def create_subscription_endpoint(email: str = Header(...), db: AsyncSession = Depends(get_db)):
+    token = await get_user_token(email, db)
+    try:
+        subscription = await subscriptions.subscribe(db, email, token)
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=502, detail=f"Graph rejected the subscription: {e.response.status_code}")
+    return subscription_info(subscription)
+
+@app.get("/subscriptions")
+async def list_subscriptions_endpoint(email: str = Header(...), db: AsyncSession = Depends(get_db)):
+    return {"value": [subscription_info(subscription) for subscription in await subscriptions.list(db, email)]}
+
+@app.delete("/subscriptions")
+async def delete_subscriptions_endpoint(email: str = Header(...), db: AsyncSession = Depends(get_db)):
+    token = await get_user_token(email, db)
+    return {"deleted": await subscriptions.unsubscribe(db, email, token)}
+
+@app.post("/notifications")
+async def notifications_endpoint(request: Request, validationToken: Optional[str] = Query(None)):
+    # Graph checks the endpoint by echoing a validation token when subscribing
+    if validationToken is not None:
+        return PlainTextResponse(validationToken)
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid notification payload")
+    await subscriptions.accept(payload.get("value", []) if isinstance(payload, dict) else [])
+    # Work happens after the response; Graph expects an answer within seconds
+    return Response(status_code=202)
+
 
 @app.post("/logout")
-def logout(email: str = Header(...), db: Session = Depends(get_db)):
-    db_token = db.query(Token).filter(Token.email == email).first()
+async def logout(email: str = Header(...), db: AsyncSession = Depends(get_db)):
+    await subscriptions.unsubscribe(db, email, token_cache.get(email))
+    await forget_token(email)
+    _forget_user_locally(email)
+    shared_state.broadcast("user", email)
+    await delete_cache(email)
+    db_token = (await db.execute(select(Token).where(Token.email == email))).scalars().first()
     if db_token:
-        db.delete(db_token)
-        db.commit()
+        await db.delete(db_token)
+        await db.commit()
         return JSONResponse({"message": f"Logged out successfully for {email}"})
     else:
         raise HTTPException(status_code=404, detail="User not found.")
\ No newline at end of file
@@ -1,9 +1,84 @@
-from pydantic import BaseModel
-from typing import List, Optional
+import re
+from datetime import date
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+from pydantic.alias_generators import to_camel
+from typing import List, Literal, Optional
+
+from app.timezones import parse_graph_datetime, validate_zone
+
+# Deliberately loose: one @, no spaces, a dot in the domain. The directory
+# lookup decides whether the mailbox exists.
+EMAIL_PATTERN = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
 
 class EventAttendee(BaseModel):
     email: str
 
+    @field_validator("email")
+    @classmethod
+    def check_email(cls, value):
+        value = value.strip()
+        if not EMAIL_PATTERN.match(value):
+            raise ValueError(f"{value!r} is not an email address")
+        return value
+
+DayOfWeek = Literal["sunday", "monday", "tuesday", "wednesday", "thursday", "friday", "saturday"]
+
+class RecurrencePattern(BaseModel):
+    """
+    Graph recurrencePattern; fields are accepted in snake_case or camelCase.
+    """
+    model_config = ConfigDict(alias_generator=to_camel, populate_by_name=True)
+
+    type: Literal["daily", "weekly", "absoluteMonthly", "relativeMonthly", "absoluteYearly", "relativeYearly"]
+    interval: int = Field(default=1, gt=0, le=99)
+    days_of_week: Optional[List[DayOfWeek]] = None
+    day_of_month: Optional[int] = Field(default=None, ge=1, le=31)
+    month: Optional[int] = Field(default=None, ge=1, le=12)
+    index: Optional[Literal["first", "second", "third", "fourth", "last"]] = None
+    first_day_of_week: Optional[DayOfWeek] = None
+
+    @model_validator(mode="after")
+    def check_fields(self):
+        if self.type in ("weekly", "relativeMonthly", "relativeYearly") and not self.days_of_week:
+            raise ValueError(f"days_of_week is required for a {self.type} pattern")
+        if self.type in ("absoluteMonthly", "absoluteYearly") and self.day_of_month is None:
+            raise ValueError(f"day_of_month is required for an {self.type} pattern")
+        if self.type in ("absoluteYearly", "relativeYearly") and self.month is None:
+            raise ValueError(f"month is required for a {self.type} pattern")
+        return self
+
+class RecurrenceRange(BaseModel):
+    """
+    Graph recurrenceRange.
+    """
+    model_config = ConfigDict(alias_generator=to_camel, populate_by_name=True)
+
+    type: Literal["endDate", "noEnd", "numbered"] = "noEnd"
+    start_date: date
+    end_date: Optional[date] = None
+    number_of_occurrences: Optional[int] = Field(default=None, gt=0)
+    recurrence_time_zone: Optional[str] = None
+
+    @field_validator("recurrence_time_zone")
+    @classmethod
+    def check_time_zone(cls, value):
+        return value if value is None else validate_zone(value)
+
+    @model_validator(mode="after")
+    def check_fields(self):
+        if self.type == "endDate" and (self.end_date is None or self.end_date < self.start_date):
+            raise ValueError("an endDate range needs an end_date on or after start_date")
+        if self.type == "numbered" and self.number_of_occurrences is None:
+            raise ValueError("a numbered range needs number_of_occurrences")
+        return self
+
+class EventRecurrence(BaseModel):
+    pattern: RecurrencePattern
+    range: RecurrenceRange
+
+    def to_graph(self) -> dict:
+        return self.model_dump(mode="json", by_alias=True, exclude_none=True)
+
 class EventRequest(BaseModel):
     subject: str
     content: Optional[str]
@@ -11,4 +86,75 @@ class EventRequest(BaseModel):
     end_time: str
     attendees: Optional[List[EventAttendee]] = []
     is_online_meeting: Optional[bool] = False
+    # IANA or Windows name; defaults to the user's time zone, then DEFAULT_TIME_ZONE
+    time_zone: Optional[str] = None
+    # Makes the event a series; start_time/end_time are its first occurrence
+    recurrence: Optional[EventRecurrence] = None
+
+    @field_validator("time_zone")
+    @classmethod
+    def check_time_zone(cls, value):
+        return value if value is None else validate_zone(value)
+
+    @model_validator(mode="after")
+    def check_times(self):
+        # Only the order is checked; the user's zone is not known yet
+        try:
+            start_at = parse_graph_datetime(self.start_time, self.time_zone or "UTC")
+            end_at = parse_graph_datetime(self.end_time, self.time_zone or "UTC")
+        except ValueError:
+            raise ValueError("start_time and end_time must be ISO 8601 datetimes")
+        if end_at <= start_at:
+            raise ValueError("end_time must be after start_time")
+        return self
+
+
+class BatchOperation(BaseModel):
+    op: Literal["create", "update", "delete"]
+    event_id: Optional[str] = None
+    event: Optional[EventRequest] = None
+
+    @model_validator(mode="after")
+    def check_fields(self):
+        if self.op in ("update", "delete") and not self.event_id:
+            raise ValueError(f"event_id is required for {self.op}")
+        if self.op in ("create", "update") and self.event is None:
+            raise ValueError(f"event is required for {self.op}")
+        return self
+
+class EventBatchRequest(BaseModel):
+    operations: List[BatchOperation]
+
+class AvailabilityRequest(BaseModel):
+    attendees: List[str]
+    start_time: str  # ISO 8601 format
+    end_time: str
+    include_organizer: bool = True
+    time_zone: Optional[str] = None
+
+    @field_validator("time_zone")
+    @classmethod
+    def check_time_zone(cls, value):
+        return value if value is None else validate_zone(value)
+
+class FreeSlotsRequest(BaseModel):
+    attendees: List[str]
+    start_time: str  # search window, ISO 8601 format
+    end_time: str
+    duration_minutes: int = Field(gt=0)
+    count: int = Field(default=5, gt=0, le=100)
+    include_organizer: bool = True
+    time_zone: Optional[str] = None
+
+    @field_validator("time_zone")
+    @classmethod
+    def check_time_zone(cls, value):
+        return value if value is None else validate_zone(value)
+
+class TimeZoneRequest(BaseModel):
+    time_zone: str
 
+    @field_validator("time_zone")
+    @classmethod
+    def check_time_zone(cls, value):
+        return validate_zone(value)
@@ -0,0 +1,75 @@
+from collections import OrderedDict
+from datetime import datetime
+
+from msal import SerializableTokenCache
+from sqlalchemy import delete, select
+
+from app import shared_state
+from app.config import MSAL_CACHE_MAX_USERS
+from app.db import AsyncSessionLocal, MsalTokenCache
+
+# email -> last serialized cache seen in or written to the DB
+_blobs: "OrderedDict[str, str]" = OrderedDict()
+
+
+def _remember(email: str, blob: str):
+    _blobs[email] = blob
+    _blobs.move_to_end(email)
+    while len(_blobs) > MSAL_CACHE_MAX_USERS:
+        _blobs.popitem(last=False)
+
+
+def forget(email: str):
+    _blobs.pop(email, None)
+
+
+# Another worker refreshed or dropped the user's tokens: its blob is newer than ours
+shared_state.on_invalidate("msal_cache", forget)
+shared_state.on_invalidate("token", forget)
+shared_state.on_invalidate("user", forget)
+
+
+async def load_cache(email: str) -> SerializableTokenCache:
+    """
+    Returns the user's MSAL cache, reading the DB only the first time.
+    """
+    cache = SerializableTokenCache()
+    blob = _blobs.get(email)
+    if blob is None:
+        async with AsyncSessionLocal() as db:
+            blob = (
+                await db.execute(select(MsalTokenCache.cache_blob).where(MsalTokenCache.email == email))
+            ).scalar()
+        if blob is None:
+            return cache
+        _remember(email, blob)
+    cache.deserialize(blob)
+    return cache
+
+
+async def save_cache(email: str, cache: SerializableTokenCache):
+    """
+    Writes the cache back, but only if MSAL changed it.
+    """
+    if not cache.has_state_changed:
+        return
+    blob = cache.serialize()
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(select(MsalTokenCache).where(MsalTokenCache.email == email))).scalars().first()
+        if row:
+            row.cache_blob = blob
+            row.updated_at = datetime.utcnow()
+        else:
+            db.add(MsalTokenCache(email=email, cache_blob=blob, updated_at=datetime.utcnow()))
+        await db.commit()
+    cache.has_state_changed = False
+    _remember(email, blob)
+    shared_state.broadcast("msal_cache", email)
+
+
+async def delete_cache(email: str):
+    forget(email)
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(MsalTokenCache).where(MsalTokenCache.email == email))
+        await db.commit()
+    shared_state.broadcast("msal_cache", email)
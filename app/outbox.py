@@ -0,0 +1,322 @@
+import asyncio
+import json
+import logging
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import and_, exists, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import aliased
+
+from app.availability import availability
+from app.config import (
+    OUTBOX_WORKERS,
+    OUTBOX_CLAIM_SIZE,
+    OUTBOX_POLL_INTERVAL_SECONDS,
+    OUTBOX_MAX_ATTEMPTS,
+    OUTBOX_RETRY_BASE_SECONDS,
+    OUTBOX_RETRY_MAX_SECONDS,
+    OUTBOX_LEASE_SECONDS,
+)
+from app.db import AsyncSessionLocal, OutboxJob
+from app.event_store import event_store
+from app.graph_api import batch
+from app.scheduler import write_scheduler
+from app.throttling import CircuitOpenError
+
+logger = logging.getLogger(__name__)
+
+# Sub-request statuses worth another attempt later; anything else is final
+TRANSIENT_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+def _retry_delay(attempts: int) -> float:
+    return random.uniform(0.5, 1.0) * min(OUTBOX_RETRY_MAX_SECONDS, OUTBOX_RETRY_BASE_SECONDS * (2 ** max(attempts - 1, 0)))
+
+
+def _claimable(now: datetime):
+    return or_(
+        and_(OutboxJob.status == "pending", OutboxJob.next_attempt_at <= now),
+        # Lease ran out: the worker holding it died or hung
+        and_(OutboxJob.status == "running", OutboxJob.locked_until < now),
+    )
+
+
+def _first_for_event():
+    # No earlier write to the same event is still pending, retrying or running
+    earlier = aliased(OutboxJob)
+    return ~exists().where(
+        earlier.email == OutboxJob.email,
+        earlier.event_id == OutboxJob.event_id,
+        earlier.status.in_(("pending", "running")),
+        or_(
+            earlier.created_at < OutboxJob.created_at,
+            and_(earlier.created_at == OutboxJob.created_at, earlier.id < OutboxJob.id),
+        ),
+    )
+
+
+def _graph_request(job: OutboxJob) -> dict:
+    if job.op == "create":
+        return {"method": "POST", "url": "/me/events", "body": json.loads(job.payload)}
+    if job.op == "update":
+        return {"method": "PATCH", "url": f"/me/events/{job.event_id}", "body": json.loads(job.payload)}
+    return {"method": "DELETE", "url": f"/me/events/{job.event_id}"}
+
+
+def job_status(job: OutboxJob) -> dict:
+    return {
+        "id": job.id,
+        "op": job.op,
+        "status": job.status,
+        "event_id": job.event_id,
+        "attempts": job.attempts,
+        "last_error": job.last_error,
+        "result": json.loads(job.result) if job.result else None,
+        "created_at": job.created_at.isoformat(),
+        "updated_at": job.updated_at.isoformat(),
+        "next_attempt_at": job.next_attempt_at.isoformat() if job.status == "pending" else None,
+    }
+
+
+async def enqueue(db: AsyncSession, email: str, op: str, event_id: str = None, payload: dict = None) -> OutboxJob:
+    """
+    Persists an event write and wakes a worker. Creates without a Graph
+    transactionId (one derived from the caller's Idempotency-Key) get the
+    job id, so Graph drops the duplicate if a retry follows a create whose
+    response was lost.
+    """
+    now = datetime.utcnow()
+    job_id = str(uuid.uuid4())
+    if op == "create":
+        payload = {**payload, "transactionId": payload.get("transactionId") or job_id}
+    job = OutboxJob(
+        id=job_id,
+        email=email,
+        op=op,
+        event_id=event_id,
+        payload=json.dumps(payload) if payload is not None else None,
+        status="pending",
+        attempts=0,
+        next_attempt_at=now,
+        created_at=now,
+        updated_at=now,
+    )
+    db.add(job)
+    await db.commit()
+    outbox.notify()
+    return job
+
+
+async def get_job(db: AsyncSession, email: str, job_id: str) -> Optional[OutboxJob]:
+    job = await db.get(OutboxJob, job_id)
+    if job is None or job.email != email:
+        return None
+    return job
+
+
+class OutboxWorkers:
+    """
+    Drains outbox_jobs with a fixed number of workers. Each worker claims
+    the due jobs of one user at a time and sends them as a single $batch.
+    Graph runs the requests of a $batch in no particular order, so only
+    the oldest unfinished job of an event is claimable: later writes to it
+    wait until it has succeeded or failed, also while it waits for a retry.
+    Claimed jobs are leased for OUTBOX_LEASE_SECONDS, and the lease is
+    renewed while they are in hand, including while they wait for a write
+    scheduler slot, so only a dead or hung worker's jobs are claimed again.
+    """
+
+    def __init__(self, workers: int = OUTBOX_WORKERS):
+        self.workers = workers
+        self._token_provider: Optional[Callable[[str], Awaitable[str]]] = None
+        self._tasks: List[asyncio.Task] = []
+        self._wake = asyncio.Event()
+        self._busy_users = set()
+        self.succeeded = 0
+        self.failed = 0
+        self.retried = 0
+
+    def notify(self):
+        self._wake.set()
+
+    async def _claim(self) -> Optional[Tuple[str, List[OutboxJob]]]:
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            candidates = (await db.execute(
+                select(OutboxJob.id, OutboxJob.email)
+                .where(_claimable(now), _first_for_event())
+                .order_by(OutboxJob.next_attempt_at)
+                .limit(OUTBOX_CLAIM_SIZE * 4)
+            )).all()
+            email = next((row.email for row in candidates if row.email not in self._busy_users), None)
+            if email is None:
+                return None
+            self._busy_users.add(email)
+            try:
+                claimed = []
+                for row in candidates:
+                    if row.email != email or len(claimed) >= OUTBOX_CLAIM_SIZE:
+                        continue
+                    # Conditional update so two processes never claim the same job
+                    result = await db.execute(
+                        update(OutboxJob)
+                        .where(OutboxJob.id == row.id, _claimable(now), _first_for_event())
+                        .values(
+                            status="running",
+                            attempts=OutboxJob.attempts + 1,
+                            locked_until=now + timedelta(seconds=OUTBOX_LEASE_SECONDS),
+                            updated_at=now,
+                        )
+                    )
+                    if result.rowcount == 1:
+                        claimed.append(row.id)
+                await db.commit()
+                if not claimed:
+                    self._busy_users.discard(email)
+                    return None
+                jobs = (await db.execute(
+                    select(OutboxJob).where(OutboxJob.id.in_(claimed)).order_by(OutboxJob.created_at)
+                )).scalars().all()
+                return email, list(jobs)
+            except BaseException:
+                self._busy_users.discard(email)
+                raise
+
+    async def _finish(self, outcomes: List[Tuple[OutboxJob, dict]]):
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            for job, values in outcomes:
+                await db.execute(
+                    update(OutboxJob)
+                    .where(OutboxJob.id == job.id, OutboxJob.status == "running")
+                    .values(locked_until=None, updated_at=now, **values)
+                )
+            await db.commit()
+
+    def _retry_or_fail(self, job: OutboxJob, error: str, delay: float = None) -> dict:
+        if job.attempts >= OUTBOX_MAX_ATTEMPTS:
+            self.failed += 1
+            return {"status": "failed", "last_error": error}
+        self.retried += 1
+        delay = max(delay or 0.0, _retry_delay(job.attempts))
+        return {"status": "pending", "last_error": error, "next_attempt_at": datetime.utcnow() + timedelta(seconds=delay)}
+
+    async def _renew_leases(self, job_ids: List[str]):
+        while True:
+            await asyncio.sleep(OUTBOX_LEASE_SECONDS / 3)
+            now = datetime.utcnow()
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(OutboxJob)
+                        .where(OutboxJob.id.in_(job_ids), OutboxJob.status == "running")
+                        .values(locked_until=now + timedelta(seconds=OUTBOX_LEASE_SECONDS))
+                    )
+                    await db.commit()
+            except Exception as e:
+                logger.warning("Renewing outbox leases failed: %s", e)
+
+    async def _process(self, email: str, jobs: List[OutboxJob]):
+        renewal = asyncio.ensure_future(self._renew_leases([job.id for job in jobs]))
+        try:
+            await self._send(email, jobs)
+        finally:
+            renewal.cancel()
+
+    async def _send(self, email: str, jobs: List[OutboxJob]):
+        try:
+            token = await self._token_provider(email)
+            responses = await batch(
+                token, [_graph_request(job) for job in jobs], slot=lambda cost: write_scheduler.slot(email, cost=cost, wait=True)
+            )
+        except HTTPException as e:
+            if e.status_code in (401, 404):
+                # The user logged out or must sign in again; retrying cannot help
+                self.failed += len(jobs)
+                await self._finish([(job, {"status": "failed", "last_error": str(e.detail)}) for job in jobs])
+            else:
+                await self._finish([(job, self._retry_or_fail(job, str(e.detail))) for job in jobs])
+            return
+        except CircuitOpenError as e:
+            await self._finish([(job, self._retry_or_fail(job, str(e), e.retry_after)) for job in jobs])
+            return
+        except Exception as e:
+            logger.warning("Outbox batch for %s failed: %s", email, e)
+            await self._finish([(job, self._retry_or_fail(job, str(e))) for job in jobs])
+            return
+
+        outcomes = []
+        for job, response in zip(jobs, responses):
+            status, body = response["status"], response["body"]
+            # A delete retried after a lost 204 finds the event already gone
+            if (status is not None and 200 <= status < 300) or (job.op == "delete" and status == 404 and job.attempts > 1):
+                self.succeeded += 1
+                values = {"status": "succeeded", "last_error": None}
+                if isinstance(body, dict) and "id" in body:
+                    event_store.upsert(email, body)
+                    values.update(event_id=body["id"], result=json.dumps(body))
+                elif job.op == "delete":
+                    event_store.remove(email, job.event_id)
+                outcomes.append((job, values))
+                continue
+            error = f"Graph returned {status}"
+            if isinstance(body, dict) and isinstance(body.get("error"), dict):
+                error = f"{error}: {body['error'].get('message') or body['error'].get('code')}"
+            if status in TRANSIENT_STATUSES:
+                outcomes.append((job, self._retry_or_fail(job, error)))
+            else:
+                self.failed += 1
+                outcomes.append((job, {"status": "failed", "last_error": error, "result": json.dumps(body) if body else None}))
+        availability.invalidate(email, email)
+        await self._finish(outcomes)
+
+    async def _worker(self):
+        while True:
+            self._wake.clear()
+            try:
+                claimed = await self._claim()
+            except Exception as e:
+                logger.exception("Outbox claim failed: %s", e)
+                claimed = None
+            if claimed is None:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), OUTBOX_POLL_INTERVAL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            email, jobs = claimed
+            try:
+                await self._process(email, jobs)
+            except Exception as e:
+                # Jobs stay running and are picked up again once their lease ends
+                logger.exception("Outbox processing for %s failed: %s", email, e)
+            finally:
+                self._busy_users.discard(email)
+
+    def start(self, token_provider: Callable[[str], Awaitable[str]]):
+        self._token_provider = token_provider
+        if not self._tasks:
+            self._wake = asyncio.Event()
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            "workers": len(self._tasks),
+            "busy_users": len(self._busy_users),
+            "succeeded": self.succeeded,
+            "failed": self.failed,
+            "retried": self.retried,
+        }
+
+
+outbox = OutboxWorkers()
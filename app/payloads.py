@@ -0,0 +1,62 @@
+from functools import lru_cache
+from typing import Dict
+
+from app.config import DEFAULT_TIME_ZONE
+from app.models import EventRequest
+from app.timezones import to_graph_datetime
+
+
+@lru_cache(maxsize=4096)
+def _attendee(address: str, name: str = None) -> dict:
+    # Shared between payloads and only ever serialized; do not mutate
+    return {"emailAddress": {"address": address, "name": name or address}, "type": "required"}
+
+
+def _body(event: EventRequest) -> dict:
+    return {"contentType": "HTML", "content": event.content or ""}
+
+
+def _time(value: str, time_zone: str) -> dict:
+    return {"dateTime": to_graph_datetime(value, time_zone), "timeZone": time_zone}
+
+
+def _recurrence(event: EventRequest, time_zone: str) -> dict:
+    recurrence = event.recurrence.to_graph()
+    recurrence["range"].setdefault("recurrenceTimeZone", time_zone)
+    return recurrence
+
+
+def build_event_payload(event: EventRequest, time_zone: str = DEFAULT_TIME_ZONE, names: Dict[str, str] = None) -> dict:
+    """
+    Graph event body for a create. `time_zone` applies when the event does
+    not name one; `names` maps attendee addresses to display names.
+    """
+    names = names or {}
+    time_zone = event.time_zone or time_zone
+    payload = {
+        "subject": event.subject,
+        "body": _body(event),
+        "start": _time(event.start_time, time_zone),
+        "end": _time(event.end_time, time_zone),
+        "isOnlineMeeting": event.is_online_meeting,
+        "attendees": [_attendee(att.email, names.get(att.email)) for att in event.attendees],
+    }
+    if event.recurrence is not None:
+        payload["recurrence"] = _recurrence(event, time_zone)
+    return payload
+
+
+def build_update_payload(event: EventRequest, time_zone: str = DEFAULT_TIME_ZONE) -> dict:
+    """
+    Graph event body for a PATCH.
+    """
+    time_zone = event.time_zone or time_zone
+    payload = {
+        "subject": event.subject,
+        "body": _body(event),
+        "start": _time(event.start_time, time_zone),
+        "end": _time(event.end_time, time_zone),
+    }
+    if event.recurrence is not None:
+        payload["recurrence"] = _recurrence(event, time_zone)
+    return payload
@@ -0,0 +1,182 @@
+import calendar
+import heapq
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, Iterator, Optional, Tuple
+
+from app.timezones import event_bounds, parse_graph_datetime, resolve_zone
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+INDEXES = {"first": 0, "second": 1, "third": 2, "fourth": 3, "last": -1}
+
+# A pattern that matches nothing this many periods in a row (e.g. February 30th) ends
+MAX_EMPTY_PERIODS = 100
+
+# Series fields that do not carry over to a single occurrence
+_SERIES_ONLY = {"id", "@odata.etag", "changeKey", "recurrence", "type", "start", "end", "originalStart"}
+
+
+def _weekdays(pattern: dict, default: date):
+    days = [WEEKDAYS.index(day.lower()) for day in pattern.get("daysOfWeek") or []]
+    return days or [default.weekday()]
+
+
+def _nth_weekday(year: int, month: int, weekdays, index: str) -> Optional[date]:
+    days = [
+        date(year, month, day)
+        for day in range(1, calendar.monthrange(year, month)[1] + 1)
+        if date(year, month, day).weekday() in weekdays
+    ]
+    position = INDEXES.get((index or "first").lower(), 0)
+    return days[position] if position < len(days) else None
+
+
+def _day_of_month(year: int, month: int, day: int) -> Optional[date]:
+    return date(year, month, day) if day <= calendar.monthrange(year, month)[1] else None
+
+
+def pattern_dates(pattern: dict, first: date, skip_to: date = None) -> Iterator[date]:
+    """
+    Yields the dates matching a Graph recurrencePattern on or after `first`,
+    in order and without end. `skip_to` jumps ahead to the period holding
+    that date instead of walking every period before it.
+    """
+    kind = pattern.get("type", "daily")
+    interval = max(int(pattern.get("interval") or 1), 1)
+
+    if kind == "daily":
+        k = max((skip_to - first).days // interval, 0) if skip_to else 0
+        while True:
+            yield first + timedelta(days=k * interval)
+            k += 1
+
+    if kind == "weekly":
+        first_day = WEEKDAYS.index((pattern.get("firstDayOfWeek") or "sunday").lower())
+        week_start = first - timedelta(days=(first.weekday() - first_day) % 7)
+        offsets = sorted((day - first_day) % 7 for day in _weekdays(pattern, first))
+        k = max((skip_to - week_start).days // (7 * interval), 0) if skip_to else 0
+        while True:
+            base = week_start + timedelta(weeks=k * interval)
+            for offset in offsets:
+                day = base + timedelta(days=offset)
+                if day >= first:
+                    yield day
+            k += 1
+
+    if kind not in ("absoluteMonthly", "relativeMonthly", "absoluteYearly", "relativeYearly"):
+        raise ValueError(f"Unsupported recurrence pattern: {kind}")
+    yearly = kind.endswith("Yearly")
+    step = 12 * interval if yearly else interval
+    start_month = first.year * 12 + (int(pattern.get("month") or first.month) if yearly else first.month) - 1
+    if skip_to:
+        k = max((skip_to.year * 12 + skip_to.month - 1 - start_month) // step, 0)
+    else:
+        k = 0
+    empty = 0
+    while empty < MAX_EMPTY_PERIODS:
+        year, month = divmod(start_month + k * step, 12)
+        month += 1
+        if kind.startswith("absolute"):
+            day = _day_of_month(year, month, int(pattern.get("dayOfMonth") or first.day))
+        else:
+            day = _nth_weekday(year, month, _weekdays(pattern, first), pattern.get("index"))
+        if day is not None and day >= first:
+            empty = 0
+            yield day
+        else:
+            empty += 1
+        k += 1
+
+
+def occurrence_starts(
+    recurrence: dict, series_start: datetime, skip_to: datetime = None, time_zone: str = "UTC"
+) -> Iterator[datetime]:
+    """
+    Yields the start (UTC) of every occurrence of a Graph
+    patternedRecurrence, honouring its range. The pattern is applied to
+    wall-clock time in the recurrence time zone (`time_zone` if the range
+    names none), so occurrences keep their local time across DST changes.
+    """
+    pattern, range_ = recurrence.get("pattern") or {}, recurrence.get("range") or {}
+    zone = resolve_zone(range_.get("recurrenceTimeZone") or time_zone)
+    local_start = series_start.astimezone(zone)
+    first = date.fromisoformat(range_["startDate"]) if range_.get("startDate") else local_start.date()
+    range_type = range_.get("type", "noEnd")
+    end_date = date.fromisoformat(range_["endDate"]) if range_type == "endDate" and range_.get("endDate") else None
+    remaining = int(range_.get("numberOfOccurrences") or 0) if range_type == "numbered" else None
+
+    # A numbered range has to be counted from its first occurrence
+    skip_date = skip_to.astimezone(zone).date() if skip_to is not None and remaining is None else None
+    for day in pattern_dates(pattern, first, skip_date):
+        if end_date is not None and day > end_date:
+            return
+        if remaining is not None:
+            if remaining <= 0:
+                return
+            remaining -= 1
+        yield datetime.combine(day, local_start.time(), tzinfo=zone).astimezone(timezone.utc)
+
+
+def _graph_time(value: datetime) -> dict:
+    return {"dateTime": value.astimezone(timezone.utc).replace(tzinfo=None).isoformat(), "timeZone": "UTC"}
+
+
+def _occurrence(master: dict, start: datetime, duration: timedelta) -> dict:
+    occurrence = {key: value for key, value in master.items() if key not in _SERIES_ONLY}
+    occurrence.update(
+        type="occurrence",
+        seriesMasterId=master.get("id"),
+        originalStart=start.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        start=_graph_time(start),
+        end=_graph_time(start + duration),
+    )
+    return occurrence
+
+
+def expand(
+    master: dict,
+    start: datetime,
+    end: datetime,
+    instances: Iterable[dict] = (),
+    covered: Tuple[datetime, datetime] = None,
+) -> Iterator[dict]:
+    """
+    Lazily yields the occurrences of a series master that overlap
+    [start, end), ordered by start.
+
+    `instances` are occurrences and exceptions of the series already known
+    from Graph (calendarView); they replace the computed occurrence with the
+    same originalStart. Inside `covered`, the range those instances were
+    synced for, a computed occurrence without an instance was cancelled and
+    is left out. Outside it, the series pattern is all there is to go on.
+    """
+    series_start, series_end = event_bounds(master)
+    duration = series_end - series_start
+    recurrence = master.get("recurrence")
+    time_zone = master.get("originalStartTimeZone") or (master.get("start") or {}).get("timeZone") or "UTC"
+    if not recurrence:
+        if series_start < end and series_end > start:
+            yield master
+        return
+
+    known = set()
+    stored = []
+    for instance in instances:
+        if instance.get("originalStart"):
+            known.add(parse_graph_datetime(instance["originalStart"].replace("Z", "+00:00")).astimezone(timezone.utc))
+        instance_start, instance_end = event_bounds(instance)
+        if instance_start < end and instance_end > start:
+            stored.append((instance_start, instance))
+    stored.sort(key=lambda item: item[0])
+
+    def _computed():
+        for original in occurrence_starts(recurrence, series_start, start - duration, time_zone):
+            if original >= end:
+                return
+            if original + duration <= start or original in known:
+                continue
+            if covered is not None and covered[0] <= original and original + duration <= covered[1]:
+                continue
+            yield original, _occurrence(master, original, duration)
+
+    for _, occurrence in heapq.merge(_computed(), stored, key=lambda item: item[0]):
+        yield occurrence
@@ -0,0 +1,213 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Tuple
+
+from app.config import (
+    GRAPH_WRITE_CONCURRENCY,
+    GRAPH_WRITE_USER_CONCURRENCY,
+    GRAPH_WRITE_USER_QUEUE_DEPTH,
+    GRAPH_WRITE_MAX_QUEUED,
+    GRAPH_WRITE_QUEUE_TIMEOUT_SECONDS,
+    GRAPH_WRITE_QUANTUM,
+)
+
+
+class SchedulerFullError(Exception):
+    """
+    Raised instead of queueing a write the user has no room for.
+    """
+
+    def __init__(self, user: str, reason: str, retry_after: float = 1.0):
+        super().__init__(f"Too many pending writes for {user} ({reason})")
+        self.user = user
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _UserQueue:
+    __slots__ = ("running", "waiters", "deficit")
+
+    def __init__(self):
+        self.running = 0
+        self.waiters: Deque[Tuple[asyncio.Future, float]] = deque()
+        self.deficit = 0.0
+
+
+class FairScheduler:
+    """
+    Admits Graph writes per user: at most `per_user` of a user's writes run
+    at once and `queue_depth` more may wait; anything beyond is rejected
+    straight away. The `concurrency` slots of the worker are handed out
+    deficit round-robin over the users with waiting writes, so a user's turn
+    admits about `quantum` Graph requests' worth of work (a $batch costs its
+    number of sub-requests) and a bulk job cannot crowd out single writes.
+    """
+
+    def __init__(
+        self,
+        concurrency: int = GRAPH_WRITE_CONCURRENCY,
+        per_user: int = GRAPH_WRITE_USER_CONCURRENCY,
+        queue_depth: int = GRAPH_WRITE_USER_QUEUE_DEPTH,
+        max_queued: int = GRAPH_WRITE_MAX_QUEUED,
+        queue_timeout: float = GRAPH_WRITE_QUEUE_TIMEOUT_SECONDS,
+        quantum: float = GRAPH_WRITE_QUANTUM,
+    ):
+        self.concurrency = concurrency
+        self.per_user = per_user
+        self.queue_depth = queue_depth
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.quantum = quantum
+        self._free = concurrency
+        self._queued = 0
+        self._users: Dict[str, _UserQueue] = {}
+        # Users with waiting writes, in turn order; the head's quantum for
+        # the current turn is already credited when _head_credited is set
+        self._ring: Deque[str] = deque()
+        self._head_credited = False
+        self.granted = 0
+        self.queued_total = 0
+        self.rejected = {"queue_full": 0, "timeout": 0}
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def _next_turn(self, finished: bool):
+        if finished:
+            self._ring.popleft()
+        else:
+            self._ring.rotate(-1)
+        self._head_credited = False
+
+    def _dispatch(self):
+        blocked = 0
+        while self._free > 0 and blocked < len(self._ring):
+            user = self._ring[0]
+            queue = self._users[user]
+            if queue.running >= self.per_user:
+                self._next_turn(False)
+                blocked += 1
+                continue
+            blocked = 0
+            waiter, cost = queue.waiters[0]
+            if waiter.done():
+                # Timed out or cancelled; the waiting task cleans up the rest
+                queue.waiters.popleft()
+                self._queued -= 1
+                if not queue.waiters:
+                    queue.deficit = 0.0
+                    self._next_turn(True)
+                continue
+            if not self._head_credited:
+                queue.deficit += self.quantum
+                self._head_credited = True
+            if queue.deficit < cost:
+                self._next_turn(False)
+                continue
+            queue.waiters.popleft()
+            queue.deficit -= cost
+            queue.running += 1
+            self._free -= 1
+            self._queued -= 1
+            waiter.set_result(None)
+            if not queue.waiters:
+                queue.deficit = 0.0
+                self._next_turn(True)
+
+    def _forget_waiter(self, user: str, queue: _UserQueue, waiter: asyncio.Future):
+        for entry in queue.waiters:
+            if entry[0] is waiter:
+                queue.waiters.remove(entry)
+                self._queued -= 1
+                break
+        if not queue.waiters:
+            queue.deficit = 0.0
+            if self._ring and self._ring[0] == user:
+                self._next_turn(True)
+            elif user in self._ring:
+                self._ring.remove(user)
+            if not queue.running and self._users.get(user) is queue:
+                del self._users[user]
+
+    async def acquire(self, user: str, cost: float = 1.0, wait: bool = False):
+        """
+        Takes one of the user's write slots. With `wait`, for background
+        work that must not fail, it waits its turn however long the queue;
+        otherwise a full queue or a wait beyond queue_timeout raises
+        SchedulerFullError.
+        """
+        queue = self._users.get(user)
+        if queue is None:
+            queue = self._users[user] = _UserQueue()
+        if not queue.waiters and queue.running < self.per_user and self._free > 0:
+            queue.running += 1
+            self._free -= 1
+            self.granted += 1
+            return
+        if not wait and (len(queue.waiters) >= self.queue_depth or self._queued >= self.max_queued):
+            self.rejected["queue_full"] += 1
+            if not queue.waiters and not queue.running:
+                del self._users[user]
+            raise SchedulerFullError(user, "queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        queue.waiters.append((waiter, cost))
+        self._queued += 1
+        self.queued_total += 1
+        if len(queue.waiters) == 1:
+            self._ring.append(user)
+        started = time.monotonic()
+        try:
+            self._dispatch()
+            await asyncio.wait_for(waiter, None if wait else self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._forget_waiter(user, queue, waiter)
+            self.rejected["timeout"] += 1
+            raise SchedulerFullError(user, "timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Granted just as the caller went away
+                self.release(user)
+            else:
+                self._forget_waiter(user, queue, waiter)
+            raise
+        waited = time.monotonic() - started
+        self.granted += 1
+        self.wait_seconds += waited
+        self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+    def release(self, user: str):
+        queue = self._users[user]
+        queue.running -= 1
+        self._free += 1
+        if not queue.running and not queue.waiters:
+            del self._users[user]
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user: str, cost: float = 1.0, wait: bool = False):
+        await self.acquire(user, cost, wait)
+        try:
+            yield
+        finally:
+            self.release(user)
+
+    def stats(self) -> dict:
+        return {
+            "concurrency": self.concurrency,
+            "per_user": self.per_user,
+            "queue_depth": self.queue_depth,
+            "running": self.concurrency - self._free,
+            "queued": self._queued,
+            "active_users": len(self._users),
+            "waiting_users": len(self._ring),
+            "granted": self.granted,
+            "queued_total": self.queued_total,
+            "rejected": dict(self.rejected),
+            "wait_seconds": round(self.wait_seconds, 3),
+            "max_wait_seconds": round(self.max_wait_seconds, 3),
+        }
+
+
+write_scheduler = FairScheduler()
@@ -0,0 +1,47 @@
+import json
+from typing import Any
+
+from fastapi.responses import Response
+
+try:
+    import orjson
+except ImportError:  # optional; stdlib json is the fallback
+    orjson = None
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+def loads(data) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+class RawJSON(dict):
+    """
+    A parsed Graph JSON object that keeps the bytes it came from, so an
+    unchanged object can be sent to the client without encoding it again.
+    """
+
+    __slots__ = ("raw",)
+
+
+def parse_graph_json(content: bytes) -> Any:
+    value = loads(content)
+    if isinstance(value, dict):
+        value = RawJSON(value)
+        value.raw = content
+    return value
+
+
+def json_response(value: Any, status_code: int = 200, headers: dict = None) -> Response:
+    """
+    JSON response that skips FastAPI's jsonable_encoder pass. RawJSON goes
+    out as the bytes Graph sent.
+    """
+    content = value.raw if isinstance(value, RawJSON) else dumps(value)
+    return Response(content=content, status_code=status_code, headers=headers, media_type="application/json")
@@ -1,4 +1,9 @@
+import logging
+
 import jwt
+
+logger = logging.getLogger(__name__)
+
 # --- UPDATED HELPER FUNCTION ---
 def get_email_from_id_token(id_token: str) -> str:
     """
@@ -6,7 +11,7 @@ def get_email_from_id_token(id_token: str) -> str:
     possible claims.
     """
     if not id_token:
-        print("ID token is missing.")
+        logger.warning("ID token is missing.")
         return None
         
     try:
@@ -23,5 +28,17 @@ def get_email_from_id_token(id_token: str) -> str:
         return email
 
     except Exception as e:
-        print(f"Error decoding token: {e}")
-        return None
\ No newline at end of file
+        logger.warning("Error decoding token: %s", e)
+        return None
+
+def get_ids_from_id_token(id_token: str):
+    """
+    Returns the (tenant id, user object id) claims of the id_token, or
+    (None, None) if it cannot be read.
+    """
+    try:
+        claims = jwt.decode(id_token, options={"verify_signature": False}) if id_token else {}
+    except Exception as e:
+        logger.warning("Error decoding token: %s", e)
+        claims = {}
+    return claims.get("tid"), claims.get("oid")
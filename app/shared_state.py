@@ -0,0 +1,245 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from typing import Callable, Dict, List, Optional
+
+from app.config import SHARED_STATE_URL, SHARED_STATE_PREFIX
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = "invalidate"
+
+# Identifies this worker on the invalidation channel, so it skips its own messages
+NODE_ID = uuid.uuid4().hex
+
+
+class InProcessState:
+    """
+    Shared state for a single worker, kept in a dict. Used when
+    SHARED_STATE_URL is not set.
+    """
+
+    distributed = False
+
+    def __init__(self):
+        self._values = {}  # key -> (value, expires_at on the monotonic clock or None)
+
+    def _live(self, key: str) -> Optional[str]:
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self._values[key]
+            return None
+        return value
+
+    def _put(self, key: str, value: str, ttl: Optional[float]):
+        self._values[key] = (value, time.monotonic() + ttl if ttl else None)
+
+    async def get(self, key: str) -> Optional[str]:
+        return self._live(key)
+
+    async def set(self, key: str, value: str, ttl: float = None):
+        self._put(key, value, ttl)
+
+    async def set_if_absent(self, key: str, value: str, ttl: float) -> bool:
+        if self._live(key) is not None:
+            return False
+        self._put(key, value, ttl)
+        return True
+
+    async def delete(self, key: str):
+        self._values.pop(key, None)
+
+    async def compare_and_delete(self, key: str, value: str) -> bool:
+        if self._live(key) != value:
+            return False
+        del self._values[key]
+        return True
+
+    async def incr(self, key: str, ttl: float, amount: int = 1) -> int:
+        current = self._live(key)
+        count = int(current or 0) + amount
+        self._values[key] = (str(count), self._values[key][1] if current is not None else time.monotonic() + ttl)
+        return count
+
+    async def publish(self, channel: str, message: str):
+        # Nobody else to tell
+        pass
+
+    async def start(self, on_message: Callable[[str], None]):
+        pass
+
+    async def close(self):
+        self._values.clear()
+
+
+class RedisState:
+    """
+    Shared state in Redis (or anything speaking its protocol), so several
+    workers and nodes see the same tokens, locks, rate limits and
+    idempotency records. Needs the optional `redis` package.
+    """
+
+    distributed = True
+
+    def __init__(self, url: str, prefix: str = SHARED_STATE_PREFIX):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError("SHARED_STATE_URL points at Redis but the `redis` package is not installed") from e
+        # RESP2 works with every Redis-compatible server, including bench/fake_redis.py
+        self._redis = redis.from_url(url, decode_responses=True, protocol=2)
+        self._prefix = prefix
+        self._pubsub = None
+        self._listener = None
+
+    def _key(self, key: str) -> str:
+        return self._prefix + key
+
+    async def get(self, key: str) -> Optional[str]:
+        return await self._redis.get(self._key(key))
+
+    async def set(self, key: str, value: str, ttl: float = None):
+        await self._redis.set(self._key(key), value, px=int(ttl * 1000) if ttl else None)
+
+    async def set_if_absent(self, key: str, value: str, ttl: float) -> bool:
+        return bool(await self._redis.set(self._key(key), value, px=int(ttl * 1000), nx=True))
+
+    async def delete(self, key: str):
+        await self._redis.delete(self._key(key))
+
+    async def compare_and_delete(self, key: str, value: str) -> bool:
+        from redis.exceptions import WatchError
+
+        key = self._key(key)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if await pipe.get(key) != value:
+                    await pipe.unwatch()
+                    return False
+                pipe.multi()
+                pipe.delete(key)
+                await pipe.execute()
+                return True
+            except WatchError:
+                return False
+
+    async def incr(self, key: str, ttl: float, amount: int = 1) -> int:
+        key = self._key(key)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            pipe.incrby(key, amount)
+            pipe.pexpire(key, int(ttl * 1000))
+            count, _ = await pipe.execute()
+        return count
+
+    async def publish(self, channel: str, message: str):
+        await self._redis.publish(self._key(channel), message)
+
+    async def start(self, on_message: Callable[[str], None]):
+        self._pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self._key(INVALIDATION_CHANNEL))
+
+        async def _listen():
+            while True:
+                try:
+                    async for message in self._pubsub.listen():
+                        if message.get("type") == "message":
+                            on_message(message["data"])
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.warning("Shared state listener failed, resubscribing: %s", e)
+                    await asyncio.sleep(1)
+
+        self._listener = asyncio.ensure_future(_listen())
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            await asyncio.gather(self._listener, return_exceptions=True)
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+            self._pubsub = None
+        await self._redis.aclose()
+
+
+def build_state(url: Optional[str]):
+    if not url:
+        return InProcessState()
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisState(url)
+    raise ValueError(f"Unsupported SHARED_STATE_URL scheme: {url}")
+
+
+state = build_state(SHARED_STATE_URL)
+
+_handlers: Dict[str, List[Callable[[str], None]]] = {}
+_background = set()
+
+
+def spawn(coro):
+    """
+    Runs a shared state write without waiting for it; failures are logged.
+    """
+    task = asyncio.ensure_future(coro)
+    _background.add(task)
+
+    def _done(task):
+        _background.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Shared state update failed: %s", task.exception())
+
+    task.add_done_callback(_done)
+
+
+def on_invalidate(kind: str, handler: Callable[[str], None]):
+    """
+    Registers handler(key), called when another worker broadcasts `kind`.
+    """
+    _handlers.setdefault(kind, []).append(handler)
+
+
+def broadcast(kind: str, key: str):
+    """
+    Tells the other workers to drop their local copy of `key`.
+    """
+    if state.distributed:
+        spawn(state.publish(INVALIDATION_CHANNEL, json.dumps({"origin": NODE_ID, "kind": kind, "key": key})))
+
+
+def _dispatch(raw: str):
+    try:
+        message = json.loads(raw)
+    except ValueError:
+        return
+    if message.get("origin") == NODE_ID:
+        return
+    for handler in _handlers.get(message.get("kind"), []):
+        handler(message.get("key"))
+
+
+async def acquire_lock(name: str, ttl: float) -> Optional[str]:
+    """
+    Returns a lock token, or None if someone else holds the lock. The lock
+    expires after `ttl` seconds even if its holder dies.
+    """
+    token = uuid.uuid4().hex
+    return token if await state.set_if_absent(f"lock:{name}", token, ttl) else None
+
+
+async def release_lock(name: str, token: str):
+    await state.compare_and_delete(f"lock:{name}", token)
+
+
+async def start():
+    await state.start(_dispatch)
+
+
+async def close():
+    await state.close()
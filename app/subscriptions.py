@@ -0,0 +1,270 @@
+import asyncio
+import hmac
+import logging
+import secrets
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Iterable, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.availability import availability
+from app.config import (
+    NOTIFICATION_URL,
+    SUBSCRIPTION_LIFETIME_MINUTES,
+    SUBSCRIPTION_RENEW_BEFORE_SECONDS,
+    SUBSCRIPTION_SCAN_INTERVAL_SECONDS,
+    NOTIFICATION_DEBOUNCE_SECONDS,
+    TOKEN_REFRESH_CONCURRENCY,
+)
+from app.db import AsyncSessionLocal, GraphSubscription
+from app.event_store import event_store
+from app.graph_api import create_subscription, delete_subscription, renew_subscription
+from app.timezones import parse_graph_datetime
+
+logger = logging.getLogger(__name__)
+
+RESOURCE = "/me/events"
+
+
+def _expiration() -> datetime:
+    return datetime.utcnow() + timedelta(minutes=SUBSCRIPTION_LIFETIME_MINUTES)
+
+
+def _graph_time(value: datetime) -> str:
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def _utc_naive(value: str) -> datetime:
+    return parse_graph_datetime(value).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def subscription_info(subscription: GraphSubscription) -> dict:
+    return {
+        "id": subscription.id,
+        "resource": subscription.resource,
+        "expires_at": subscription.expires_at.isoformat(),
+        "created_at": subscription.created_at.isoformat(),
+    }
+
+
+class SubscriptionManager:
+    """
+    Keeps one Graph change-notification subscription per user on /me/events,
+    renews it before it expires, and turns incoming notifications into
+    delta syncs of the event store. Notifications are collected for
+    NOTIFICATION_DEBOUNCE_SECONDS, so a burst of changes costs one
+    incremental sync per user.
+    """
+
+    def __init__(
+        self,
+        renew_before_seconds: int = SUBSCRIPTION_RENEW_BEFORE_SECONDS,
+        interval_seconds: int = SUBSCRIPTION_SCAN_INTERVAL_SECONDS,
+        debounce_seconds: float = NOTIFICATION_DEBOUNCE_SECONDS,
+        concurrency: int = TOKEN_REFRESH_CONCURRENCY,
+    ):
+        self.renew_before_seconds = renew_before_seconds
+        self.interval_seconds = interval_seconds
+        self.debounce_seconds = debounce_seconds
+        self.concurrency = concurrency
+        self._token_provider: Optional[Callable[[str], Awaitable[str]]] = None
+        self._known = {}  # subscription id -> (email, client_state)
+        self._pending: Set[str] = set()
+        self._flush_task = None
+        self._task = None
+        self._background = set()
+        self.notifications_received = 0
+        self.notifications_rejected = 0
+        self.syncs = 0
+        self.renewals = 0
+
+    # --- Subscription lifecycle ---
+
+    async def subscribe(self, db: AsyncSession, email: str, access_token: str) -> GraphSubscription:
+        if not NOTIFICATION_URL:
+            raise HTTPException(status_code=503, detail="Change notifications are not configured (NOTIFICATION_URL is not set)")
+        existing = (await db.execute(
+            select(GraphSubscription).where(GraphSubscription.email == email, GraphSubscription.expires_at > datetime.utcnow())
+        )).scalars().first()
+        if existing is not None:
+            return existing
+
+        client_state = secrets.token_urlsafe(32)
+        expires_at = _expiration()
+        created = await create_subscription(access_token, RESOURCE, NOTIFICATION_URL, _graph_time(expires_at), client_state)
+        subscription = GraphSubscription(
+            id=created["id"],
+            email=email,
+            resource=RESOURCE,
+            client_state=client_state,
+            expires_at=_utc_naive(created["expirationDateTime"]) if created.get("expirationDateTime") else expires_at,
+            created_at=datetime.utcnow(),
+        )
+        await db.execute(delete(GraphSubscription).where(GraphSubscription.email == email))
+        db.add(subscription)
+        await db.commit()
+        self._known[subscription.id] = (email, client_state)
+        return subscription
+
+    async def list(self, db: AsyncSession, email: str) -> List[GraphSubscription]:
+        return list((await db.execute(select(GraphSubscription).where(GraphSubscription.email == email))).scalars().all())
+
+    async def unsubscribe(self, db: AsyncSession, email: str, access_token: Optional[str]) -> int:
+        """
+        Drops the user's subscriptions. Graph is told as well when a token is
+        at hand; otherwise the subscription lapses on its own and its
+        notifications are ignored.
+        """
+        subscriptions = await self.list(db, email)
+        for subscription in subscriptions:
+            self._known.pop(subscription.id, None)
+            if access_token:
+                try:
+                    await delete_subscription(access_token, subscription.id)
+                except Exception as e:
+                    logger.warning("Deleting subscription %s failed: %s", subscription.id, e)
+        await db.execute(delete(GraphSubscription).where(GraphSubscription.email == email))
+        await db.commit()
+        return len(subscriptions)
+
+    async def _renew(self, subscription_id: str, email: str):
+        access_token = await self._token_provider(email)
+        expires_at = _expiration()
+        renewed = await renew_subscription(access_token, subscription_id, _graph_time(expires_at))
+        async with AsyncSessionLocal() as db:
+            if renewed is None:
+                # Graph dropped it (expired or removed); start a new one
+                self._known.pop(subscription_id, None)
+                await db.execute(delete(GraphSubscription).where(GraphSubscription.id == subscription_id))
+                await db.commit()
+                await self.subscribe(db, email, access_token)
+                # Changes may have been missed while there was no subscription
+                self._enqueue(email)
+                return
+            subscription = await db.get(GraphSubscription, subscription_id)
+            if subscription is not None:
+                subscription.expires_at = _utc_naive(renewed["expirationDateTime"]) if renewed.get("expirationDateTime") else expires_at
+                await db.commit()
+        self.renewals += 1
+
+    async def run_once(self) -> int:
+        deadline = datetime.utcnow() + timedelta(seconds=self.renew_before_seconds)
+        async with AsyncSessionLocal() as db:
+            due = (await db.execute(
+                select(GraphSubscription.id, GraphSubscription.email).where(GraphSubscription.expires_at < deadline)
+            )).all()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _renew_one(subscription_id, email):
+            async with semaphore:
+                try:
+                    await self._renew(subscription_id, email)
+                except Exception as e:
+                    logger.warning("Renewing subscription %s for %s failed: %s", subscription_id, email, e)
+
+        await asyncio.gather(*(_renew_one(row.id, row.email) for row in due))
+        return len(due)
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.exception("Subscription renewal scan failed: %s", e)
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self, token_provider: Callable[[str], Awaitable[str]]):
+        self._token_provider = token_provider
+        if self._task is None and NOTIFICATION_URL:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self):
+        tasks = [task for task in (self._task, self._flush_task) if task is not None] + list(self._background)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._task = None
+        self._flush_task = None
+        self._background.clear()
+
+    # --- Notifications ---
+
+    async def _lookup(self, subscription_id: str) -> Optional[Tuple[str, str]]:
+        known = self._known.get(subscription_id)
+        if known is None:
+            async with AsyncSessionLocal() as db:
+                subscription = await db.get(GraphSubscription, subscription_id)
+            if subscription is None:
+                return None
+            known = self._known[subscription_id] = (subscription.email, subscription.client_state)
+        return known
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _enqueue(self, email: str):
+        self._pending.add(email)
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._flush())
+
+    async def accept(self, notifications: Iterable[dict]) -> int:
+        """
+        Validates a notification payload and queues the affected users.
+        Returns how many notifications were accepted.
+        """
+        accepted = 0
+        for notification in notifications:
+            self.notifications_received += 1
+            known = await self._lookup(notification.get("subscriptionId", ""))
+            if known is None or not hmac.compare_digest(known[1], notification.get("clientState") or ""):
+                self.notifications_rejected += 1
+                continue
+            email = known[0]
+            accepted += 1
+            lifecycle_event = notification.get("lifecycleEvent")
+            if lifecycle_event in ("reauthorizationRequired", "subscriptionRemoved"):
+                self._spawn(self._renew(notification["subscriptionId"], email))
+            else:
+                # Change notifications and "missed" both mean: sync this user
+                self._enqueue(email)
+        return accepted
+
+    async def _flush(self):
+        await asyncio.sleep(self.debounce_seconds)
+        emails, self._pending = self._pending, set()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def _sync_one(email):
+            async with semaphore:
+                availability.invalidate_mailbox(email)
+                if not event_store.has(email):
+                    # Nothing cached for this user; the next read syncs anyway
+                    return
+                try:
+                    await event_store.sync(email, await self._token_provider(email))
+                    self.syncs += 1
+                except Exception as e:
+                    logger.warning("Notification sync for %s failed: %s", email, e)
+
+        await asyncio.gather(*(_sync_one(email) for email in emails))
+        if self._pending:
+            # More arrived while syncing; they get their own window
+            self._flush_task = asyncio.ensure_future(self._flush())
+
+    def stats(self) -> dict:
+        return {
+            "enabled": bool(NOTIFICATION_URL),
+            "known_subscriptions": len(self._known),
+            "pending_users": len(self._pending),
+            "notifications_received": self.notifications_received,
+            "notifications_rejected": self.notifications_rejected,
+            "syncs": self.syncs,
+            "renewals": self.renewals,
+        }
+
+
+subscriptions = SubscriptionManager()
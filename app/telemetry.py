@@ -0,0 +1,174 @@
+import contextvars
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from threading import Lock
+from typing import Callable, Dict, List, Tuple
+
+from app.config import TELEMETRY_ENABLED, OTEL_ENABLED
+
+# Upper bounds in seconds, from sub-millisecond cache hits to slow upstream calls
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+HELP = {
+    "http_request_duration_seconds": "Latency of API requests by route",
+    "stage_duration_seconds": "Latency of hot-path stages by endpoint",
+    "upstream_request_duration_seconds": "Latency of calls to Graph and Azure AD",
+}
+
+# ASGI scope of the request being served, so spans can be labelled by route
+_current_scope = contextvars.ContextVar("current_scope", default=None)
+
+_NOOP = nullcontext()
+_tracer = None
+if TELEMETRY_ENABLED and OTEL_ENABLED:
+    try:
+        from opentelemetry import trace
+
+        _tracer = trace.get_tracer("ms-calendar-app")
+    except ImportError:
+        _tracer = None
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+_histograms: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], Histogram] = {}
+_lock = Lock()
+_span_hooks: List[Callable[[str, float, dict], None]] = []
+
+
+def add_span_hook(hook: Callable[[str, float, dict], None]):
+    """
+    Registers hook(name, duration_seconds, labels), called after every span.
+    """
+    _span_hooks.append(hook)
+
+
+def observe(metric: str, value: float, **labels):
+    if not TELEMETRY_ENABLED:
+        return
+    key = (metric, tuple(sorted(labels.items())))
+    histogram = _histograms.get(key)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(key, Histogram())
+    histogram.observe(value)
+
+
+def current_endpoint() -> str:
+    scope = _current_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return getattr(route, "path", None) or scope.get("path", "unknown")
+
+
+@contextmanager
+def _span(name: str, labels: dict):
+    endpoint = current_endpoint()
+    otel_span = _tracer.start_as_current_span(name, attributes=labels) if _tracer else _NOOP
+    started = time.perf_counter()
+    with otel_span:
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            observe("stage_duration_seconds", duration, stage=name, endpoint=endpoint)
+            for hook in _span_hooks:
+                hook(name, duration, {"endpoint": endpoint, **labels})
+
+
+def span(name: str, **labels):
+    """
+    Times a hot-path stage. Returns a shared no-op context when telemetry
+    is disabled, so instrumented code pays almost nothing.
+    """
+    if not TELEMETRY_ENABLED:
+        return _NOOP
+    return _span(name, labels)
+
+
+class TelemetryMiddleware:
+    """
+    Pure ASGI middleware recording request latency by route template.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        token = _current_scope.set(scope)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            observe(
+                "http_request_duration_seconds",
+                time.perf_counter() - started,
+                method=scope["method"],
+                route=current_endpoint(),
+                status=str(status["code"]),
+            )
+            _current_scope.reset(token)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra: str = "") -> str:
+    parts = [f'{key}="{_escape(value)}"' for key, value in labels]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def render_prometheus(samples: List[Tuple[str, str, dict, float]] = ()) -> str:
+    """
+    Prometheus text exposition of all histograms plus extra samples given
+    as (name, type, labels, value), e.g. gauges read from other modules.
+    """
+    lines = []
+    with _lock:
+        items = sorted(_histograms.items())
+    seen = set()
+    for (metric, labels), histogram in items:
+        if metric not in seen:
+            seen.add(metric)
+            lines.append(f"# HELP {metric} {HELP.get(metric, metric)}")
+            lines.append(f"# TYPE {metric} histogram")
+        cumulative = 0
+        for bound, count in zip(BUCKETS + (float("inf"),), histogram.counts):
+            cumulative += count
+            le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+            lines.append(f"{metric}_bucket{_format_labels(labels, le)} {cumulative}")
+        lines.append(f"{metric}_sum{_format_labels(labels)} {histogram.sum}")
+        lines.append(f"{metric}_count{_format_labels(labels)} {histogram.count}")
+    for name, metric_type, labels, value in samples:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# TYPE {name} {metric_type}")
+        lines.append(f"{name}{_format_labels(sorted(labels.items()))} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,262 @@
+import asyncio
+import hashlib
+import random
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import Optional, Tuple
+
+import jwt
+
+from app.config import (
+    GRAPH_USER_RATE,
+    GRAPH_USER_BURST,
+    GRAPH_TENANT_RATE,
+    GRAPH_TENANT_BURST,
+    GRAPH_BACKOFF_BASE,
+    GRAPH_BACKOFF_MAX,
+    GRAPH_MAX_RETRY_AFTER,
+    GRAPH_BREAKER_FAILURE_THRESHOLD,
+    GRAPH_BREAKER_RECOVERY_SECONDS,
+)
+from app import shared_state
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised instead of calling Graph while the route's circuit is open.
+    """
+
+    def __init__(self, route: str, retry_after: float):
+        super().__init__(f"Graph circuit for {route} is open")
+        self.route = route
+        self.retry_after = retry_after
+
+
+@lru_cache(maxsize=4096)
+def token_identity(access_token: str) -> Tuple[str, str]:
+    """
+    Returns (user_key, tenant_key) for rate limiting. Work/school access
+    tokens are JWTs carrying oid/tid; opaque tokens fall back to a hash.
+    """
+    try:
+        claims = jwt.decode(access_token, options={"verify_signature": False})
+        user = claims.get("oid") or claims.get("upn") or claims.get("preferred_username")
+        tenant = claims.get("tid")
+    except Exception:
+        user, tenant = None, None
+    if not user:
+        user = hashlib.sha1(access_token.encode()).hexdigest()[:16]
+    return user, tenant or "common"
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        try:
+            seconds = (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), GRAPH_MAX_RETRY_AFTER)
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Exponential backoff with full jitter.
+    """
+    return random.uniform(0, min(GRAPH_BACKOFF_MAX, GRAPH_BACKOFF_BASE * (2 ** attempt)))
+
+
+class TokenBucket:
+    """
+    Token bucket that hands out reservations instead of blocking: the
+    caller sleeps for the returned delay, which keeps waiters in FIFO order.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self) -> float:
+        self._refill(time.monotonic())
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def block_for(self, seconds: float):
+        """
+        Empties the bucket so that nothing is admitted for `seconds`.
+        """
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class RateLimiter:
+    """
+    Per-user and per-tenant token buckets in front of Graph.
+
+    With distributed shared state the limits apply across all workers
+    instead, counted in one-second windows; bursts above the rate are not
+    allowed there.
+    """
+
+    def __init__(self, max_buckets: int = 50000):
+        self.max_buckets = max_buckets
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+
+    def _bucket(self, key: str, rate: float, capacity: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, capacity)
+            while len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        self._buckets.move_to_end(key)
+        return bucket
+
+    async def _acquire_shared(self, user: str, tenant: str) -> float:
+        state = shared_state.state
+        waited = 0.0
+        while True:
+            now = time.time()
+            blocked_until = await state.get(f"ratelimit:block:{user}")
+            if blocked_until is not None and float(blocked_until) > now:
+                delay = float(blocked_until) - now
+            else:
+                window = int(now)
+                keys = (f"ratelimit:user:{user}:{window}", f"ratelimit:tenant:{tenant}:{window}")
+                user_count, tenant_count = await asyncio.gather(*(state.incr(key, 2) for key in keys))
+                if user_count <= max(1, int(GRAPH_USER_RATE)) and tenant_count <= max(1, int(GRAPH_TENANT_RATE)):
+                    return waited
+                # Not sent in this window, so it must not use up the tenant's
+                # (or its own next attempt's) share of it
+                await asyncio.gather(*(state.incr(key, 2, -1) for key in keys))
+                delay = window + 1 - now
+            await asyncio.sleep(delay)
+            waited += delay
+
+    async def acquire(self, user: str, tenant: str) -> float:
+        """
+        Waits until both buckets admit the request and returns the wait.
+        """
+        if shared_state.state.distributed:
+            return await self._acquire_shared(user, tenant)
+        delay = max(
+            self._bucket(f"user:{user}", GRAPH_USER_RATE, GRAPH_USER_BURST).reserve(),
+            self._bucket(f"tenant:{tenant}", GRAPH_TENANT_RATE, GRAPH_TENANT_BURST).reserve(),
+        )
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return delay
+
+    def throttled(self, user: str, retry_after: float):
+        self._bucket(f"user:{user}", GRAPH_USER_RATE, GRAPH_USER_BURST).block_for(retry_after)
+        if shared_state.state.distributed:
+            shared_state.spawn(shared_state.state.set(f"ratelimit:block:{user}", str(time.time() + retry_after), retry_after))
+
+
+class CircuitBreaker:
+    """
+    Opens after GRAPH_BREAKER_FAILURE_THRESHOLD consecutive failures, lets
+    one trial request through after the recovery period, and closes again
+    on success. A trial that never reports back is given up after another
+    recovery period, so the circuit cannot stay half open for good.
+    """
+
+    def __init__(self, failure_threshold: int = GRAPH_BREAKER_FAILURE_THRESHOLD, recovery_seconds: float = GRAPH_BREAKER_RECOVERY_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_started_at = 0.0
+        self.times_opened = 0
+
+    def allow(self, route: str):
+        now = time.monotonic()
+        if self.state == "open":
+            remaining = self.opened_at + self.recovery_seconds - now
+            if remaining > 0:
+                raise CircuitOpenError(route, remaining)
+            self.state = "half_open"
+            self.trial_started_at = now
+        elif self.state == "half_open":
+            # Only one trial request at a time
+            remaining = self.trial_started_at + self.recovery_seconds - now
+            if remaining > 0:
+                raise CircuitOpenError(route, remaining)
+            self.trial_started_at = now
+
+    def abandon(self):
+        """
+        For a request that ended without an outcome (cancelled, or failed
+        before reaching Graph): if it was the trial, the circuit opens again.
+        """
+        if self.state == "half_open":
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        self.state = "closed"
+        self.failures = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == "half_open" or self.failures >= self.failure_threshold:
+            if self.state != "open":
+                self.times_opened += 1
+            self.state = "open"
+            self.opened_at = time.monotonic()
+
+
+class ThrottleMetrics:
+    def __init__(self):
+        self.throttle_events = {}  # route -> count of 429/503 responses
+        self.retries = {}
+        self.rate_limit_wait_seconds = 0.0
+        self.retry_wait_seconds = 0.0
+        self.circuit_rejections = 0
+
+    def record_throttle(self, route: str):
+        self.throttle_events[route] = self.throttle_events.get(route, 0) + 1
+
+    def record_retry(self, route: str, delay: float):
+        self.retries[route] = self.retries.get(route, 0) + 1
+        self.retry_wait_seconds += delay
+
+
+rate_limiter = RateLimiter()
+metrics = ThrottleMetrics()
+breakers = {}
+
+
+def breaker_for(route: str) -> CircuitBreaker:
+    breaker = breakers.get(route)
+    if breaker is None:
+        breaker = breakers[route] = CircuitBreaker()
+    return breaker
+
+
+def stats() -> dict:
+    return {
+        "throttle_events": dict(metrics.throttle_events),
+        "retries": dict(metrics.retries),
+        "rate_limit_wait_seconds": round(metrics.rate_limit_wait_seconds, 3),
+        "retry_wait_seconds": round(metrics.retry_wait_seconds, 3),
+        "circuit_rejections": metrics.circuit_rejections,
+        "circuits": {
+            route: {"state": breaker.state, "failures": breaker.failures, "times_opened": breaker.times_opened}
+            for route, breaker in breakers.items()
+        },
+    }
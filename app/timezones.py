@@ -0,0 +1,168 @@
+import re
+from datetime import datetime, timezone
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+# Windows time zone names Graph and Outlook use, mapped to IANA (CLDR "001" territory)
+WINDOWS_TO_IANA = {
+    "Dateline Standard Time": "Etc/GMT+12",
+    "UTC-11": "Etc/GMT+11",
+    "Hawaiian Standard Time": "Pacific/Honolulu",
+    "Alaskan Standard Time": "America/Anchorage",
+    "Pacific Standard Time": "America/Los_Angeles",
+    "Pacific Standard Time (Mexico)": "America/Tijuana",
+    "US Mountain Standard Time": "America/Phoenix",
+    "Mountain Standard Time": "America/Denver",
+    "Mountain Standard Time (Mexico)": "America/Mazatlan",
+    "Central America Standard Time": "America/Guatemala",
+    "Central Standard Time": "America/Chicago",
+    "Central Standard Time (Mexico)": "America/Mexico_City",
+    "Canada Central Standard Time": "America/Regina",
+    "SA Pacific Standard Time": "America/Bogota",
+    "Eastern Standard Time": "America/New_York",
+    "Eastern Standard Time (Mexico)": "America/Cancun",
+    "US Eastern Standard Time": "America/Indianapolis",
+    "Venezuela Standard Time": "America/Caracas",
+    "Atlantic Standard Time": "America/Halifax",
+    "SA Western Standard Time": "America/La_Paz",
+    "Pacific SA Standard Time": "America/Santiago",
+    "Newfoundland Standard Time": "America/St_Johns",
+    "E. South America Standard Time": "America/Sao_Paulo",
+    "Argentina Standard Time": "America/Buenos_Aires",
+    "SA Eastern Standard Time": "America/Cayenne",
+    "Greenland Standard Time": "America/Godthab",
+    "UTC-02": "Etc/GMT+2",
+    "Azores Standard Time": "Atlantic/Azores",
+    "Cape Verde Standard Time": "Atlantic/Cape_Verde",
+    "UTC": "Etc/UTC",
+    "GMT Standard Time": "Europe/London",
+    "Greenwich Standard Time": "Atlantic/Reykjavik",
+    "Morocco Standard Time": "Africa/Casablanca",
+    "W. Europe Standard Time": "Europe/Berlin",
+    "Central Europe Standard Time": "Europe/Budapest",
+    "Romance Standard Time": "Europe/Paris",
+    "Central European Standard Time": "Europe/Warsaw",
+    "W. Central Africa Standard Time": "Africa/Lagos",
+    "GTB Standard Time": "Europe/Bucharest",
+    "E. Europe Standard Time": "Europe/Chisinau",
+    "Egypt Standard Time": "Africa/Cairo",
+    "South Africa Standard Time": "Africa/Johannesburg",
+    "FLE Standard Time": "Europe/Kiev",
+    "Israel Standard Time": "Asia/Jerusalem",
+    "Jordan Standard Time": "Asia/Amman",
+    "Turkey Standard Time": "Europe/Istanbul",
+    "Arab Standard Time": "Asia/Riyadh",
+    "Russian Standard Time": "Europe/Moscow",
+    "E. Africa Standard Time": "Africa/Nairobi",
+    "Iran Standard Time": "Asia/Tehran",
+    "Arabian Standard Time": "Asia/Dubai",
+    "Afghanistan Standard Time": "Asia/Kabul",
+    "Pakistan Standard Time": "Asia/Karachi",
+    "West Asia Standard Time": "Asia/Tashkent",
+    "India Standard Time": "Asia/Calcutta",
+    "Sri Lanka Standard Time": "Asia/Colombo",
+    "Nepal Standard Time": "Asia/Katmandu",
+    "Central Asia Standard Time": "Asia/Almaty",
+    "Bangladesh Standard Time": "Asia/Dhaka",
+    "Myanmar Standard Time": "Asia/Rangoon",
+    "SE Asia Standard Time": "Asia/Bangkok",
+    "China Standard Time": "Asia/Shanghai",
+    "Singapore Standard Time": "Asia/Singapore",
+    "Taipei Standard Time": "Asia/Taipei",
+    "W. Australia Standard Time": "Australia/Perth",
+    "Tokyo Standard Time": "Asia/Tokyo",
+    "Korea Standard Time": "Asia/Seoul",
+    "Cen. Australia Standard Time": "Australia/Adelaide",
+    "AUS Central Standard Time": "Australia/Darwin",
+    "E. Australia Standard Time": "Australia/Brisbane",
+    "AUS Eastern Standard Time": "Australia/Sydney",
+    "West Pacific Standard Time": "Pacific/Port_Moresby",
+    "Tasmania Standard Time": "Australia/Hobart",
+    "Central Pacific Standard Time": "Pacific/Guadalcanal",
+    "New Zealand Standard Time": "Pacific/Auckland",
+    "Fiji Standard Time": "Pacific/Fiji",
+    "Tonga Standard Time": "Pacific/Tongatapu",
+}
+
+
+@lru_cache(maxsize=512)
+def _zone(name: str):
+    if name.upper() == "UTC":
+        return timezone.utc
+    return ZoneInfo(WINDOWS_TO_IANA.get(name, name))
+
+
+def validate_zone(name: str) -> str:
+    """
+    Returns `name` if it is an IANA or Windows time zone name; raises
+    ValueError otherwise.
+    """
+    try:
+        _zone(name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        raise ValueError(f"Unknown time zone: {name}")
+    return name
+
+
+def resolve_zone(name: str):
+    """
+    Returns a tzinfo for a Graph timeZone name (IANA or Windows), falling
+    back to UTC.
+    """
+    if not name:
+        return timezone.utc
+    try:
+        return _zone(name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        return timezone.utc
+
+
+# Fractional seconds of an ISO 8601 time, e.g. the "0000000" in "09:00:00.0000000Z"
+_FRACTION = re.compile(r"[T ]\d{2}:\d{2}:\d{2}\.(\d+)")
+
+
+def parse_graph_datetime(value: str, time_zone: str = "UTC") -> datetime:
+    """
+    Parses a Graph dateTimeTimeZone value into an aware datetime.
+    Graph sends seven fractional digits, which fromisoformat does not accept;
+    they are cut (or padded) to six, keeping any Z or offset after them.
+    """
+    match = _FRACTION.search(value)
+    if match:
+        value = f"{value[:match.start(1)]}{match.group(1)[:6].ljust(6, '0')}{value[match.end(1):]}"
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=resolve_zone(time_zone))
+    return parsed
+
+
+@lru_cache(maxsize=4096)
+def to_graph_datetime(value: str, time_zone: str) -> str:
+    """
+    Graph dateTime for an ISO 8601 input: naive values are kept as wall
+    time in `time_zone`, values with an offset are converted into it.
+    """
+    parsed = parse_graph_datetime(value.replace("Z", "+00:00"), time_zone)
+    return parsed.astimezone(resolve_zone(time_zone)).replace(tzinfo=None).isoformat()
+
+
+def event_bounds(event: dict):
+    """
+    Returns the (start, end) of a Graph event as aware datetimes.
+    """
+    start, end = event.get("start") or {}, event.get("end") or {}
+    return (
+        parse_graph_datetime(start["dateTime"], start.get("timeZone", "UTC")),
+        parse_graph_datetime(end["dateTime"], end.get("timeZone", "UTC")),
+    )
+
+
+def parse_query_datetime(value: str) -> datetime:
+    """
+    Parses an ISO 8601 query parameter; naive values are treated as UTC.
+    """
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
@@ -0,0 +1,124 @@
+import json
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+from typing import Optional
+
+from app.config import TOKEN_CACHE_MAX_SIZE, TOKEN_CACHE_TTL_SECONDS, EXPIRATION_BUFFER_SECONDS
+from app import shared_state
+
+
+class TokenCache:
+    """
+    In-process LRU cache of access tokens keyed by email.
+
+    An entry is served only while it is younger than the TTL and the token
+    is outside the refresh buffer, so callers never get a stale access token
+    and refresh ahead of expiry instead of being handed one about to expire.
+    """
+
+    def __init__(
+        self,
+        max_size: int = TOKEN_CACHE_MAX_SIZE,
+        ttl_seconds: int = TOKEN_CACHE_TTL_SECONDS,
+        buffer_seconds: int = EXPIRATION_BUFFER_SECONDS,
+    ):
+        self.max_size = max_size
+        self.ttl = timedelta(seconds=ttl_seconds)
+        self.buffer = timedelta(seconds=buffer_seconds)
+        self._entries = OrderedDict()  # email -> (access_token, expires_at, valid_until)
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, email: str) -> Optional[str]:
+        now = datetime.utcnow()
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None:
+                self.misses += 1
+                return None
+            access_token, _, valid_until = entry
+            if now >= valid_until:
+                del self._entries[email]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(email)
+            self.hits += 1
+            return access_token
+
+    def set(self, email: str, access_token: str, expires_at: datetime):
+        valid_until = min(expires_at - self.buffer, datetime.utcnow() + self.ttl)
+        with self._lock:
+            self._entries[email] = (access_token, expires_at, valid_until)
+            self._entries.move_to_end(email)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, email: str):
+        with self._lock:
+            if self._entries.pop(email, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "max_size": self.max_size,
+            "ttl_seconds": int(self.ttl.total_seconds()),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+token_cache = TokenCache()
+shared_state.on_invalidate("token", token_cache.invalidate)
+
+
+async def lookup_token(email: str) -> Optional[str]:
+    """
+    Checks this worker's cache, then the shared one. Tokens inside the
+    refresh buffer are left to the caller so it can refresh ahead of expiry.
+    """
+    access_token = token_cache.get(email)
+    if access_token or not shared_state.state.distributed:
+        return access_token
+    raw = await shared_state.state.get(f"token:{email}")
+    if raw is None:
+        return None
+    access_token, expires_at = json.loads(raw)
+    expires_at = datetime.fromisoformat(expires_at)
+    if datetime.utcnow() >= expires_at - timedelta(seconds=EXPIRATION_BUFFER_SECONDS):
+        return None
+    token_cache.set(email, access_token, expires_at)
+    return access_token
+
+
+async def remember_token(email: str, access_token: str, expires_at: datetime):
+    token_cache.set(email, access_token, expires_at)
+    if shared_state.state.distributed:
+        ttl = min(TOKEN_CACHE_TTL_SECONDS, (expires_at - datetime.utcnow()).total_seconds())
+        if ttl > 0:
+            await shared_state.state.set(f"token:{email}", json.dumps([access_token, expires_at.isoformat()]), ttl)
+
+
+async def forget_token(email: str):
+    """
+    Drops the user's token here, in the shared cache and on the other workers.
+    """
+    token_cache.invalidate(email)
+    if shared_state.state.distributed:
+        await shared_state.state.delete(f"token:{email}")
+        shared_state.broadcast("token", email)
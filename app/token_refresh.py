@@ -0,0 +1,216 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Set
+
+from fastapi import HTTPException
+from sqlalchemy import select, update
+
+from app.auth import acquire_token_silent_async, refresh_access_token_async
+from app.msal_cache import delete_cache, load_cache, save_cache
+from app.config import (
+    EXPIRATION_BUFFER_SECONDS,
+    TOKEN_REFRESH_SCAN_INTERVAL_SECONDS,
+    TOKEN_REFRESH_CONCURRENCY,
+    TOKEN_REFRESH_LOCK_SECONDS,
+)
+from app.db import AsyncSessionLocal, Token
+from app.shared_state import acquire_lock, release_lock
+from app.telemetry import span
+from app.token_cache import remember_token, token_cache
+from app.token_store import iter_expiring_tokens
+
+logger = logging.getLogger(__name__)
+
+# email -> the single in-flight refresh for that user
+_in_flight: Dict[str, asyncio.Task] = {}
+# Background refreshes started by schedule_refresh, kept so they are not collected mid-run
+_background: Set[asyncio.Task] = set()
+# How often a worker checks whether another worker's refresh has landed
+PEER_REFRESH_POLL_SECONDS = 0.25
+# MSAL errors meaning the refresh token is dead (expired, revoked, consent
+# withdrawn); only a new sign-in helps
+PERMANENT_REFRESH_ERRORS = {"invalid_grant", "interaction_required", "consent_required"}
+
+
+async def _peer_refreshed_token(email: str) -> Optional[str]:
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(select(Token.access_token, Token.expires_at).where(Token.email == email))).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="User not found or not authenticated. Please login.")
+    if row.expires_at > datetime.utcnow() + timedelta(seconds=EXPIRATION_BUFFER_SECONDS):
+        await remember_token(email, row.access_token, row.expires_at)
+        return row.access_token
+    return None
+
+
+async def _refresh(email: str) -> str:
+    """
+    Refreshes under a per-user lock shared by all workers. A worker that
+    finds the lock taken waits for the holder's token to reach the database
+    instead of refreshing a second time.
+    """
+    lock_name = f"refresh:{email}"
+    lock = await acquire_lock(lock_name, TOKEN_REFRESH_LOCK_SECONDS)
+    while lock is None:
+        access_token = await _peer_refreshed_token(email)
+        if access_token:
+            return access_token
+        await asyncio.sleep(PEER_REFRESH_POLL_SECONDS)
+        # Taking the lock succeeds once the holder releases it or dies
+        lock = await acquire_lock(lock_name, TOKEN_REFRESH_LOCK_SECONDS)
+    try:
+        # A peer may have finished a refresh just before we got the lock
+        return await _peer_refreshed_token(email) or await _refresh_locked(email)
+    finally:
+        await release_lock(lock_name, lock)
+
+
+async def _refresh_locked(email: str) -> str:
+    """
+    Gets a fresh token from the user's MSAL cache, falling back to the
+    stored refresh token, and writes the new token row.
+    """
+    token_cache.invalidate(email)
+    async with AsyncSessionLocal() as db:
+        stored_refresh_token = (
+            await db.execute(select(Token.refresh_token).where(Token.email == email))
+        ).first()
+    if stored_refresh_token is None:
+        raise HTTPException(status_code=404, detail="User not found or not authenticated. Please login.")
+    stored_refresh_token = stored_refresh_token[0]
+
+    msal_cache = await load_cache(email)
+    new_token_result = await acquire_token_silent_async(email, msal_cache, EXPIRATION_BUFFER_SECONDS)
+    if not new_token_result or "access_token" not in new_token_result:
+        if not stored_refresh_token:
+            raise HTTPException(status_code=401, detail="Token expired and no refresh token available. Please login again.")
+        new_token_result = await refresh_access_token_async(stored_refresh_token, msal_cache)
+    await save_cache(email, msal_cache)
+    if "access_token" not in new_token_result:
+        if new_token_result.get("error") in PERMANENT_REFRESH_ERRORS:
+            await _drop_refresh_token(email, new_token_result["error"])
+        # If refresh fails, user must re-authenticate
+        raise HTTPException(status_code=401, detail="Could not refresh token. Please login again.")
+
+    expires_at = datetime.utcnow() + timedelta(seconds=new_token_result['expires_in'])
+    async with AsyncSessionLocal() as db:
+        db_token = (await db.execute(select(Token).where(Token.email == email))).scalars().first()
+        if not db_token:
+            raise HTTPException(status_code=404, detail="User not found or not authenticated. Please login.")
+        db_token.access_token = new_token_result['access_token']
+        # Some flows provide a new refresh token, some don't. Update if available.
+        if 'refresh_token' in new_token_result:
+            db_token.refresh_token = new_token_result['refresh_token']
+        db_token.expires_at = expires_at
+        await db.commit()
+
+    await remember_token(email, new_token_result['access_token'], expires_at)
+    logger.info("Token for %s refreshed successfully.", email)
+    return new_token_result['access_token']
+
+
+async def _drop_refresh_token(email: str, error: str):
+    """
+    Forgets a refresh token Azure AD has refused for good, so the scheduler
+    stops picking the user up; signing in again stores a new one.
+    """
+    logger.warning("Refresh token for %s refused (%s); waiting for the user to sign in again.", email, error)
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(Token).where(Token.email == email).values(refresh_token=None))
+        await db.commit()
+    await delete_cache(email)
+
+
+async def _traced_refresh(email: str) -> str:
+    with span("token_refresh"):
+        return await _refresh(email)
+
+
+async def refresh_user_token(email: str) -> str:
+    """
+    Refreshes the user's token, sharing one in-flight refresh between all
+    concurrent callers for the same email.
+    """
+    task = _in_flight.get(email)
+    if task is None:
+        task = asyncio.ensure_future(_traced_refresh(email))
+        _in_flight[email] = task
+        task.add_done_callback(lambda _: _in_flight.pop(email, None))
+    # Shield so one cancelled caller does not cancel the refresh for everyone else
+    return await asyncio.shield(task)
+
+
+def schedule_refresh(email: str):
+    """
+    Starts a refresh in the background without waiting for it.
+    """
+    if email in _in_flight:
+        return
+
+    async def _run():
+        try:
+            await refresh_user_token(email)
+        except Exception as e:
+            logger.warning("Background refresh failed for %s: %s", email, e)
+
+    task = asyncio.ensure_future(_run())
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+class TokenRefreshScheduler:
+    """
+    Periodically refreshes tokens that expire within the buffer, so request
+    paths find a valid token and never wait on Azure AD.
+    """
+
+    def __init__(
+        self,
+        buffer_seconds: int = EXPIRATION_BUFFER_SECONDS,
+        interval_seconds: int = TOKEN_REFRESH_SCAN_INTERVAL_SECONDS,
+        concurrency: int = TOKEN_REFRESH_CONCURRENCY,
+    ):
+        self.buffer_seconds = buffer_seconds
+        self.interval_seconds = interval_seconds
+        self.concurrency = concurrency
+        self._task = None
+
+    async def run_once(self):
+        cutoff = datetime.utcnow() + timedelta(seconds=self.buffer_seconds)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        refreshed = 0
+
+        async def _refresh_one(email):
+            async with semaphore:
+                try:
+                    await refresh_user_token(email)
+                except Exception as e:
+                    logger.warning("Scheduled refresh failed for %s: %s", email, e)
+
+        # One page at a time, so a large backlog does not load every row
+        async for rows in iter_expiring_tokens(cutoff):
+            await asyncio.gather(*(_refresh_one(row.email) for row in rows))
+            refreshed += len(rows)
+        return refreshed
+
+    async def _loop(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.exception("Token refresh scan failed: %s", e)
+            await asyncio.sleep(self.interval_seconds)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
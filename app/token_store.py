@@ -0,0 +1,95 @@
+"""
+Bulk access to the tokens table for background jobs. Scans are keyset
+paginated on (expires_at, id) or id, so each page is an index range read
+and a full pass costs the same per row however large the table is.
+
+    python -m app.token_store reencrypt
+"""
+import asyncio
+import logging
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Tuple
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm.attributes import flag_modified
+
+from app.config import TOKEN_SCAN_BATCH_SIZE
+from app.db import AsyncSessionLocal, MsalTokenCache, Token
+
+logger = logging.getLogger(__name__)
+
+
+async def expiring_tokens(
+    db,
+    before: datetime,
+    after: Optional[Tuple[datetime, int]] = None,
+    limit: int = TOKEN_SCAN_BATCH_SIZE,
+    tenant_id: str = None,
+) -> list:
+    """
+    One page of refreshable tokens expiring before `before`, ordered by
+    (expires_at, id). Rows carry id, email, tenant_id and expires_at; pass
+    the last row's (expires_at, id) as `after` for the next page.
+    """
+    query = select(Token.id, Token.email, Token.tenant_id, Token.expires_at).where(
+        Token.expires_at < before, Token.refresh_token.isnot(None)
+    )
+    if tenant_id is not None:
+        query = query.where(Token.tenant_id == tenant_id)
+    if after is not None:
+        query = query.where(tuple_(Token.expires_at, Token.id) > tuple_(*after))
+    return list((await db.execute(query.order_by(Token.expires_at, Token.id).limit(limit))).all())
+
+
+async def iter_expiring_tokens(
+    before: datetime, batch_size: int = TOKEN_SCAN_BATCH_SIZE, tenant_id: str = None
+) -> AsyncIterator[List]:
+    """
+    Yields expiring tokens page by page, each page read in its own short
+    transaction. Rows refreshed while the scan runs move past `before`
+    and are not seen twice.
+    """
+    after = None
+    while True:
+        async with AsyncSessionLocal() as db:
+            rows = await expiring_tokens(db, before, after, batch_size, tenant_id)
+        if rows:
+            yield rows
+        if len(rows) < batch_size:
+            return
+        after = (rows[-1].expires_at, rows[-1].id)
+
+
+async def reencrypt_tokens(batch_size: int = TOKEN_SCAN_BATCH_SIZE) -> int:
+    """
+    Rewrites every token and MSAL cache row with the current encryption key,
+    e.g. after turning encryption on or adding a key. Returns rows written.
+    """
+    written = 0
+    for model, columns in ((Token, ("access_token", "refresh_token")), (MsalTokenCache, ("cache_blob",))):
+        last_id = 0
+        while True:
+            async with AsyncSessionLocal() as db:
+                rows = (await db.execute(
+                    select(model).where(model.id > last_id).order_by(model.id).limit(batch_size)
+                )).scalars().all()
+                for row in rows:
+                    for column in columns:
+                        flag_modified(row, column)
+                await db.commit()
+            written += len(rows)
+            if len(rows) < batch_size:
+                break
+            last_id = rows[-1].id
+    logger.info("Re-encrypted %d rows", written)
+    return written
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Token table maintenance")
+    parser.add_argument("command", choices=["reencrypt"])
+    parser.add_argument("--batch-size", type=int, default=TOKEN_SCAN_BATCH_SIZE)
+    args = parser.parse_args()
+    print(f"{asyncio.run(reencrypt_tokens(args.batch_size))} rows re-encrypted")
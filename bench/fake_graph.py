@@ -0,0 +1,252 @@
+"""
+Local stand-in for Microsoft Graph and the Azure AD token endpoint, used by
+the offline benchmark (bench/run.py).
+
+    python -m bench.fake_graph --port 8765 --latency-ms 40 --error-rate 0.01 --throttle-rate 0.02
+
+Graph lives under /v1.0 and Azure AD under /aad. MSAL only talks https, so
+the app reaches /aad through msal_http_client(), which rewrites
+login.microsoftonline.com URLs to BENCH_FAKE_AAD_URL.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import os
+import random
+import time
+import uuid
+from collections import Counter
+from urllib.parse import parse_qs
+
+import jwt
+import requests
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import JSONResponse
+
+AAD_HOST = "https://login.microsoftonline.com"
+# Tokens are not verified by the app; the key only has to satisfy PyJWT
+BENCH_SIGNING_KEY = "bench-signing-key-not-a-secret-000"
+
+settings = {"latency_ms": 0.0, "jitter_ms": 0.0, "error_rate": 0.0, "throttle_rate": 0.0, "retry_after": 1}
+calls = Counter()
+events = {}
+
+app = FastAPI()
+
+
+def _b64(data: dict) -> str:
+    return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+
+async def _simulate(route: str):
+    """
+    Applies latency and fault injection. Returns an error response or None.
+    """
+    calls[route] += 1
+    delay = settings["latency_ms"] + random.uniform(0, settings["jitter_ms"])
+    if delay:
+        await asyncio.sleep(delay / 1000)
+    roll = random.random()
+    if roll < settings["throttle_rate"]:
+        calls["throttled"] += 1
+        return JSONResponse(
+            {"error": {"code": "TooManyRequests", "message": "Throttled by bench"}},
+            status_code=429,
+            headers={"Retry-After": str(settings["retry_after"])},
+        )
+    if roll < settings["throttle_rate"] + settings["error_rate"]:
+        calls["errors"] += 1
+        return JSONResponse({"error": {"code": "ServiceUnavailable", "message": "Injected by bench"}}, status_code=503)
+    return None
+
+
+def _event(event_id: str, body: dict) -> dict:
+    return {"id": event_id, "@odata.etag": f'W/"{uuid.uuid4().hex}"', "isCancelled": False, "showAs": "busy", **body}
+
+
+# --- Azure AD ---
+
+@app.get("/aad/{tenant}/v2.0/.well-known/openid-configuration")
+async def openid_configuration(tenant: str):
+    calls["aad_discovery"] += 1
+    return {
+        "authorization_endpoint": f"{AAD_HOST}/{tenant}/oauth2/v2.0/authorize",
+        "token_endpoint": f"{AAD_HOST}/{tenant}/oauth2/v2.0/token",
+        "device_authorization_endpoint": f"{AAD_HOST}/{tenant}/oauth2/v2.0/devicecode",
+    }
+
+
+@app.get("/aad/common/discovery/instance")
+async def instance_discovery():
+    calls["aad_discovery"] += 1
+    return {
+        "tenant_discovery_endpoint": f"{AAD_HOST}/common/v2.0/.well-known/openid-configuration",
+        "metadata": [{"preferred_network": "login.microsoftonline.com", "aliases": ["login.microsoftonline.com"]}],
+    }
+
+
+@app.post("/aad/{tenant}/oauth2/v2.0/token")
+async def token(tenant: str, request: Request):
+    error = await _simulate("aad_token")
+    if error is not None:
+        return error
+    # Parsed by hand so the bench does not need python-multipart
+    form = {key: values[0] for key, values in parse_qs((await request.body()).decode()).items()}
+    if form.get("grant_type") == "authorization_code":
+        # Codes look like "bench-<email>" so the bench controls the user
+        email = form["code"].split("bench-", 1)[-1]
+    else:
+        email = form["refresh_token"].split("rt-", 1)[-1]
+    uid = uuid.uuid5(uuid.NAMESPACE_DNS, email).hex
+    now = int(time.time())
+    claims = {"aud": form.get("client_id"), "iss": f"{AAD_HOST}/bench/v2.0", "iat": now, "exp": now + 3600,
+              "oid": uid, "tid": "bench-tenant", "preferred_username": email}
+    return {
+        "token_type": "Bearer",
+        "scope": form.get("scope", ""),
+        "expires_in": 3600,
+        "access_token": jwt.encode(claims, BENCH_SIGNING_KEY, algorithm="HS256"),
+        "refresh_token": f"rt-{email}",
+        "id_token": jwt.encode(claims, BENCH_SIGNING_KEY, algorithm="HS256"),
+        "client_info": _b64({"uid": uid, "utid": "bench-tenant"}),
+    }
+
+
+# --- Graph ---
+
+@app.post("/v1.0/me/events")
+async def create_event(request: Request):
+    error = await _simulate("create_event")
+    if error is not None:
+        return error
+    event_id = uuid.uuid4().hex
+    events[event_id] = _event(event_id, await request.json())
+    return JSONResponse(events[event_id], status_code=201)
+
+
+@app.get("/v1.0/me/events/{event_id}")
+async def get_event(event_id: str):
+    error = await _simulate("get_event")
+    if error is not None:
+        return error
+    if event_id not in events:
+        return JSONResponse({"error": {"code": "ErrorItemNotFound"}}, status_code=404)
+    return events[event_id]
+
+
+@app.patch("/v1.0/me/events/{event_id}")
+async def update_event(event_id: str, request: Request):
+    error = await _simulate("update_event")
+    if error is not None:
+        return error
+    if event_id not in events:
+        return JSONResponse({"error": {"code": "ErrorItemNotFound"}}, status_code=404)
+    events[event_id] = _event(event_id, {**events[event_id], **(await request.json())})
+    return events[event_id]
+
+
+@app.delete("/v1.0/me/events/{event_id}")
+async def delete_event(event_id: str):
+    error = await _simulate("delete_event")
+    if error is not None:
+        return error
+    if events.pop(event_id, None) is None:
+        return JSONResponse({"error": {"code": "ErrorItemNotFound"}}, status_code=404)
+    return Response(status_code=204)
+
+
+@app.get("/v1.0/me/calendarView/delta")
+async def calendar_delta(request: Request):
+    error = await _simulate("list_events")
+    if error is not None:
+        return error
+    return {"value": [], "@odata.deltaLink": f"{str(request.base_url).rstrip('/')}/v1.0/me/calendarView/delta?token=bench"}
+
+
+@app.post("/v1.0/me/calendar/getSchedule")
+async def get_schedule(request: Request):
+    error = await _simulate("get_schedule")
+    if error is not None:
+        return error
+    body = await request.json()
+    return {"value": [{"scheduleId": schedule, "scheduleItems": []} for schedule in body.get("schedules", [])]}
+
+
+@app.post("/v1.0/$batch")
+async def batch(request: Request):
+    error = await _simulate("batch")
+    if error is not None:
+        return error
+    responses = []
+    for sub_request in (await request.json())["requests"]:
+        method, url = sub_request["method"], sub_request["url"]
+        event_id = url.rsplit("/", 1)[-1]
+        if method == "POST":
+            event_id = uuid.uuid4().hex
+            events[event_id] = _event(event_id, sub_request.get("body") or {})
+            responses.append({"id": sub_request["id"], "status": 201, "body": events[event_id]})
+        elif event_id not in events:
+            responses.append({"id": sub_request["id"], "status": 404, "body": {"error": {"code": "ErrorItemNotFound"}}})
+        elif method == "PATCH":
+            events[event_id] = _event(event_id, {**events[event_id], **(sub_request.get("body") or {})})
+            responses.append({"id": sub_request["id"], "status": 200, "body": events[event_id]})
+        else:
+            del events[event_id]
+            responses.append({"id": sub_request["id"], "status": 204})
+    return {"responses": responses}
+
+
+# --- Bench control ---
+
+@app.get("/_stats")
+async def stats():
+    return dict(calls)
+
+
+@app.post("/_reset")
+async def reset():
+    calls.clear()
+    return {}
+
+
+class LocalAzureADSession(requests.Session):
+    """
+    requests.Session that sends Azure AD traffic to the local stand-in.
+    """
+
+    def __init__(self, base_url: str):
+        super().__init__()
+        self.base_url = base_url.rstrip("/")
+
+    def request(self, method, url, *args, **kwargs):
+        if url.startswith(AAD_HOST):
+            url = self.base_url + url[len(AAD_HOST):]
+        return super().request(method, url, *args, **kwargs)
+
+
+def msal_http_client():
+    """
+    Factory for MSAL_HTTP_CLIENT=bench.fake_graph:msal_http_client.
+    """
+    return LocalAzureADSession(os.environ["BENCH_FAKE_AAD_URL"])
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description="Local Graph/Azure AD stand-in")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--jitter-ms", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+    settings.update(
+        latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate, retry_after=args.retry_after,
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
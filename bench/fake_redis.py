@@ -0,0 +1,230 @@
+"""
+Local stand-in for Redis, speaking enough RESP2 for app/shared_state.py:
+GET/SET (EX, PX, NX, XX), DEL, INCR/INCRBY, PEXPIRE/EXPIRE, PTTL, WATCH/MULTI/EXEC,
+PUBLISH/SUBSCRIBE, plus the handshake commands redis-py sends.
+
+    python -m bench.fake_redis --port 6399
+    SHARED_STATE_URL=redis://127.0.0.1:6399/0 uvicorn app.main:app --workers 4
+
+Single-threaded and in-memory; meant for tests and the benchmark, not
+for keeping data.
+"""
+import argparse
+import asyncio
+import time
+from collections import defaultdict
+
+values = {}  # key -> (bytes value, expires_at on the monotonic clock or None)
+versions = defaultdict(int)  # key -> bumped on every write, for WATCH
+channels = defaultdict(set)  # channel -> subscribed connections
+
+
+def _live(key):
+    entry = values.get(key)
+    if entry is None:
+        return None
+    if entry[1] is not None and time.monotonic() >= entry[1]:
+        del values[key]
+        return None
+    return entry[0]
+
+
+def _write(key, value, expires_at=None):
+    versions[key] += 1
+    if value is None:
+        values.pop(key, None)
+    else:
+        values[key] = (value, expires_at)
+
+
+class Error(Exception):
+    pass
+
+
+def _encode(reply) -> bytes:
+    if reply is None:
+        return b"$-1\r\n"
+    if isinstance(reply, Error):
+        return b"-ERR " + str(reply).encode() + b"\r\n"
+    if isinstance(reply, bool):
+        return b":1\r\n" if reply else b":0\r\n"
+    if isinstance(reply, int):
+        return b":%d\r\n" % reply
+    if isinstance(reply, str):
+        return b"+" + reply.encode() + b"\r\n"
+    if isinstance(reply, bytes):
+        return b"$%d\r\n%s\r\n" % (len(reply), reply)
+    if isinstance(reply, list):
+        return b"*%d\r\n" % len(reply) + b"".join(_encode(item) for item in reply)
+    raise TypeError(type(reply))
+
+
+async def _read_command(reader):
+    line = await reader.readline()
+    if not line:
+        return None
+    if not line.startswith(b"*"):
+        # Inline command, e.g. from redis-cli or telnet
+        return line.strip().split()
+    args = []
+    for _ in range(int(line[1:])):
+        size = int((await reader.readline())[1:])
+        args.append((await reader.readexactly(size + 2))[:-2])
+    return args
+
+
+def _set(args):
+    key, value = args[0], args[1]
+    expires_at, nx, xx = None, False, False
+    options = iter(args[2:])
+    for option in options:
+        option = option.upper()
+        if option == b"EX":
+            expires_at = time.monotonic() + int(next(options))
+        elif option == b"PX":
+            expires_at = time.monotonic() + int(next(options)) / 1000
+        elif option == b"NX":
+            nx = True
+        elif option == b"XX":
+            xx = True
+    exists = _live(key) is not None
+    if (nx and exists) or (xx and not exists):
+        return None
+    _write(key, value, expires_at)
+    return "OK"
+
+
+def _expire(key, seconds):
+    value = _live(key)
+    if value is None:
+        return 0
+    values[key] = (value, time.monotonic() + seconds)
+    return 1
+
+
+def execute(name: bytes, args) -> object:
+    if name == b"GET":
+        return _live(args[0])
+    if name == b"SET":
+        return _set(args)
+    if name == b"DEL":
+        removed = 0
+        for key in args:
+            if _live(key) is not None:
+                removed += 1
+                _write(key, None)
+        return removed
+    if name in (b"INCR", b"INCRBY"):
+        value = int(_live(args[0]) or 0) + (int(args[1]) if name == b"INCRBY" else 1)
+        expires_at = values[args[0]][1] if args[0] in values else None
+        _write(args[0], str(value).encode(), expires_at)
+        return value
+    if name == b"PEXPIRE":
+        return _expire(args[0], int(args[1]) / 1000)
+    if name == b"EXPIRE":
+        return _expire(args[0], int(args[1]))
+    if name == b"PTTL":
+        if _live(args[0]) is None:
+            return -2
+        expires_at = values[args[0]][1]
+        return -1 if expires_at is None else int((expires_at - time.monotonic()) * 1000)
+    if name == b"PUBLISH":
+        for writer in list(channels.get(args[0], ())):
+            writer.write(_encode([b"message", args[0], args[1]]))
+        return len(channels.get(args[0], ()))
+    if name == b"FLUSHALL" or name == b"FLUSHDB":
+        for key in list(values):
+            _write(key, None)
+        return "OK"
+    if name == b"PING":
+        return args[0] if args else "PONG"
+    if name in (b"CLIENT", b"SELECT", b"ECHO"):
+        return args[0] if name == b"ECHO" else "OK"
+    return Error(f"unknown command '{name.decode()}'")
+
+
+async def handle(reader, writer):
+    watched = {}
+    queued = None
+    subscriptions = set()
+    try:
+        while True:
+            command = await _read_command(reader)
+            if command is None:
+                break
+            if not command:
+                continue
+            name, args = command[0].upper(), command[1:]
+            if name == b"WATCH":
+                watched.update({key: versions[key] for key in args})
+                reply = "OK"
+            elif name == b"UNWATCH":
+                watched.clear()
+                reply = "OK"
+            elif name == b"MULTI":
+                queued = []
+                reply = "OK"
+            elif name == b"DISCARD":
+                queued, reply = None, "OK"
+                watched.clear()
+            elif name == b"EXEC":
+                if queued is None:
+                    reply = Error("EXEC without MULTI")
+                elif any(versions[key] != version for key, version in watched.items()):
+                    reply = None
+                    writer.write(b"*-1\r\n")
+                    queued = None
+                    watched.clear()
+                    await writer.drain()
+                    continue
+                else:
+                    reply = [execute(queued_name, queued_args) for queued_name, queued_args in queued]
+                queued = None
+                watched.clear()
+            elif queued is not None:
+                queued.append((name, args))
+                reply = "QUEUED"
+            elif name == b"SUBSCRIBE":
+                for channel in args:
+                    subscriptions.add(channel)
+                    channels[channel].add(writer)
+                    writer.write(_encode([b"subscribe", channel, len(subscriptions)]))
+                await writer.drain()
+                continue
+            elif name == b"UNSUBSCRIBE":
+                for channel in args or list(subscriptions):
+                    subscriptions.discard(channel)
+                    channels[channel].discard(writer)
+                    writer.write(_encode([b"unsubscribe", channel, len(subscriptions)]))
+                await writer.drain()
+                continue
+            elif name == b"HELLO":
+                # Keep clients on RESP2
+                reply = Error("unknown command 'HELLO'")
+            elif name == b"QUIT":
+                writer.write(_encode("OK"))
+                break
+            else:
+                reply = execute(name, args)
+            writer.write(_encode(reply))
+            await writer.drain()
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    finally:
+        for channel in subscriptions:
+            channels[channel].discard(writer)
+        writer.close()
+
+
+async def serve(host: str, port: int):
+    server = await asyncio.start_server(handle, host, port)
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local Redis stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6399)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
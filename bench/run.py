@@ -0,0 +1,299 @@
+"""
+Offline load test for the calendar API.
+
+Starts the local Graph/Azure AD stand-in (bench/fake_graph.py) in a
+subprocess, points the app at it and at a throwaway SQLite database, and
+drives /callback, /event/create, /event/update/{event_id} and
+/event/delete/{event_id} in-process at a fixed concurrency.
+
+    python -m bench.run --users 50 --requests 2000 --concurrency 64 --latency-ms 40
+    python -m bench.run --output bench/results/$(git rev-parse --short HEAD).json --compare bench/results/base.json
+    python -m bench.run --shared-state redis   # shared state through bench/fake_redis.py
+
+Each phase reports p50/p95/p99 latency, requests per second, errors and
+the number of DB statements and Graph calls it caused. Results are written
+as JSON tagged with the commit, so runs with the same arguments can be
+compared across commits.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(samples, pct):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return round(ordered[index] * 1000, 3)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _configure_environment(args, fake_url: str, db_path: str, redis_url: str = None):
+    # Must run before the app is imported: app.config reads these once
+    os.environ["GRAPH_API_ENDPOINT"] = f"{fake_url}/v1.0"
+    os.environ["BENCH_FAKE_AAD_URL"] = f"{fake_url}/aad"
+    os.environ["MSAL_HTTP_CLIENT"] = "bench.fake_graph:msal_http_client"
+    os.environ.setdefault("DATABASE_URL", args.database_url or f"sqlite:///{db_path}")
+    os.environ.setdefault("GRAPH_HTTP2", "false")
+    if redis_url:
+        os.environ["SHARED_STATE_URL"] = redis_url
+    # Token refresh scans would add noise to the measured phases
+    os.environ.setdefault("TOKEN_REFRESH_SCAN_INTERVAL_SECONDS", "3600")
+
+
+async def _wait_for(url: str, client, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            await client.get(url)
+            return
+        except Exception:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"Fake Graph server did not start at {url}")
+
+
+async def _wait_for_port(port: int, timeout: float = 15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            _, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.close()
+            return
+        except OSError:
+            await asyncio.sleep(0.1)
+    raise RuntimeError(f"Redis stand-in did not start on port {port}")
+
+
+class DbStatementCounter:
+    def __init__(self, engine):
+        from sqlalchemy import event
+
+        self.count = 0
+        event.listen(engine.sync_engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args, **kwargs):
+        self.count += 1
+
+
+async def _run_phase(name, client, fake, db_counter, concurrency, jobs):
+    """
+    Runs `jobs` (callables returning a request coroutine) with bounded
+    concurrency and returns the phase report.
+    """
+    await fake.post("/_reset")
+    db_before = db_counter.count
+    latencies, errors, statuses = [], 0, {}
+    queue = list(jobs)
+    queue.reverse()
+
+    async def worker():
+        nonlocal errors
+        while queue:
+            job = queue.pop()
+            started = time.perf_counter()
+            try:
+                response = await job()
+                status = response.status_code
+            except Exception:
+                status = "exception"
+            latencies.append(time.perf_counter() - started)
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == "exception" or status >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    graph_calls = (await fake.get("/_stats")).json()
+    return {
+        "phase": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "statuses": statuses,
+        "elapsed_seconds": round(elapsed, 3),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": _percentile(latencies, 50),
+        "p95_ms": _percentile(latencies, 95),
+        "p99_ms": _percentile(latencies, 99),
+        "db_statements": db_counter.count - db_before,
+        "graph_calls": graph_calls,
+    }
+
+
+async def run(args) -> dict:
+    import httpx
+
+    from app.db import get_engine
+    from app.main import app
+
+    db_counter = DbStatementCounter(get_engine())
+    rng = random.Random(args.seed)
+    users = [f"user{i}@bench.local" for i in range(args.users)]
+    start = datetime(2030, 1, 1, 9, 0)
+
+    def event_body(i):
+        begin = start + timedelta(minutes=30 * i)
+        return {
+            "subject": f"Bench meeting {i}",
+            "content": "<p>Load test</p>",
+            "start_time": begin.isoformat(),
+            "end_time": (begin + timedelta(minutes=30)).isoformat(),
+            "attendees": [{"email": f"guest{j}@bench.local"} for j in range(args.attendees)],
+        }
+
+    phases = []
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client, \
+                httpx.AsyncClient(base_url=args.fake_url) as fake:
+            phases.append(await _run_phase(
+                "callback", client, fake, db_counter, args.concurrency,
+                [lambda u=u: client.get("/callback", params={"code": f"bench-{u}"}) for u in users],
+            ))
+
+            created = []
+
+            async def create(i):
+                user = users[rng.randrange(len(users))]
+                response = await client.post("/event/create", json=event_body(i), headers={"email": user})
+                if response.status_code < 400 and "id" in response.json():
+                    created.append((user, response.json()["id"]))
+                return response
+
+            phases.append(await _run_phase(
+                "create", client, fake, db_counter, args.concurrency,
+                [lambda i=i: create(i) for i in range(args.requests)],
+            ))
+            phases.append(await _run_phase(
+                "update", client, fake, db_counter, args.concurrency,
+                [
+                    lambda u=u, e=e, i=i: client.patch(f"/event/update/{e}", json={**event_body(i), "subject": f"Updated {i}"}, headers={"email": u})
+                    for i, (u, e) in enumerate(list(created))
+                ],
+            ))
+            phases.append(await _run_phase(
+                "delete", client, fake, db_counter, args.concurrency,
+                [lambda u=u, e=e: client.delete(f"/event/delete/{e}", headers={"email": u}) for u, e in list(created)],
+            ))
+
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.utcnow().isoformat() + "Z",
+        "python": sys.version.split()[0],
+        "params": {
+            key: getattr(args, key)
+            for key in ("users", "requests", "concurrency", "attendees", "latency_ms", "jitter_ms", "error_rate", "throttle_rate", "retry_after", "seed", "shared_state")
+        },
+        "phases": phases,
+    }
+
+
+def _print_report(result: dict, baseline: dict = None):
+    base = {phase["phase"]: phase for phase in (baseline or {}).get("phases", [])}
+    print(f"commit {result['commit']}  params {json.dumps(result['params'])}")
+    header = f"{'phase':<10}{'reqs':>7}{'errors':>8}{'rps':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'db stmts':>10}{'graph':>8}"
+    print(header)
+    for phase in result["phases"]:
+        graph_total = sum(v for k, v in phase["graph_calls"].items() if k not in ("throttled", "errors"))
+        print(
+            f"{phase['phase']:<10}{phase['requests']:>7}{phase['errors']:>8}{phase['rps'] or 0:>10}"
+            f"{phase['p50_ms'] or 0:>10}{phase['p95_ms'] or 0:>10}{phase['p99_ms'] or 0:>10}"
+            f"{phase['db_statements']:>10}{graph_total:>8}"
+        )
+        previous = base.get(phase["phase"])
+        if previous and previous.get("rps") and phase.get("rps"):
+            print(
+                f"{'  vs base':<10}{'':>15}{phase['rps'] / previous['rps'] - 1:>+10.1%}"
+                f"{(phase['p50_ms'] or 0) - (previous['p50_ms'] or 0):>+10.2f}"
+                f"{(phase['p95_ms'] or 0) - (previous['p95_ms'] or 0):>+10.2f}"
+                f"{(phase['p99_ms'] or 0) - (previous['p99_ms'] or 0):>+10.2f}"
+                f"{phase['db_statements'] - previous['db_statements']:>+10}"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test against a local Graph/Azure AD stand-in")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--requests", type=int, default=500, help="events created (and then updated and deleted)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--attendees", type=int, default=3, help="attendees per event")
+    parser.add_argument("--latency-ms", type=float, default=20.0, help="fake upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of upstream calls failing with 503")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="fraction of upstream calls failing with 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds on injected 429s")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--database-url", help="sync SQLAlchemy URL; defaults to a throwaway SQLite file")
+    parser.add_argument("--shared-state", choices=("local", "redis"), default="local",
+                        help="keep shared state in-process, or in the local Redis stand-in")
+    parser.add_argument("--output", help="write the JSON result here")
+    parser.add_argument("--compare", help="earlier JSON result to diff against")
+    args = parser.parse_args()
+
+    port = _free_port()
+    args.fake_url = f"http://127.0.0.1:{port}"
+    fake = subprocess.Popen([
+        sys.executable, "-m", "bench.fake_graph", "--port", str(port),
+        "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+        "--error-rate", str(args.error_rate), "--throttle-rate", str(args.throttle_rate),
+        "--retry-after", str(args.retry_after), "--seed", str(args.seed),
+    ])
+    redis, redis_url = None, None
+    if args.shared_state == "redis":
+        redis_port = _free_port()
+        redis_url = f"redis://127.0.0.1:{redis_port}/0"
+        redis = subprocess.Popen([sys.executable, "-m", "bench.fake_redis", "--port", str(redis_port)])
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            _configure_environment(args, args.fake_url, os.path.join(tmp, "bench.db"), redis_url)
+
+            async def _main():
+                import httpx
+
+                async with httpx.AsyncClient() as probe:
+                    await _wait_for(f"{args.fake_url}/_stats", probe)
+                if redis_url:
+                    await _wait_for_port(redis_port)
+                return await run(args)
+
+            result = asyncio.run(_main())
+    finally:
+        for process in (fake, redis):
+            if process is not None:
+                process.terminate()
+                process.wait()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    _print_report(result, baseline)
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+import os
+import tempfile
+
+# Settings are read once, on first use, which importing most app modules
+# triggers, so they have to be in place before any app module loads
+_tmp = tempfile.mkdtemp(prefix="ms-calendar-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/test.db"
+os.environ.setdefault("CLIENT_ID", "test-client")
+os.environ.setdefault("CLIENT_SECRET", "test-secret")
+os.environ["MSAL_WARM_UP"] = "false"
+os.environ["ATTENDEE_RESOLUTION_ENABLED"] = "false"
+os.environ.pop("SHARED_STATE_URL", None)
+os.environ.pop("NOTIFICATION_URL", None)
+
+import httpx
+import jwt
+import pytest
+
+
+class FakeGraph:
+    """
+    Stands in for Graph behind the shared httpx client. Tests set `handler`
+    (request -> httpx.Response); every request is kept in `requests`.
+    """
+
+    def __init__(self):
+        self.requests = []
+        self.handler = lambda request: httpx.Response(404, json={"error": {"code": "NotFound"}})
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        return self.handler(request)
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def graph():
+    return FakeGraph()
+
+
+@pytest.fixture
+def client(graph, monkeypatch):
+    """
+    TestClient for the app with Graph faked and user@test.local signed in.
+    """
+    from fastapi.testclient import TestClient
+
+    import app.graph_api as graph_api
+    import app.main as main
+
+    async def _token_by_code(code, token_cache=None):
+        return {
+            "access_token": "access-token",
+            "refresh_token": "refresh-token",
+            "expires_in": 3600,
+            "id_token": jwt.encode({"preferred_username": "user@test.local", "tid": "t1", "oid": "o1"}, "unverified-test-signing-key-0123456789"),
+        }
+
+    monkeypatch.setattr(main, "get_token_by_auth_code_async", _token_by_code)
+    with TestClient(main.app) as test_client:
+        real_client = graph_api._client
+        graph_api._client = httpx.AsyncClient(transport=httpx.MockTransport(graph))
+        assert test_client.get("/callback?code=test").status_code == 200
+        yield test_client
+        graph_api._client = real_client
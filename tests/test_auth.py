@@ -0,0 +1,62 @@
+import asyncio
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+import app.auth as auth
+
+
+def _scope() -> str:
+    return parse_qs(urlparse(auth.get_auth_url()).query)["scope"][0]
+
+
+def test_auth_url_asks_for_configured_scopes(monkeypatch):
+    monkeypatch.setattr(auth, "SCOPES", ["Calendars.ReadWrite", "User.Read", "People.Read"])
+    assert _scope() == "Calendars.ReadWrite User.Read People.Read offline_access"
+
+
+def test_offline_access_is_not_repeated(monkeypatch):
+    monkeypatch.setattr(auth, "SCOPES", ["User.Read", "offline_access"])
+    assert _scope() == "User.Read offline_access"
+
+
+@pytest.mark.anyio
+async def test_msal_calls_run_on_their_own_threads(monkeypatch):
+    def _exchange(code, token_cache=None):
+        return {"access_token": code, "thread": threading.current_thread().name}
+
+    monkeypatch.setattr(auth, "get_token_by_auth_code", _exchange)
+    result = await auth.get_token_by_auth_code_async("code")
+    assert result["access_token"] == "code" and result["thread"].startswith("msal")
+
+
+@pytest.mark.anyio
+async def test_slow_msal_call_times_out(monkeypatch):
+    monkeypatch.setattr(auth, "MSAL_TIMEOUT_SECONDS", 0.05)
+    monkeypatch.setattr(auth, "refresh_access_token", lambda refresh_token, token_cache=None: time.sleep(0.3))
+    result = await auth.refresh_access_token_async("refresh")
+    assert result["error"] == "timeout"
+
+
+@pytest.mark.anyio
+async def test_msal_concurrency_is_capped(monkeypatch):
+    monkeypatch.setattr(auth, "_semaphore", asyncio.Semaphore(2))
+    lock = threading.Lock()
+    running = []
+    most = []
+
+    def _call(refresh_token, token_cache=None):
+        with lock:
+            running.append(refresh_token)
+            most.append(len(running))
+        time.sleep(0.02)
+        with lock:
+            running.remove(refresh_token)
+        return {"access_token": refresh_token}
+
+    monkeypatch.setattr(auth, "refresh_access_token", _call)
+    results = await asyncio.gather(*(auth.refresh_access_token_async(f"r{index}") for index in range(6)))
+    assert [result["access_token"] for result in results] == [f"r{index}" for index in range(6)]
+    assert max(most) == 2
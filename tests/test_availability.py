@@ -0,0 +1,88 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import app.availability as availability_module
+from app.availability import AvailabilityService, IntervalIndex
+
+pytestmark = pytest.mark.anyio
+
+START = datetime(2026, 3, 2, 8, tzinfo=timezone.utc)
+END = datetime(2026, 3, 2, 18, tzinfo=timezone.utc)
+
+
+def test_intervals_are_merged_and_sorted():
+    index = IntervalIndex([(50, 60), (10, 20), (15, 30), (30, 40), (70, 70), (90, 80)])
+    # Overlapping and touching intervals merge; empty and reversed ones are dropped
+    assert (index.starts, index.ends) == ([10, 50], [40, 60])
+    assert len(index) == 2
+    assert IntervalIndex.union([IntervalIndex([(0, 5)]), index, IntervalIndex([(38, 52)])]).starts == [0, 10]
+
+
+def test_conflicts_and_is_free():
+    index = IntervalIndex([(10, 20), (30, 40), (50, 60)])
+    assert index.conflicts(15, 35) == [(10, 20), (30, 40)]
+    # Back-to-back meetings do not conflict
+    assert index.conflicts(20, 30) == [] and index.is_free(20, 30)
+    assert not index.is_free(39, 45)
+    assert index.is_free(60, 100) and IntervalIndex().is_free(0, 1)
+
+
+def test_free_slots():
+    index = IntervalIndex([(10, 20), (25, 40)])
+    assert index.free_slots(0, 60, 5, 10) == [(0, 5), (5, 10), (20, 25), (40, 45), (45, 50), (50, 55), (55, 60)]
+    assert index.free_slots(12, 60, 10, 2) == [(40, 50), (50, 60)]
+    assert index.free_slots(0, 60, 30, 1) == []
+
+
+@pytest.fixture
+def schedules(monkeypatch):
+    """
+    Fakes getSchedule: tests fill `answers` (address -> schedule); every
+    call's addresses are kept in `calls`.
+    """
+    class _Schedules:
+        answers = {}
+        calls = []
+
+    async def _get_schedule(access_token, addresses, start, end):
+        _Schedules.calls.append(addresses)
+        return [{"scheduleId": address, **_Schedules.answers[address]} for address in addresses if address in _Schedules.answers]
+
+    monkeypatch.setattr(availability_module, "get_schedule", _get_schedule)
+    return _Schedules
+
+
+def _item(status, start, end):
+    return {"status": status, "start": {"dateTime": start, "timeZone": "UTC"}, "end": {"dateTime": end, "timeZone": "UTC"}}
+
+
+async def test_busy_items_conflict(schedules):
+    schedules.answers = {"a@test.local": {"scheduleItems": [
+        _item("busy", "2026-03-02T09:00:00", "2026-03-02T10:00:00"),
+        _item("free", "2026-03-02T11:00:00", "2026-03-02T12:00:00"),
+    ]}}
+    service = AvailabilityService()
+    result = await service.check("o@test.local", "token", ["A@test.local"], START + timedelta(hours=1), START + timedelta(hours=4))
+    assert result["free"] is False and result["unknown"] == []
+    assert result["conflicts"] == {"a@test.local": [{"start": "2026-03-02T09:00:00+00:00", "end": "2026-03-02T10:00:00+00:00"}]}
+
+    # Cached for the next lookup
+    await service.check("o@test.local", "token", ["a@test.local"], START + timedelta(hours=2), END)
+    assert len(schedules.calls) == 1 and service.stats()["hits"] == 1
+
+
+async def test_errored_schedule_is_unknown_and_not_cached(schedules):
+    schedules.answers = {
+        "a@test.local": {"scheduleItems": []},
+        "x@other.example": {"error": {"message": "The user is outside of your organization", "responseCode": "OrganizationNotFound"}},
+    }
+    service = AvailabilityService()
+    result = await service.check("o@test.local", "token", ["a@test.local", "x@other.example", "gone@test.local"], START, END)
+    # Neither the errored schedule nor the one Graph left out counts as free
+    assert result == {"free": False, "conflicts": {}, "unknown": ["x@other.example", "gone@test.local"]}
+
+    slots = await service.find_slots("o@test.local", "token", ["a@test.local", "x@other.example"], START, END, timedelta(hours=1), 1)
+    assert slots == {"slots": [{"start": "2026-03-02T08:00:00+00:00", "end": "2026-03-02T09:00:00+00:00"}], "unknown": ["x@other.example"]}
+    assert schedules.calls[1] == ["x@other.example"]
+    assert service.stats()["entries"] == 1
@@ -0,0 +1,105 @@
+import json
+
+import httpx
+import pytest
+
+import app.graph_api as graph_api
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def graph_client(graph, monkeypatch):
+    monkeypatch.setattr(graph_api, "_client", httpx.AsyncClient(transport=httpx.MockTransport(graph)))
+    return graph
+
+
+def _sub_requests(request):
+    return json.loads(request.content)["requests"]
+
+
+def _answer(statuses=None, headers=None):
+    """
+    $batch handler answering each sub-request with statuses.get(id), else
+    201 for a create and 204 for a delete, in reverse order, as Graph does
+    not keep the request order.
+    """
+    def _response(sub):
+        status = (statuses or {}).get(sub["id"]) or (204 if sub["method"] == "DELETE" else 201)
+        body = {"id": f"e{sub['id']}"} if status == 201 else None
+        return {"id": sub["id"], "status": status, "headers": headers or {}, "body": body}
+
+    def _handler(request):
+        return httpx.Response(200, json={"responses": [_response(sub) for sub in _sub_requests(request)][::-1]})
+
+    return _handler
+
+
+def _creates(count):
+    return [{"method": "POST", "url": "/me/events", "body": {"subject": f"s{index}"}} for index in range(count)]
+
+
+async def test_chunks_of_twenty_answered_in_request_order(graph_client):
+    graph_client.handler = _answer()
+    responses = await graph_api.batch("access-token", _creates(45))
+
+    assert sorted(len(_sub_requests(request)) for request in graph_client.requests) == [5, 20, 20]
+    assert [response["body"]["id"] for response in responses] == [f"e{index}" for index in range(45)]
+    assert all(response["status"] == 201 for response in responses)
+    # Each create carries its own transactionId
+    bodies = [sub["body"] for request in graph_client.requests for sub in _sub_requests(request)]
+    assert len({body["transactionId"] for body in bodies}) == 45
+
+
+async def test_throttled_sub_requests_are_resent(graph_client):
+    throttled, answered = _answer({"3": 429, "21": 503}, {"Retry-After": "0"}), _answer()
+    graph_client.handler = lambda request: (throttled if len(graph_client.requests) <= 2 else answered)(request)
+    responses = await graph_api.batch("access-token", _creates(25))
+
+    assert [response["status"] for response in responses] == [201] * 25
+    resent = sorted(sub["id"] for request in graph_client.requests[2:] for sub in _sub_requests(request))
+    assert resent == ["21", "3"]
+    # The resend is the same create, so Graph can drop a duplicate
+    first = {sub["id"]: sub["body"] for request in graph_client.requests[:2] for sub in _sub_requests(request)}
+    assert all(sub["body"] == first[sub["id"]] for sub in _sub_requests(graph_client.requests[2]))
+
+
+async def test_throttled_batch_shares_one_retry_budget(graph_client, monkeypatch):
+    monkeypatch.setattr(graph_api, "GRAPH_MAX_RETRIES", 2)
+    graph_client.handler = lambda request: httpx.Response(429, headers={"Retry-After": "0"}, json={"error": {"code": "TooManyRequests"}})
+    responses = await graph_api.batch("access-token", _creates(3))
+
+    # The first try and two retries, not two retries of each of three tries
+    assert len(graph_client.requests) == 3
+    assert [response["status"] for response in responses] == [429] * 3
+
+
+async def test_unreachable_batch_is_retried(graph_client, monkeypatch):
+    monkeypatch.setattr(graph_api, "GRAPH_MAX_RETRIES", 1)
+    monkeypatch.setattr(graph_api, "backoff_delay", lambda attempt: 0)
+    calls = []
+
+    def _handler(request):
+        calls.append(request)
+        if len(calls) == 1:
+            raise httpx.ConnectError("refused")
+        return _answer()(request)
+
+    graph_client.handler = _handler
+    responses = await graph_api.batch("access-token", _creates(2))
+    assert [response["status"] for response in responses] == [201, 201]
+
+
+def test_batch_endpoint(client, graph):
+    graph.handler = _answer({"1": 404})
+    event = {"subject": "Review", "content": "", "start_time": "2026-03-02T09:00:00", "end_time": "2026-03-02T10:00:00", "time_zone": "UTC"}
+    operations = [{"op": "create", "event": event}, {"op": "delete", "event_id": "gone"}] * 12
+
+    response = client.post("/events/batch", json={"operations": operations}, headers={"email": "user@test.local"})
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert [result["index"] for result in results] == list(range(24))
+    assert results[0]["success"] and results[0]["event_id"] == "e0"
+    assert results[1] == {"index": 1, "op": "delete", "event_id": "gone", "status": 404, "success": False, "body": None}
+    assert results[3]["status"] == 204 and results[3]["success"]
+    assert [len(_sub_requests(request)) for request in graph.requests] == [20, 4]
@@ -0,0 +1,68 @@
+import jwt
+import pytest
+import requests
+from fastapi.testclient import TestClient
+
+import bench.fake_graph as fake_graph
+from bench.run import _percentile
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    monkeypatch.setattr(fake_graph, "settings", {**fake_graph.settings})
+    monkeypatch.setattr(fake_graph, "events", {})
+    fake_graph.calls.clear()
+    with TestClient(fake_graph.app) as client:
+        yield client
+
+
+def _claims(token: str) -> dict:
+    return jwt.decode(token, options={"verify_signature": False})
+
+
+def test_token_endpoint_signs_in_the_code_user(fake):
+    response = fake.post("/aad/common/oauth2/v2.0/token", content="grant_type=authorization_code&code=bench-a%40test.local&client_id=c")
+    body = response.json()
+    assert _claims(body["id_token"])["preferred_username"] == "a@test.local"
+    assert body["refresh_token"] == "rt-a@test.local"
+
+    refreshed = fake.post("/aad/common/oauth2/v2.0/token", content="grant_type=refresh_token&refresh_token=rt-a%40test.local").json()
+    assert _claims(refreshed["access_token"])["oid"] == _claims(body["access_token"])["oid"]
+
+
+def test_events_and_batch(fake):
+    created = fake.post("/v1.0/me/events", json={"subject": "Review"})
+    assert created.status_code == 201
+    event_id = created.json()["id"]
+    assert fake.patch(f"/v1.0/me/events/{event_id}", json={"subject": "Moved"}).json()["subject"] == "Moved"
+
+    responses = fake.post("/v1.0/$batch", json={"requests": [
+        {"id": "0", "method": "POST", "url": "/me/events", "body": {"subject": "New"}},
+        {"id": "1", "method": "DELETE", "url": f"/me/events/{event_id}"},
+        {"id": "2", "method": "GET", "url": "/me/events/missing"},
+    ]}).json()["responses"]
+    assert [response["status"] for response in responses] == [201, 204, 404]
+    assert fake.get(f"/v1.0/me/events/{event_id}").status_code == 404
+    assert fake.get("/_stats").json()["batch"] == 1
+
+
+def test_injected_throttling(fake):
+    fake_graph.settings.update(throttle_rate=1.0, retry_after=7)
+    response = fake.delete("/v1.0/me/events/e1")
+    assert response.status_code == 429 and response.headers["Retry-After"] == "7"
+    assert fake.get("/_stats").json()["throttled"] == 1
+
+
+def test_azure_ad_traffic_goes_to_the_stand_in(monkeypatch):
+    sent = []
+    monkeypatch.setattr(requests.Session, "request", lambda self, method, url, *args, **kwargs: sent.append(url))
+    session = fake_graph.LocalAzureADSession("http://127.0.0.1:8765/aad/")
+    session.request("GET", "https://login.microsoftonline.com/common/discovery/instance")
+    session.request("GET", "https://example.com/other")
+    assert sent == ["http://127.0.0.1:8765/aad/common/discovery/instance", "https://example.com/other"]
+
+
+def test_percentile():
+    samples = [0.001 * value for value in range(1, 101)]
+    assert (_percentile(samples, 50), _percentile(samples, 99)) == (50.0, 99.0)
+    assert _percentile([], 50) is None
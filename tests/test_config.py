@@ -0,0 +1,82 @@
+import dataclasses
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+import app.config as config
+from app.config import Settings, get_settings
+
+
+@pytest.fixture
+def environment(monkeypatch):
+    """
+    Sets environment variables for a fresh get_settings(); the cached
+    settings are read again after the test.
+    """
+    monkeypatch.setattr(config, "load_dotenv", lambda: None)
+    get_settings.cache_clear()
+    yield monkeypatch.setenv
+    get_settings.cache_clear()
+
+
+def test_importing_config_does_not_read_dotenv():
+    script = (
+        "import dotenv\n"
+        "calls = []\n"
+        "dotenv.load_dotenv = lambda *args, **kwargs: calls.append(1)\n"
+        "import app.config\n"
+        "print(len(calls))\n"
+        "app.config.GRAPH_MAX_RETRIES, app.config.CLIENT_ID\n"
+        "print(len(calls))\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", script], cwd=Path(__file__).parents[1], capture_output=True, text=True, check=True,
+    ).stdout
+    assert output.split() == ["0", "1"]
+
+
+def test_settings_from_environment(environment):
+    environment("SCOPES", "Calendars.ReadWrite User.Read People.Read")
+    environment("GRAPH_BATCH_SIZE", "50")
+    environment("MSAL_MAX_WORKERS", "3")
+    environment("TOKEN_ENCRYPTION_KEYS", " new , old ,")
+    environment("OUTBOX_LEASE_SECONDS", "30")
+    environment("ATTENDEE_RESOLUTION_ENABLED", "yes")
+
+    settings = get_settings()
+    assert settings is get_settings()
+    assert settings.scopes == ("Calendars.ReadWrite", "User.Read", "People.Read")
+    # Graph takes at most 20 requests per $batch
+    assert settings.graph_batch_size == 20
+    assert settings.msal_max_concurrency == 3
+    assert settings.token_encryption_keys == ("new", "old")
+    assert settings.outbox_lease_seconds == 30 and settings.attendee_resolution_enabled is True
+    with pytest.raises(dataclasses.FrozenInstanceError):
+        settings.graph_max_retries = 0
+
+
+def test_module_names_read_the_settings(environment):
+    environment("GRAPH_MAX_RETRIES", "7")
+    environment("SCOPES", "User.Read")
+    assert config.GRAPH_MAX_RETRIES == 7
+    assert config.SCOPES == ["User.Read"] and config.settings is get_settings()
+    with pytest.raises(AttributeError):
+        config.NOT_A_SETTING
+
+
+def test_secrets_stay_out_of_repr(environment):
+    environment("CLIENT_SECRET", "very-secret")
+    environment("DATABASE_URL", "postgresql://app:db-password@db/calendar")
+    text = repr(get_settings())
+    assert "very-secret" not in text and "db-password" not in text
+    environment("CLIENT_ID", "")
+    get_settings.cache_clear()
+    assert get_settings().problems() == ["CLIENT_ID"]
+
+
+def test_defaults():
+    settings = Settings.from_env()
+    assert settings.graph_route_timeouts["batch"] == 60.0
+    assert settings.subscription_lifetime_minutes <= 10080
@@ -0,0 +1,85 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import app.db as db_module
+import app.main as main
+from app.db import AsyncSessionLocal, Token, _async_url, close_db, get_db, init_db
+from app.token_cache import token_cache
+
+pytestmark = pytest.mark.anyio
+
+EMAIL = "user@test.local"
+
+
+@pytest.fixture
+async def tokens():
+    await init_db()
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(Token))
+        await db.commit()
+    token_cache.clear()
+    yield
+    token_cache.clear()
+    await close_db()
+
+
+async def _add(expires_in: timedelta, refresh_token="refresh"):
+    async with AsyncSessionLocal() as db:
+        db.add(Token(email=EMAIL, access_token="access", refresh_token=refresh_token, expires_at=datetime.utcnow() + expires_in))
+        await db.commit()
+
+
+async def _token(email=EMAIL) -> str:
+    async with AsyncSessionLocal() as db:
+        return await main.get_user_token(email, db)
+
+
+def test_async_url():
+    assert _async_url("postgresql://u:p@db/calendar") == "postgresql+asyncpg://u:p@db/calendar"
+    assert _async_url("postgresql+psycopg2://u:p@db/calendar") == "postgresql+asyncpg://u:p@db/calendar"
+    assert _async_url("sqlite:///./calendar.db") == "sqlite+aiosqlite:///./calendar.db"
+    assert _async_url("postgresql+asyncpg://db/calendar") == "postgresql+asyncpg://db/calendar"
+
+
+async def test_get_db_yields_an_async_session(tokens):
+    sessions = get_db()
+    db = await sessions.__anext__()
+    assert isinstance(db, AsyncSession)
+    await sessions.aclose()
+
+
+async def test_valid_token_is_read_once(tokens):
+    await _add(timedelta(hours=1))
+    assert await _token() == "access"
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(Token))
+        await db.commit()
+    # Served from the cache now
+    assert await _token() == "access"
+
+
+async def test_missing_or_expired_tokens(tokens):
+    with pytest.raises(HTTPException) as error:
+        await _token("")
+    assert error.value.status_code == 401
+    with pytest.raises(HTTPException) as error:
+        await _token()
+    assert error.value.status_code == 404
+
+    await _add(-timedelta(minutes=1), refresh_token=None)
+    with pytest.raises(HTTPException) as error:
+        await _token()
+    assert error.value.status_code == 401
+
+
+async def test_engine_is_created_on_first_use():
+    await db_module.close_db()
+    assert db_module._engine is None
+    async with AsyncSessionLocal() as db:
+        assert db.bind is db_module.get_engine() is db_module._engine
+    await db_module.close_db()
+    assert db_module._engine is None
@@ -0,0 +1,104 @@
+from urllib.parse import unquote
+
+import pytest
+
+import app.directory as directory
+from app.directory import AttendeeResolver
+
+pytestmark = pytest.mark.anyio
+
+DIRECTORY = {"alice@corp.com": "Alice A"}
+PEOPLE = {"ext@partner.com": "Ext Person"}
+
+
+class FakeBatch:
+    def __init__(self, statuses=None):
+        self.calls = []
+        self.statuses = statuses or {}
+
+    async def __call__(self, access_token, requests):
+        self.calls.append(requests)
+        responses = []
+        for request in requests:
+            url = unquote(request["url"])
+            source = "users" if url.startswith("/users") else "people"
+            if source in self.statuses:
+                responses.append({"status": self.statuses[source], "body": {"error": {"code": "Forbidden"}}})
+            elif source == "users":
+                address = url.split("'")[1]
+                value = [{"displayName": DIRECTORY[address]}] if address in DIRECTORY else []
+                responses.append({"status": 200, "body": {"value": value}})
+            else:
+                address = url.split('"')[1]
+                value = [{"displayName": "Someone", "scoredEmailAddresses": [{"address": "other@corp.com"}]}]
+                if address in PEOPLE:
+                    value = [{"displayName": PEOPLE[address], "scoredEmailAddresses": [{"address": address}]}]
+                responses.append({"status": 200, "body": {"value": value}})
+        return responses
+
+
+@pytest.fixture
+def fake_batch(monkeypatch):
+    fake = FakeBatch()
+    monkeypatch.setattr(directory, "batch", fake)
+    return fake
+
+
+async def test_resolves_from_directory_and_people(fake_batch):
+    resolver = AttendeeResolver()
+    entries = await resolver.resolve("token", ["alice@corp.com", "ext@partner.com", "nobody@nowhere.com"])
+    assert entries["alice@corp.com"].name == "Alice A"
+    assert entries["ext@partner.com"].name == "Ext Person"
+    # A fuzzy people match for another address does not count
+    assert entries["nobody@nowhere.com"].found is False
+    assert len(fake_batch.calls) == 1
+
+
+async def test_hits_and_negative_hits_skip_graph(fake_batch):
+    resolver = AttendeeResolver()
+    await resolver.resolve("token", ["alice@corp.com", "nobody@nowhere.com"])
+    entries = await resolver.resolve("token", ["Alice@corp.com", "nobody@nowhere.com"])
+    assert entries["Alice@corp.com"].found is True
+    assert entries["nobody@nowhere.com"].found is False
+    assert len(fake_batch.calls) == 1
+    stats = resolver.stats()
+    assert (stats["hits"], stats["negative_hits"], stats["misses"]) == (1, 1, 2)
+
+
+async def test_only_misses_are_looked_up(fake_batch):
+    resolver = AttendeeResolver()
+    await resolver.resolve("token", ["alice@corp.com"])
+    await resolver.resolve("token", ["alice@corp.com", "ext@partner.com"])
+    assert len(fake_batch.calls[1]) == 2  # users + people for ext@partner.com only
+
+
+async def test_failed_lookup_is_not_cached(monkeypatch):
+    async def failing(access_token, requests):
+        raise RuntimeError("Graph down")
+
+    monkeypatch.setattr(directory, "batch", failing)
+    resolver = AttendeeResolver()
+    entries = await resolver.resolve("token", ["alice@corp.com"])
+    assert entries["alice@corp.com"].found is None
+    assert resolver.stats()["size"] == 0
+
+
+async def test_refused_source_is_skipped_for_the_tenant(monkeypatch):
+    fake = FakeBatch({"users": 403, "people": 403})
+    monkeypatch.setattr(directory, "batch", fake)
+    resolver = AttendeeResolver()
+    assert (await resolver.resolve("token", ["alice@corp.com"]))["alice@corp.com"].found is None
+    assert (await resolver.resolve("token", ["bob@corp.com"]))["bob@corp.com"].found is None
+    assert len(fake.calls) == 1
+
+
+async def test_refused_users_still_asks_people(monkeypatch):
+    fake = FakeBatch({"users": 403})
+    monkeypatch.setattr(directory, "batch", fake)
+    resolver = AttendeeResolver()
+    await resolver.resolve("token", ["alice@corp.com"])
+    entries = await resolver.resolve("token", ["ext@partner.com", "alice@corp.com"])
+    assert entries["ext@partner.com"].name == "Ext Person"
+    # Unsettled without /users, but cached rather than asked again
+    assert entries["alice@corp.com"].found is None
+    assert [len(call) for call in fake.calls] == [2, 1]
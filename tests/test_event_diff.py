@@ -0,0 +1,135 @@
+import json
+
+import httpx
+import pytest
+
+from app.event_diff import WrittenEvents
+
+pytestmark = pytest.mark.anyio
+
+PAYLOAD = {
+    "subject": "Planning",
+    "body": {"contentType": "HTML", "content": "<p>agenda</p>" * 100},
+    "start": {"dateTime": "2030-01-01T09:00:00", "timeZone": "UTC"},
+    "end": {"dateTime": "2030-01-01T10:00:00", "timeZone": "UTC"},
+}
+
+
+async def _written() -> WrittenEvents:
+    written = WrittenEvents()
+    await written.remember("a@x", {"id": "e1", "@odata.etag": 'W/"1"'}, PAYLOAD)
+    return written
+
+
+async def test_without_if_match_everything_is_sent():
+    written = await _written()
+    assert await written.diff("a@x", "e1", dict(PAYLOAD)) == PAYLOAD
+
+
+async def test_if_match_of_recorded_write_sends_only_changes():
+    written = await _written()
+    changes = await written.diff("a@x", "e1", {**PAYLOAD, "subject": "Review"}, 'W/"1"')
+    assert changes == {"subject": "Review"}
+
+
+async def test_unchanged_with_recorded_if_match_is_empty():
+    written = await _written()
+    assert await written.diff("a@x", "e1", dict(PAYLOAD), 'W/"1"') == {}
+    assert written.stats()["unchanged"] == 1
+
+
+async def test_other_if_match_sends_everything():
+    written = await _written()
+    assert await written.diff("a@x", "e1", dict(PAYLOAD), 'W/"7"') == PAYLOAD
+
+
+async def test_newer_etag_in_event_store_sends_everything():
+    written = await _written()
+    assert await written.diff("a@x", "e1", dict(PAYLOAD), 'W/"1"', current_etag='W/"2"') == PAYLOAD
+
+
+async def test_start_and_end_go_together():
+    written = await _written()
+    moved = {**PAYLOAD, "end": {"dateTime": "2030-01-01T11:00:00", "timeZone": "UTC"}}
+    changes = await written.diff("a@x", "e1", moved, 'W/"1"')
+    assert set(changes) == {"start", "end"}
+
+
+async def test_partial_write_keeps_other_fields():
+    written = await _written()
+    await written.remember("a@x", {"id": "e1", "@odata.etag": 'W/"2"'}, {"subject": "Review"}, partial=True)
+    assert await written.diff("a@x", "e1", {**PAYLOAD, "subject": "Review"}, 'W/"2"') == {}
+
+
+async def test_forget():
+    written = await _written()
+    await written.forget("a@x", "e1")
+    assert await written.diff("a@x", "e1", dict(PAYLOAD), 'W/"1"') == PAYLOAD
+
+
+class _Calendar:
+    """
+    One event behind the fake Graph, with an etag bumped on every write.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self.event = {}
+
+    @property
+    def etag(self):
+        return f'W/"{self.version}"'
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        body = json.loads(request.content) if request.content else {}
+        if request.method == "PATCH":
+            if_match = request.headers.get("if-match")
+            if if_match and if_match != self.etag:
+                return httpx.Response(412, json={"error": {"code": "ErrorIrresolvableConflict"}})
+            self.event.update(body)
+        elif request.method == "POST":
+            self.event = {"id": "e1", **body}
+        self.version += 1
+        return httpx.Response(201 if request.method == "POST" else 200, json={**self.event, "@odata.etag": self.etag})
+
+
+def _event(subject):
+    return {"subject": subject, "content": "<p>agenda</p>", "start_time": "2030-01-01T09:00:00", "end_time": "2030-01-01T10:00:00"}
+
+
+def _patches(graph):
+    return [request for request in graph.requests if request.method == "PATCH"]
+
+
+def test_update_endpoint(client, graph):
+    calendar = _Calendar()
+    graph.handler = calendar
+    headers = {"email": "user@test.local"}
+    created = client.post("/event/create", headers=headers, json=_event("a"))
+    etag = created.json()["@odata.etag"]
+
+    # Without If-Match the update always goes out, in full and unconditionally
+    response = client.patch("/event/update/e1", headers=headers, json=_event("a"))
+    assert response.status_code == 200
+    request = _patches(graph)[-1]
+    assert "if-match" not in request.headers
+    assert set(json.loads(request.content)) == {"subject", "body", "start", "end"}
+    etag = response.headers["etag"]
+
+    # With the ETag of the last write, only the changed field is sent
+    response = client.patch("/event/update/e1", headers={**headers, "If-Match": etag}, json=_event("b"))
+    request = _patches(graph)[-1]
+    assert request.headers["if-match"] == etag
+    assert json.loads(request.content) == {"subject": "b"}
+    etag = response.headers["etag"]
+
+    # Nothing changed since that write: no Graph call
+    count = len(graph.requests)
+    response = client.patch("/event/update/e1", headers={**headers, "If-Match": etag}, json=_event("b"))
+    assert response.status_code == 200 and response.headers["etag"] == etag
+    assert len(graph.requests) == count
+
+    # Edited elsewhere: the client's precondition fails
+    calendar.version += 1
+    response = client.patch("/event/update/e1", headers={**headers, "If-Match": etag}, json=_event("c"))
+    assert response.status_code == 412
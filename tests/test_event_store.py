@@ -0,0 +1,108 @@
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+import app.graph_api as graph_api
+from app.event_store import EventStore
+
+pytestmark = pytest.mark.anyio
+
+EMAIL = "user@test.local"
+DELTA = "https://graph.microsoft.com/v1.0/me/calendarView/delta?$deltatoken=1"
+
+
+@pytest.fixture
+def graph_client(graph, monkeypatch):
+    monkeypatch.setattr(graph_api, "_client", httpx.AsyncClient(transport=httpx.MockTransport(graph)))
+    return graph
+
+
+def _event(event_id, day, **fields):
+    return {
+        "id": event_id,
+        "start": {"dateTime": f"2026-03-{day:02d}T09:00:00", "timeZone": "UTC"},
+        "end": {"dateTime": f"2026-03-{day:02d}T10:00:00", "timeZone": "UTC"},
+        **fields,
+    }
+
+
+def _pages(*pages):
+    """
+    Answers calendarView/delta requests with `pages` in turn, linked by nextLink.
+    """
+    answers = iter(pages)
+
+    def _handler(request):
+        return httpx.Response(200, json=next(answers))
+
+    return _handler
+
+
+async def test_full_sync_pages_then_delta(graph_client):
+    graph_client.handler = _pages(
+        {"value": [_event("a", 2), _event("b", 3)], "@odata.nextLink": "https://graph.microsoft.com/v1.0/me/calendarView/delta?$skiptoken=2"},
+        {"value": [_event("c", 4, seriesMasterId="s")], "@odata.deltaLink": DELTA},
+        {"value": [{"id": "b", "@removed": {"reason": "deleted"}}, _event("a", 5, subject="moved")], "@odata.deltaLink": DELTA + "2"},
+    )
+    store = EventStore()
+    await store.ensure_fresh(EMAIL, "token")
+    assert [event["id"] for event in store.list(EMAIL)] == ["a", "b", "c"]
+    first = graph_client.requests[0]
+    assert "startDateTime" in first.url.params and first.headers["Prefer"].startswith("odata.maxpagesize=")
+
+    # Fresh enough: no Graph call
+    await store.ensure_fresh(EMAIL, "token")
+    assert len(graph_client.requests) == 2
+
+    store.upsert(EMAIL, {"id": "s", "type": "seriesMaster", "subject": "Standup"})
+    await store.ensure_fresh(EMAIL, "token", force=True)
+    assert str(graph_client.requests[2].url) == DELTA
+    assert [event["id"] for event in store.list(EMAIL)] == ["c", "a"]
+    assert store.get(EMAIL, "a")["subject"] == "moved" and store.get(EMAIL, "s")["subject"] == "Standup"
+    assert store.stats()["full_syncs"] == 1 and store.stats()["delta_syncs"] == 1
+
+
+async def test_range_outside_window_widens_it(graph_client, monkeypatch):
+    graph_client.handler = lambda request: httpx.Response(200, json={"value": [], "@odata.deltaLink": DELTA})
+    store = EventStore()
+    await store.ensure_fresh(EMAIL, "token")
+    far = datetime.now(timezone.utc) + timedelta(days=3650)
+    await store.ensure_fresh(EMAIL, "token", far, far + timedelta(days=1))
+
+    # A full sync over the wider window, not a delta of the old one
+    assert len(graph_client.requests) == 2 and "startDateTime" in graph_client.requests[1].url.params
+    assert graph_client.requests[1].url.params["endDateTime"] >= (far + timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%SZ")
+    assert store.stats()["full_syncs"] == 2
+    await store.ensure_fresh(EMAIL, "token", far, far + timedelta(days=1))
+    assert len(graph_client.requests) == 2
+
+
+async def test_expired_delta_link_starts_over(graph_client):
+    def _handler(request):
+        if "deltatoken" in str(request.url):
+            return httpx.Response(410, json={"error": {"code": "SyncStateNotFound"}})
+        return httpx.Response(200, json={"value": [_event("a", 2)], "@odata.deltaLink": DELTA})
+
+    graph_client.handler = _handler
+    store = EventStore()
+    await store.sync(EMAIL, "token")
+    await store.sync(EMAIL, "token")
+    assert [event["id"] for event in store.list(EMAIL)] == ["a"]
+    assert store.stats()["full_syncs"] == 2 and store.stats()["delta_syncs"] == 0
+
+
+async def test_list_by_range_and_local_writes(graph_client):
+    graph_client.handler = _pages({"value": [_event("a", 2), _event("b", 3)], "@odata.deltaLink": DELTA})
+    store = EventStore()
+    await store.sync(EMAIL, "token")
+    start = datetime(2026, 3, 2, 10, tzinfo=timezone.utc)
+    # An event ending exactly at the range start is outside it
+    assert [event["id"] for event in store.list(EMAIL, start, start + timedelta(days=2))] == ["b"]
+
+    store.upsert(EMAIL, {"id": "b", "subject": "renamed"})
+    store.remove(EMAIL, "a")
+    assert [(event["id"], event.get("subject")) for event in store.list(EMAIL)] == [("b", "renamed")]
+    # Users without a store are not started by a write
+    store.upsert("other@test.local", _event("x", 2))
+    assert not store.has("other@test.local")
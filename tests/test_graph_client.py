@@ -0,0 +1,53 @@
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+import app.graph_api as graph_api
+import app.main as main
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def no_client(monkeypatch):
+    monkeypatch.setattr(graph_api, "_client", None)
+
+
+async def test_one_client_per_process(no_client):
+    with pytest.raises(RuntimeError):
+        graph_api.get_client()
+    client = await graph_api.start_client()
+    try:
+        assert await graph_api.start_client() is client and graph_api.get_client() is client
+        assert graph_api.pool_stats()["started"] is True
+    finally:
+        await graph_api.close_client()
+    assert client.is_closed and graph_api._client is None
+    # Closing twice is harmless
+    await graph_api.close_client()
+
+
+async def test_requests_share_the_client_with_route_timeouts(monkeypatch):
+    seen = []
+
+    def _handler(request):
+        seen.append(request.extensions["timeout"])
+        return httpx.Response(204)
+
+    monkeypatch.setattr(graph_api, "_client", httpx.AsyncClient(transport=httpx.MockTransport(_handler)))
+    monkeypatch.setitem(graph_api.GRAPH_ROUTE_TIMEOUTS, "delete_event", 3.0)
+    before = graph_api.pool_stats()["total_requests"]
+
+    assert await graph_api.delete_event("access-token", "e1")
+    assert await graph_api.delete_event("access-token", "e2")
+    assert seen[0]["read"] == 3.0 and seen[0]["connect"] == graph_api.GRAPH_CONNECT_TIMEOUT
+    stats = graph_api.pool_stats()
+    assert stats["total_requests"] == before + 2 and stats["in_flight_requests"] == 0
+
+
+def test_lifespan_opens_and_closes_the_client(no_client):
+    with TestClient(main.app) as test_client:
+        client = graph_api._client
+        assert client is not None and not client.is_closed
+        assert test_client.get("/stats/graph").json()["started"] is True
+    assert client.is_closed and graph_api._client is None
@@ -0,0 +1,174 @@
+import json
+from datetime import datetime
+
+import httpx
+import pytest
+
+import app.main as main
+from app.ics import (
+    LineTooLongError,
+    _unfolded_lines,
+    parse_events,
+    rrule_to_recurrence,
+    to_graph_payload,
+    to_vevent,
+)
+
+pytestmark = pytest.mark.anyio
+
+CALENDAR = (
+    "BEGIN:VCALENDAR\r\n"
+    "BEGIN:VEVENT\r\n"
+    "UID:one@example.com\r\n"
+    'DTSTART;TZID="Europe/Berlin":20260302T090000\r\n'
+    "DTEND;TZID=Europe/Berlin:20260302T100000\r\n"
+    "SUMMARY:Planning\\, part 1 – kick\r\n"
+    " off\r\n"
+    "DESCRIPTION:Line one\\nLine two\r\n"
+    "RRULE:FREQ=WEEKLY;BYDAY=MO,WE;COUNT=6\r\n"
+    "ATTENDEE;CN=\"Doe: Jane\";ROLE=OPT-PARTICIPANT:mailto:jane@example.com\r\n"
+    "BEGIN:VALARM\r\n"
+    "TRIGGER:-PT15M\r\n"
+    "SUMMARY:Alarm\r\n"
+    "END:VALARM\r\n"
+    "END:VEVENT\r\n"
+    "BEGIN:VEVENT\r\n"
+    "UID:two@example.com\r\n"
+    "DTSTART;VALUE=DATE:20260305\r\n"
+    "SUMMARY:Offsite\r\n"
+    "END:VEVENT\r\n"
+    "END:VCALENDAR\r\n"
+).encode()
+
+
+async def _chunks(data: bytes, size: int = 7):
+    # Small chunks split lines, folds and UTF-8 sequences
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+async def _events(data: bytes):
+    return [event async for event in parse_events(_chunks(data))]
+
+
+async def test_parse_events_unfolds_and_skips_alarms():
+    first, second = await _events(CALENDAR)
+    names = [name for name, _, _ in first]
+    assert names == ["UID", "DTSTART", "DTEND", "SUMMARY", "DESCRIPTION", "RRULE", "ATTENDEE"]
+    assert dict((name, value) for name, _, value in first)["SUMMARY"] == "Planning\\, part 1 – kickoff"
+    assert first[1][1] == {"TZID": "Europe/Berlin"}
+    assert first[6][1] == {"CN": "Doe: Jane", "ROLE": "OPT-PARTICIPANT"}
+    assert [name for name, _, _ in second] == ["UID", "DTSTART", "SUMMARY"]
+
+
+async def test_to_graph_payload():
+    first, second = await _events(CALENDAR)
+    payload = to_graph_payload(first, "UTC", "user@test.local")
+    assert payload["subject"] == "Planning, part 1 – kickoff"
+    assert payload["body"]["content"] == "Line one\nLine two"
+    assert payload["start"] == {"dateTime": "2026-03-02T09:00:00", "timeZone": "Europe/Berlin"}
+    assert payload["end"] == {"dateTime": "2026-03-02T10:00:00", "timeZone": "Europe/Berlin"}
+    assert payload["attendees"] == [{"emailAddress": {"address": "jane@example.com", "name": "Doe: Jane"}, "type": "optional"}]
+    assert payload["recurrence"]["pattern"] == {"interval": 1, "type": "weekly", "daysOfWeek": ["monday", "wednesday"]}
+    assert payload["recurrence"]["range"] == {
+        "startDate": "2026-03-02", "recurrenceTimeZone": "Europe/Berlin", "type": "numbered", "numberOfOccurrences": 6,
+    }
+
+    all_day = to_graph_payload(second, "Europe/London", "user@test.local")
+    assert all_day["isAllDay"] is True
+    assert all_day["start"] == {"dateTime": "2026-03-05T00:00:00", "timeZone": "Europe/London"}
+    assert all_day["end"]["dateTime"] == "2026-03-06T00:00:00"
+
+
+async def test_transaction_id_is_stable_per_user_and_uid():
+    first, _ = await _events(CALENDAR)
+    again, _ = await _events(CALENDAR)
+    assert to_graph_payload(first, "UTC", "a@test.local")["transactionId"] == to_graph_payload(again, "UTC", "a@test.local")["transactionId"]
+    assert to_graph_payload(first, "UTC", "a@test.local")["transactionId"] != to_graph_payload(first, "UTC", "b@test.local")["transactionId"]
+
+
+def test_payload_times_and_rejections():
+    utc = to_graph_payload([("DTSTART", {}, "20260302T090000Z"), ("DURATION", {}, "PT1H30M")], "Europe/Berlin", "u")
+    assert utc["start"] == {"dateTime": "2026-03-02T09:00:00", "timeZone": "UTC"}
+    assert utc["end"]["dateTime"] == "2026-03-02T10:30:00"
+    # DTEND in another zone is converted to the start's
+    mixed = to_graph_payload([("DTSTART", {"TZID": "Europe/Berlin"}, "20260302T090000"), ("DTEND", {}, "20260302T090000Z")], "UTC", "u")
+    assert mixed["end"] == {"dateTime": "2026-03-02T10:00:00", "timeZone": "Europe/Berlin"}
+    with pytest.raises(ValueError):
+        to_graph_payload([("SUMMARY", {}, "x")], "UTC", "u")
+    with pytest.raises(ValueError):
+        to_graph_payload([("DTSTART", {}, "20260302T090000Z"), ("RECURRENCE-ID", {}, "20260302T090000Z")], "UTC", "u")
+
+
+def test_rrule_to_recurrence():
+    start = datetime(2026, 3, 10, 9)
+    monthly = rrule_to_recurrence("FREQ=MONTHLY;BYDAY=2TU;UNTIL=20261231T000000Z", start, "UTC")
+    assert monthly["pattern"] == {"interval": 1, "type": "relativeMonthly", "daysOfWeek": ["tuesday"], "index": "second"}
+    assert monthly["range"]["type"] == "endDate" and monthly["range"]["endDate"] == "2026-12-31"
+    assert rrule_to_recurrence("FREQ=YEARLY", start, "UTC")["pattern"] == {"interval": 1, "month": 3, "type": "absoluteYearly", "dayOfMonth": 10}
+    with pytest.raises(ValueError):
+        rrule_to_recurrence("FREQ=DAILY;BYHOUR=9", start, "UTC")
+    with pytest.raises(ValueError):
+        rrule_to_recurrence("FREQ=MINUTELY", start, "UTC")
+
+
+async def test_exported_event_parses_back():
+    event = {
+        "id": "e1",
+        "subject": "Review; budget, " + "long " * 30,
+        "start": {"dateTime": "2026-03-02T09:00:00.0000000", "timeZone": "Europe/Berlin"},
+        "end": {"dateTime": "2026-03-02T10:00:00.0000000", "timeZone": "Europe/Berlin"},
+        "recurrence": {"pattern": {"type": "weekly", "interval": 2, "daysOfWeek": ["monday"]}, "range": {"type": "noEnd", "startDate": "2026-03-02"}},
+    }
+    vevent = to_vevent(event, "20260301T000000Z")
+    assert all(len(line.encode()) <= 75 for line in vevent.split("\r\n"))
+    (properties,) = await _events(vevent.encode())
+    payload = to_graph_payload(properties, "UTC", "u")
+    assert payload["subject"] == event["subject"]
+    assert payload["start"] == {"dateTime": "2026-03-02T09:00:00", "timeZone": "Europe/Berlin"}
+    assert payload["recurrence"]["pattern"] == {"interval": 2, "type": "weekly", "daysOfWeek": ["monday"]}
+
+
+@pytest.mark.parametrize("data", [
+    b"SUMMARY:" + b"x" * 100 + b"\r\n",
+    b"SUMMARY:" + b"x" * 100,
+    b"SUMMARY:" + b"x" * 60 + b"\r\n " + b"x" * 60 + b"\r\n",
+])
+async def test_overlong_lines_are_rejected(data):
+    with pytest.raises(LineTooLongError):
+        [line async for line in _unfolded_lines(_chunks(data), max_length=100)]
+
+
+async def test_lines_at_the_limit_pass():
+    data = b"SUMMARY:" + b"x" * 92 + b"\r\nUID:1\r\n"
+    assert [line async for line in _unfolded_lines(_chunks(data), max_length=100)] == ["SUMMARY:" + "x" * 92, "UID:1"]
+
+
+def test_import_rejects_overlong_line(client, graph):
+    upload = CALENDAR.replace(b"END:VCALENDAR\r\n", b"X-JUNK:" + b"x" * (2 ** 20) + b"\r\nEND:VCALENDAR\r\n")
+    response = client.post("/events/import", content=upload, headers={"email": "user@test.local"})
+    assert response.status_code == 413
+    detail = response.json()["detail"]
+    assert "longer than" in detail["message"]
+    # Events still waiting for their $batch are not sent
+    assert detail["imported"] == 0 and not graph.requests
+
+
+def test_export_fetches_token_per_page(client, graph, monkeypatch):
+    tokens = iter(["token-1", "token-2"])
+
+    async def _token(email):
+        return next(tokens)
+
+    monkeypatch.setattr(main, "_background_token", _token)
+
+    def _handler(request):
+        if "page=2" in str(request.url):
+            return httpx.Response(200, json={"value": [{"id": "e2"}]})
+        return httpx.Response(200, json={"value": [{"id": "e1"}], "@odata.nextLink": "https://graph.microsoft.com/v1.0/me/events?page=2"})
+
+    graph.handler = _handler
+    response = client.get("/events/export?format=ndjson", headers={"email": "user@test.local"})
+    assert response.status_code == 200
+    assert [json.loads(line)["id"] for line in response.text.splitlines()] == ["e1", "e2"]
+    assert [request.headers["Authorization"] for request in graph.requests] == ["Bearer token-1", "Bearer token-2"]
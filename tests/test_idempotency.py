@@ -0,0 +1,127 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import delete
+
+from app.db import AsyncSessionLocal, IdempotencyKey, close_db, init_db
+from app.idempotency import IdempotencyStore, request_fingerprint, transaction_id
+
+pytestmark = pytest.mark.anyio
+
+EMAIL = "user@test.local"
+
+
+@pytest.fixture
+async def db():
+    await init_db()
+    async with AsyncSessionLocal() as session:
+        await session.execute(delete(IdempotencyKey))
+        await session.commit()
+        yield session
+    await close_db()
+
+
+class _Call:
+    """
+    Stands in for the keyed request; counts how often it really ran.
+    """
+
+    def __init__(self, status_code=200, body=None, store=True, delay=0.0):
+        self.result = (status_code, body if body is not None else {"id": "e1"}, store)
+        self.delay = delay
+        self.calls = 0
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        return self.result
+
+
+def test_fingerprint_ignores_key_order():
+    assert request_fingerprint({"a": 1, "b": 2}, True) == request_fingerprint({"b": 2, "a": 1}, True)
+    assert request_fingerprint({"a": 1}, True) != request_fingerprint({"a": 1}, False)
+    assert transaction_id(EMAIL, "k") == transaction_id(EMAIL, "k") != transaction_id("other@test.local", "k")
+
+
+async def test_replays_stored_response(db):
+    store = IdempotencyStore()
+    call = _Call(201, {"id": "e1"})
+    assert await store.run(db, EMAIL, "k1", "hash", call) == (201, {"id": "e1"}, False)
+    assert await store.run(db, EMAIL, "k1", "hash", call) == (201, {"id": "e1"}, True)
+    assert call.calls == 1
+    # Keys are per user
+    assert (await store.run(db, "other@test.local", "k1", "hash", call))[2] is False
+    assert store.stats()["replays"] == 1 and store.stats()["misses"] == 2
+
+
+async def test_replays_from_database_after_restart(db):
+    await IdempotencyStore().run(db, EMAIL, "k1", "hash", _Call(201, {"id": "e1"}))
+    call = _Call()
+    assert await IdempotencyStore().run(db, EMAIL, "k1", "hash", call) == (201, {"id": "e1"}, True)
+    assert call.calls == 0
+
+
+async def test_key_reused_for_another_request(db):
+    store = IdempotencyStore()
+    await store.run(db, EMAIL, "k1", "hash", _Call())
+    with pytest.raises(HTTPException) as error:
+        await store.run(db, EMAIL, "k1", "other-hash", _Call())
+    assert error.value.status_code == 422
+    assert store.stats()["mismatches"] == 1
+
+
+async def test_failed_attempt_can_be_retried(db):
+    store = IdempotencyStore()
+    failed = _Call(502, {"error": "Graph unavailable"}, store=False)
+    assert await store.run(db, EMAIL, "k1", "hash", failed) == (502, {"error": "Graph unavailable"}, False)
+    succeeded = _Call(201, {"id": "e1"})
+    assert await store.run(db, EMAIL, "k1", "hash", succeeded) == (201, {"id": "e1"}, False)
+    assert failed.calls == 1 and succeeded.calls == 1
+
+
+async def test_concurrent_requests_share_one_call(db):
+    store = IdempotencyStore()
+    call = _Call(201, {"id": "e1"}, delay=0.05)
+
+    async def _request():
+        # Each request has a session of its own
+        async with AsyncSessionLocal() as session:
+            return await store.run(session, EMAIL, "k1", "hash", call)
+
+    results = await asyncio.gather(*(_request() for _ in range(3)))
+    assert call.calls == 1
+    assert sorted(replayed for _, _, replayed in results) == [False, True, True]
+
+
+async def test_expired_record_is_not_replayed(db):
+    store = IdempotencyStore(ttl_seconds=0)
+    await store.run(db, EMAIL, "k1", "hash", _Call())
+    call = _Call()
+    assert (await store.run(db, EMAIL, "k1", "hash", call))[2] is False
+    assert call.calls == 1
+
+
+async def test_overlong_key_is_rejected(db):
+    with pytest.raises(HTTPException) as error:
+        await IdempotencyStore().run(db, EMAIL, "k" * 256, "hash", _Call())
+    assert error.value.status_code == 400
+
+
+def test_create_endpoint_replays(client, graph):
+    graph.handler = lambda request: httpx.Response(201, json={"id": f"e{len(graph.requests)}", "@odata.etag": 'W/"1"'})
+    event = {"subject": "Review", "content": "", "start_time": "2026-03-02T09:00:00", "end_time": "2026-03-02T10:00:00", "time_zone": "UTC"}
+    headers = {"email": EMAIL, "Idempotency-Key": "create-1"}
+
+    first = client.post("/event/create", json=event, headers=headers)
+    again = client.post("/event/create", json=event, headers=headers)
+    assert first.status_code == again.status_code == 200
+    assert first.json()["id"] == again.json()["id"] == "e1"
+    assert "Idempotent-Replayed" not in first.headers and again.headers["Idempotent-Replayed"] == "true"
+    assert len(graph.requests) == 1
+    assert json.loads(graph.requests[0].content)["transactionId"] == transaction_id(EMAIL, "create-1")
+
+    changed = client.post("/event/create", json={**event, "subject": "Other"}, headers=headers)
+    assert changed.status_code == 422 and len(graph.requests) == 1
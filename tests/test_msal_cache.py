@@ -0,0 +1,95 @@
+import json
+
+import pytest
+from msal import SerializableTokenCache
+from sqlalchemy import delete, select, update
+
+import app.msal_cache as msal_cache
+from app import shared_state
+from app.db import AsyncSessionLocal, MsalTokenCache, close_db, init_db
+
+pytestmark = pytest.mark.anyio
+
+EMAIL = "user@test.local"
+
+
+@pytest.fixture
+async def caches():
+    await init_db()
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(MsalTokenCache))
+        await db.commit()
+    msal_cache._blobs.clear()
+    yield
+    msal_cache._blobs.clear()
+    await close_db()
+
+
+def _cache(secret: str) -> SerializableTokenCache:
+    cache = SerializableTokenCache()
+    cache.deserialize(json.dumps({"RefreshToken": {"rt": {"secret": secret}}}))
+    cache.has_state_changed = True
+    return cache
+
+
+def _from_other_worker(kind: str, key: str):
+    shared_state._dispatch(json.dumps({"origin": "other-worker", "kind": kind, "key": key}))
+
+
+async def _secret() -> str:
+    return json.loads((await msal_cache.load_cache(EMAIL)).serialize())["RefreshToken"]["rt"]["secret"]
+
+
+@pytest.mark.parametrize("kind", ["msal_cache", "token", "user"])
+async def test_invalidation_drops_the_local_blob(caches, kind):
+    await msal_cache.save_cache(EMAIL, _cache("old"))
+    # Another worker refreshes and writes a newer cache
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(MsalTokenCache).values(cache_blob=_cache("new").serialize()))
+        await db.commit()
+    assert await _secret() == "old"
+
+    _from_other_worker(kind, EMAIL)
+    assert EMAIL not in msal_cache._blobs
+    assert await _secret() == "new"
+
+
+async def test_unchanged_cache_is_not_written(caches):
+    cache = _cache("old")
+    cache.has_state_changed = False
+    await msal_cache.save_cache(EMAIL, cache)
+    assert EMAIL not in msal_cache._blobs
+    assert (await msal_cache.load_cache(EMAIL)).serialize() == "{}"
+
+
+async def _rows() -> list:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(MsalTokenCache.email))).scalars().all()
+
+
+async def test_cache_is_read_from_the_database_once(caches):
+    await msal_cache.save_cache(EMAIL, _cache("first"))
+    await msal_cache.save_cache(EMAIL, _cache("second"))
+    assert await _rows() == [EMAIL]
+
+    msal_cache._blobs.clear()
+    assert await _secret() == "second"
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(MsalTokenCache))
+        await db.commit()
+    # Served from this worker's copy
+    assert await _secret() == "second"
+
+
+async def test_delete_cache(caches):
+    await msal_cache.save_cache(EMAIL, _cache("old"))
+    await msal_cache.delete_cache(EMAIL)
+    assert await _rows() == [] and EMAIL not in msal_cache._blobs
+
+
+async def test_local_copies_are_bounded(caches, monkeypatch):
+    monkeypatch.setattr(msal_cache, "MSAL_CACHE_MAX_USERS", 2)
+    for email in ("a@test.local", "b@test.local", "c@test.local"):
+        await msal_cache.save_cache(email, _cache(email))
+    assert list(msal_cache._blobs) == ["b@test.local", "c@test.local"]
+    assert len(await _rows()) == 3
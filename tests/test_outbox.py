@@ -0,0 +1,191 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, update
+
+import app.outbox as outbox_module
+from app.db import AsyncSessionLocal, OutboxJob, close_db, init_db
+from app.outbox import OutboxWorkers, enqueue
+
+pytestmark = pytest.mark.anyio
+
+EMAIL = "user@test.local"
+
+
+@pytest.fixture
+async def workers():
+    await init_db()
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(OutboxJob))
+        await db.commit()
+    workers = OutboxWorkers(workers=1)
+
+    async def _token(email):
+        return "access-token"
+
+    workers._token_provider = _token
+    yield workers
+    await close_db()
+
+
+@pytest.fixture
+def graph_batch(monkeypatch):
+    """
+    Replaces the outbox's $batch call; `statuses` maps a sub-request url to
+    the status it answers with (200 by default).
+    """
+    class _Batch:
+        def __init__(self):
+            self.calls = []
+            self.statuses = {}
+
+        async def __call__(self, token, requests, slot=None):
+            self.calls.append(requests)
+            responses = []
+            for request in requests:
+                status = self.statuses.get(request["url"], 200)
+                body = {"id": request["url"].rsplit("/", 1)[-1], "@odata.etag": "W/\"1\""} if status == 200 else {"error": {"code": str(status)}}
+                responses.append({"id": str(len(responses)), "status": status, "body": body})
+            return responses
+
+    fake = _Batch()
+    monkeypatch.setattr(outbox_module, "batch", fake)
+    return fake
+
+
+async def _enqueue(op, event_id=None, payload=None, email=EMAIL):
+    async with AsyncSessionLocal() as db:
+        return await enqueue(db, email, op, event_id, payload)
+
+
+async def _job(job_id) -> OutboxJob:
+    async with AsyncSessionLocal() as db:
+        return await db.get(OutboxJob, job_id)
+
+
+async def _make_due(job_id):
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(OutboxJob).where(OutboxJob.id == job_id).values(next_attempt_at=datetime.utcnow() - timedelta(seconds=1)))
+        await db.commit()
+
+
+async def _claim_and_process(workers):
+    claimed = await workers._claim()
+    if claimed is None:
+        return None
+    email, jobs = claimed
+    try:
+        await workers._process(email, jobs)
+    finally:
+        workers._busy_users.discard(email)
+    return [job.id for job in jobs]
+
+
+async def test_claims_one_job_per_event(workers, graph_batch):
+    first = await _enqueue("update", "e1", {"subject": "a"})
+    second = await _enqueue("update", "e1", {"subject": "b"})
+    other = await _enqueue("update", "e2", {"subject": "c"})
+    created = await _enqueue("create", payload={"subject": "d"})
+
+    assert await _claim_and_process(workers) == [first.id, other.id, created.id]
+    assert await _claim_and_process(workers) == [second.id]
+    assert await _claim_and_process(workers) is None
+    assert [[request["body"]["subject"] for request in call] for call in graph_batch.calls] == [["a", "c", "d"], ["b"]]
+    for job in (first, second, other, created):
+        assert (await _job(job.id)).status == "succeeded"
+
+
+async def test_later_write_waits_for_earlier_retry(workers, graph_batch):
+    first = await _enqueue("update", "e1", {"subject": "a"})
+    second = await _enqueue("update", "e1", {"subject": "b"})
+    graph_batch.statuses["/me/events/e1"] = 503
+
+    assert await _claim_and_process(workers) == [first.id]
+    job = await _job(first.id)
+    assert job.status == "pending" and job.attempts == 1 and job.last_error.startswith("Graph returned 503")
+    # The retry is not due yet and the later write must not overtake it
+    assert await _claim_and_process(workers) is None
+
+    graph_batch.statuses.clear()
+    await _make_due(first.id)
+    assert await _claim_and_process(workers) == [first.id]
+    assert await _claim_and_process(workers) == [second.id]
+    assert (await _job(second.id)).status == "succeeded"
+
+
+async def test_retries_until_max_attempts(workers, graph_batch, monkeypatch):
+    monkeypatch.setattr(outbox_module, "OUTBOX_MAX_ATTEMPTS", 2)
+    job = await _enqueue("delete", "e1")
+    graph_batch.statuses["/me/events/e1"] = 429
+
+    await _claim_and_process(workers)
+    assert (await _job(job.id)).status == "pending"
+    await _make_due(job.id)
+    await _claim_and_process(workers)
+    job = await _job(job.id)
+    assert job.status == "failed" and job.attempts == 2
+    assert workers.retried == 1 and workers.failed == 1
+
+
+async def test_permanent_error_fails_at_once(workers, graph_batch):
+    job = await _enqueue("update", "e1", {"subject": "a"})
+    graph_batch.statuses["/me/events/e1"] = 400
+
+    await _claim_and_process(workers)
+    job = await _job(job.id)
+    assert job.status == "failed" and job.attempts == 1 and job.result
+
+
+async def test_retried_delete_of_gone_event_succeeds(workers, graph_batch):
+    job = await _enqueue("delete", "e1")
+    graph_batch.statuses["/me/events/e1"] = 503
+    await _claim_and_process(workers)
+    # The first attempt went through after all; the event is gone now
+    graph_batch.statuses["/me/events/e1"] = 404
+    await _make_due(job.id)
+    await _claim_and_process(workers)
+    assert (await _job(job.id)).status == "succeeded"
+
+
+async def test_expired_lease_is_claimed_again(workers, graph_batch):
+    job = await _enqueue("update", "e1", {"subject": "a"})
+    claimed = await workers._claim()
+    assert [claimed_job.id for claimed_job in claimed[1]] == [job.id]
+    workers._busy_users.clear()
+    # Still leased: another worker may not take it
+    assert await workers._claim() is None
+
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(OutboxJob).where(OutboxJob.id == job.id).values(locked_until=datetime.utcnow() - timedelta(seconds=1)))
+        await db.commit()
+    assert await _claim_and_process(workers) == [job.id]
+    job = await _job(job.id)
+    assert job.status == "succeeded" and job.attempts == 2
+
+
+async def test_lease_is_renewed_while_waiting(workers, graph_batch, monkeypatch):
+    monkeypatch.setattr(outbox_module, "OUTBOX_LEASE_SECONDS", 0.15)
+    job = await _enqueue("update", "e1", {"subject": "a"})
+    other_process = OutboxWorkers(workers=1)
+    sent = graph_batch.__call__
+
+    async def _slow_batch(token, requests, slot=None):
+        # Waits for a write scheduler slot well past the first lease
+        await asyncio.sleep(0.5)
+        assert await other_process._claim() is None
+        return await sent(token, requests, slot)
+
+    monkeypatch.setattr(outbox_module, "batch", _slow_batch)
+    assert await _claim_and_process(workers) == [job.id]
+    job = await _job(job.id)
+    assert job.status == "succeeded" and job.attempts == 1
+    assert len(graph_batch.calls) == 1
+
+
+async def test_create_keeps_callers_transaction_id(workers, graph_batch):
+    keyed = await _enqueue("create", payload={"subject": "a", "transactionId": "from-idempotency-key"})
+    unkeyed = await _enqueue("create", payload={"subject": "b"})
+    await _claim_and_process(workers)
+    assert [request["body"]["transactionId"] for request in graph_batch.calls[0]] == ["from-idempotency-key", unkeyed.id]
+    assert keyed.id != "from-idempotency-key"
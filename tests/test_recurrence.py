@@ -0,0 +1,116 @@
+from datetime import date, datetime, timezone
+from itertools import islice
+
+from app.recurrence import expand, occurrence_starts, pattern_dates
+
+
+def _dates(pattern, first, count, skip_to=None):
+    return list(islice(pattern_dates(pattern, first, skip_to), count))
+
+
+def _utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+
+def _time(value: str) -> dict:
+    return {"dateTime": value, "timeZone": "UTC"}
+
+
+def test_daily_with_interval_and_skip():
+    pattern = {"type": "daily", "interval": 2}
+    assert _dates(pattern, date(2026, 3, 1), 3) == [date(2026, 3, 1), date(2026, 3, 3), date(2026, 3, 5)]
+    # Jumps to the period holding skip_to without leaving the interval grid
+    assert _dates(pattern, date(2026, 3, 1), 2, date(2026, 6, 10)) == [date(2026, 6, 9), date(2026, 6, 11)]
+
+
+def test_weekly_days_and_interval():
+    pattern = {"type": "weekly", "interval": 2, "daysOfWeek": ["wednesday", "monday"], "firstDayOfWeek": "sunday"}
+    assert _dates(pattern, date(2026, 3, 2), 6) == [
+        date(2026, 3, 2), date(2026, 3, 4), date(2026, 3, 16), date(2026, 3, 18), date(2026, 3, 30), date(2026, 4, 1),
+    ]
+    # Days of the first week before the series starts are not occurrences
+    assert _dates(pattern, date(2026, 3, 3), 2) == [date(2026, 3, 4), date(2026, 3, 16)]
+
+
+def test_absolute_monthly_skips_short_months():
+    pattern = {"type": "absoluteMonthly", "interval": 1, "dayOfMonth": 31}
+    assert _dates(pattern, date(2026, 1, 31), 5) == [
+        date(2026, 1, 31), date(2026, 3, 31), date(2026, 5, 31), date(2026, 7, 31), date(2026, 8, 31),
+    ]
+
+
+def test_relative_monthly_last_weekday():
+    pattern = {"type": "relativeMonthly", "interval": 1, "daysOfWeek": ["friday"], "index": "last"}
+    assert _dates(pattern, date(2026, 1, 1), 3) == [date(2026, 1, 30), date(2026, 2, 27), date(2026, 3, 27)]
+
+
+def test_yearly_leap_day():
+    pattern = {"type": "absoluteYearly", "interval": 1, "month": 2, "dayOfMonth": 29}
+    assert _dates(pattern, date(2024, 2, 29), 2) == [date(2024, 2, 29), date(2028, 2, 29)]
+
+
+def test_impossible_pattern_ends():
+    pattern = {"type": "absoluteYearly", "interval": 1, "month": 2, "dayOfMonth": 30}
+    assert _dates(pattern, date(2026, 1, 1), 1) == []
+
+
+def test_occurrences_keep_local_time_across_dst():
+    recurrence = {
+        "pattern": {"type": "daily", "interval": 1},
+        "range": {"type": "numbered", "numberOfOccurrences": 3, "startDate": "2026-03-27", "recurrenceTimeZone": "Europe/Berlin"},
+    }
+    assert list(occurrence_starts(recurrence, _utc(2026, 3, 27, 8))) == [
+        _utc(2026, 3, 27, 8), _utc(2026, 3, 28, 8), _utc(2026, 3, 29, 7),
+    ]
+
+
+def test_ranges():
+    numbered = {"pattern": {"type": "daily"}, "range": {"type": "numbered", "numberOfOccurrences": 3, "startDate": "2026-03-01"}}
+    # Counted from the first occurrence even when asked to skip ahead
+    assert list(occurrence_starts(numbered, _utc(2026, 3, 1, 9), skip_to=_utc(2026, 3, 20))) == [
+        _utc(2026, 3, 1, 9), _utc(2026, 3, 2, 9), _utc(2026, 3, 3, 9),
+    ]
+    end_date = {"pattern": {"type": "daily"}, "range": {"type": "endDate", "startDate": "2026-03-01", "endDate": "2026-03-02"}}
+    assert list(occurrence_starts(end_date, _utc(2026, 3, 1, 9))) == [_utc(2026, 3, 1, 9), _utc(2026, 3, 2, 9)]
+    no_end = {"pattern": {"type": "daily"}, "range": {"type": "noEnd", "startDate": "2026-03-01"}}
+    assert next(occurrence_starts(no_end, _utc(2026, 3, 1, 9), skip_to=_utc(2027, 1, 1))) == _utc(2027, 1, 1, 9)
+
+
+MASTER = {
+    "id": "series",
+    "subject": "Standup",
+    "@odata.etag": 'W/"1"',
+    "start": _time("2026-03-02T09:00:00"),
+    "end": _time("2026-03-02T10:00:00"),
+    "recurrence": {"pattern": {"type": "daily", "interval": 1}, "range": {"type": "numbered", "numberOfOccurrences": 5, "startDate": "2026-03-02"}},
+}
+
+
+def test_expand_computes_occurrences():
+    occurrences = list(expand(MASTER, _utc(2026, 3, 3, 9, 30), _utc(2026, 3, 5)))
+    assert [occurrence["start"]["dateTime"] for occurrence in occurrences] == ["2026-03-03T09:00:00", "2026-03-04T09:00:00"]
+    first = occurrences[0]
+    assert first["type"] == "occurrence" and first["seriesMasterId"] == "series" and first["subject"] == "Standup"
+    assert first["originalStart"] == "2026-03-03T09:00:00Z" and "recurrence" not in first and "@odata.etag" not in first
+
+
+def test_expand_merges_known_instances_and_drops_cancelled():
+    moved = {
+        "id": "moved", "type": "exception", "originalStart": "2026-03-03T09:00:00Z",
+        "start": _time("2026-03-03T15:00:00"), "end": _time("2026-03-03T16:00:00"),
+    }
+    # Synced for March 4th, where Graph had no instance: that one was cancelled
+    covered = (_utc(2026, 3, 4), _utc(2026, 3, 5))
+    starts = [
+        (occurrence.get("id"), occurrence["start"]["dateTime"])
+        for occurrence in expand(MASTER, _utc(2026, 3, 1), _utc(2026, 3, 31), [moved], covered)
+    ]
+    assert starts == [
+        (None, "2026-03-02T09:00:00"), ("moved", "2026-03-03T15:00:00"), (None, "2026-03-05T09:00:00"), (None, "2026-03-06T09:00:00"),
+    ]
+
+
+def test_expand_single_event():
+    event = {"id": "one", "start": _time("2026-03-02T09:00:00"), "end": _time("2026-03-02T10:00:00")}
+    assert list(expand(event, _utc(2026, 3, 2), _utc(2026, 3, 3))) == [event]
+    assert list(expand(event, _utc(2026, 3, 2, 10), _utc(2026, 3, 3))) == []
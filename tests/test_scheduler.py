@@ -0,0 +1,142 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import app.graph_api as graph_api
+from app.scheduler import FairScheduler, SchedulerFullError
+
+pytestmark = pytest.mark.anyio
+
+
+async def _run_all(scheduler, writes):
+    """
+    Queues `writes` ((name, user, cost), in order) behind a held slot, then
+    lets them through and returns the names in the order they were admitted.
+    """
+    admitted = []
+
+    async def _write(name, user, cost):
+        async with scheduler.slot(user, cost, wait=True):
+            admitted.append(name)
+
+    await scheduler.acquire("holder")
+    tasks = [asyncio.ensure_future(_write(*write)) for write in writes]
+    await asyncio.sleep(0)
+    scheduler.release("holder")
+    await asyncio.gather(*tasks)
+    return admitted
+
+
+async def test_bulk_writes_do_not_crowd_out_single_writes():
+    scheduler = FairScheduler(concurrency=1, per_user=10, queue_depth=10, quantum=2)
+    admitted = await _run_all(scheduler, [
+        ("a1", "a", 4), ("a2", "a", 4), ("b1", "b", 1), ("b2", "b", 1), ("b3", "b", 1), ("b4", "b", 1),
+    ])
+    # a's $batch costs two turns' quantum, so b gets two writes in per a batch
+    assert admitted == ["b1", "b2", "a1", "b3", "b4", "a2"]
+    assert scheduler.stats()["running"] == 0 and scheduler.stats()["active_users"] == 0
+
+
+async def test_equal_users_take_turns():
+    scheduler = FairScheduler(concurrency=1, per_user=10, queue_depth=10, quantum=1)
+    admitted = await _run_all(scheduler, [("a1", "a", 1), ("a2", "a", 1), ("a3", "a", 1), ("b1", "b", 1), ("b2", "b", 1)])
+    assert admitted == ["a1", "b1", "a2", "b2", "a3"]
+
+
+async def test_per_user_limit():
+    scheduler = FairScheduler(concurrency=10, per_user=1, queue_depth=10)
+    await scheduler.acquire("a")
+    waiting = asyncio.ensure_future(scheduler.acquire("a"))
+    await scheduler.acquire("b")
+    await asyncio.sleep(0)
+    assert not waiting.done()
+    scheduler.release("a")
+    await waiting
+    assert scheduler.stats()["running"] == 2
+
+
+async def test_full_queue_rejects_at_once():
+    scheduler = FairScheduler(concurrency=1, per_user=1, queue_depth=1)
+    await scheduler.acquire("a")
+    waiting = asyncio.ensure_future(scheduler.acquire("a"))
+    await asyncio.sleep(0)
+    with pytest.raises(SchedulerFullError) as error:
+        await scheduler.acquire("a")
+    assert error.value.reason == "queue_full"
+    # Background work waits however long the queue
+    background = asyncio.ensure_future(scheduler.acquire("a", wait=True))
+    scheduler.release("a")
+    await waiting
+    scheduler.release("a")
+    await background
+    scheduler.release("a")
+    assert scheduler.stats()["rejected"] == {"queue_full": 1, "timeout": 0}
+
+
+async def test_wait_times_out():
+    scheduler = FairScheduler(concurrency=1, per_user=1, queue_depth=4, queue_timeout=0.01)
+    await scheduler.acquire("a")
+    with pytest.raises(SchedulerFullError) as error:
+        await scheduler.acquire("b")
+    assert error.value.reason == "timeout"
+    scheduler.release("a")
+    assert scheduler.stats()["queued"] == 0 and scheduler.stats()["active_users"] == 0
+    await scheduler.acquire("b")
+
+
+async def test_cancelled_waiter_gives_up_its_place():
+    scheduler = FairScheduler(concurrency=1, per_user=1, queue_depth=4)
+    await scheduler.acquire("a")
+    cancelled = asyncio.ensure_future(scheduler.acquire("b"))
+    waiting = asyncio.ensure_future(scheduler.acquire("c"))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    scheduler.release("a")
+    await waiting
+    assert scheduler.stats()["running"] == 1 and scheduler.stats()["queued"] == 0
+
+
+@pytest.fixture
+def batch_graph(monkeypatch):
+    """
+    $batch endpoint that takes a moment per call and records how many
+    calls overlapped.
+    """
+    class _Graph:
+        in_flight = 0
+        most = 0
+
+    async def _handler(request):
+        _Graph.in_flight += 1
+        _Graph.most = max(_Graph.most, _Graph.in_flight)
+        await asyncio.sleep(0.01)
+        _Graph.in_flight -= 1
+        sub_requests = json.loads(request.content)["requests"]
+        return httpx.Response(200, json={"responses": [{"id": sub["id"], "status": 204} for sub in sub_requests]})
+
+    monkeypatch.setattr(graph_api, "_client", httpx.AsyncClient(transport=httpx.MockTransport(_handler)))
+    return _Graph
+
+
+async def test_batch_takes_a_slot_per_chunk(batch_graph):
+    scheduler = FairScheduler(concurrency=10, per_user=2, queue_depth=10)
+    requests = [{"method": "DELETE", "url": f"/me/events/e{index}"} for index in range(65)]
+
+    responses = await graph_api.batch("access-token", requests, slot=lambda cost: scheduler.slot("a", cost=cost, wait=True))
+    assert [response["status"] for response in responses] == [204] * 65
+    # Four chunks, run in parallel but never beyond the user's two slots
+    assert batch_graph.most == 2
+    assert scheduler.stats()["granted"] == 4 and scheduler.stats()["running"] == 0
+
+
+async def test_batch_chunk_turned_away_answers_429(batch_graph, monkeypatch):
+    monkeypatch.setattr(graph_api, "GRAPH_MAX_RETRIES", 0)
+    scheduler = FairScheduler(concurrency=10, per_user=1, queue_depth=0)
+    requests = [{"method": "DELETE", "url": f"/me/events/e{index}"} for index in range(25)]
+
+    responses = await graph_api.batch("access-token", requests, slot=lambda cost: scheduler.slot("a", cost=cost))
+    assert [response["status"] for response in responses] == [204] * 20 + [429] * 5
+    assert responses[-1]["headers"]["Retry-After"] == "1.0"
@@ -0,0 +1,55 @@
+import httpx
+import pytest
+
+import app.serialization as serialization
+from app.models import EventRequest
+from app.payloads import build_event_payload, build_update_payload
+from app.serialization import RawJSON, dumps, json_response, loads, parse_graph_json
+
+VALUE = {"subject": "Café ☕", "attendees": [{"address": "a@test.local"}], "count": 2, "online": False, "note": None}
+
+
+@pytest.mark.parametrize("codec", ["orjson", "json"])
+def test_codecs_agree(codec, monkeypatch):
+    if codec == "json":
+        monkeypatch.setattr(serialization, "orjson", None)
+    encoded = dumps(VALUE)
+    assert encoded == '{"subject":"Café ☕","attendees":[{"address":"a@test.local"}],"count":2,"online":false,"note":null}'.encode()
+    assert loads(encoded) == VALUE
+
+
+def test_graph_objects_keep_their_bytes():
+    content = b'{"id": "e1",  "subject": "Review"}'
+    event = parse_graph_json(content)
+    assert isinstance(event, RawJSON) and event == {"id": "e1", "subject": "Review"} and event.raw == content
+    assert json_response(event, headers={"ETag": 'W/"1"'}).body == content
+    # Lists and plain dicts are encoded as usual
+    assert parse_graph_json(b"[1, 2]") == [1, 2]
+    assert json_response({"id": "e1"}, status_code=201).body == b'{"id":"e1"}'
+
+
+def test_event_payloads():
+    event = EventRequest(
+        subject="Review", content=None, start_time="2026-03-02T09:00:00", end_time="2026-03-02T10:00:00",
+        attendees=[{"email": "a@test.local"}, {"email": "b@test.local"}], time_zone="Europe/Berlin",
+    )
+    payload = build_event_payload(event, "UTC", {"a@test.local": "Alice"})
+    assert payload["start"] == {"dateTime": "2026-03-02T09:00:00", "timeZone": "Europe/Berlin"}
+    assert payload["body"] == {"contentType": "HTML", "content": ""}
+    assert [attendee["emailAddress"]["name"] for attendee in payload["attendees"]] == ["Alice", "b@test.local"]
+    # Attendee entries are built once per address and name
+    assert build_event_payload(event, "UTC")["attendees"][1] is payload["attendees"][1]
+    assert set(build_update_payload(event)) == {"subject", "body", "start", "end"}
+
+
+def test_get_event_returns_graph_bytes(client, graph):
+    content = b'{"id": "far",  "subject": "Outside the synced window", "@odata.etag": "W/\\"7\\""}'
+
+    def _handler(request):
+        if "delta" in request.url.path:
+            return httpx.Response(200, json={"value": [], "@odata.deltaLink": "https://graph.microsoft.com/v1.0/me/calendarView/delta?$deltatoken=1"})
+        return httpx.Response(200, content=content, headers={"Content-Type": "application/json"})
+
+    graph.handler = _handler
+    response = client.get("/events/far", headers={"email": "user@test.local"})
+    assert response.status_code == 200 and response.content == content
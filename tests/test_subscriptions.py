@@ -0,0 +1,132 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, select, update
+
+import app.subscriptions as subscriptions_module
+from app.db import AsyncSessionLocal, GraphSubscription, close_db, init_db
+from app.subscriptions import SubscriptionManager
+
+pytestmark = pytest.mark.anyio
+
+EMAIL = "user@test.local"
+
+
+@pytest.fixture
+async def graph_subscriptions(monkeypatch):
+    """
+    Fakes Graph's subscription calls; `renewable` is False once Graph has
+    dropped a subscription, so renewing it answers 404.
+    """
+    await init_db()
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(GraphSubscription))
+        await db.commit()
+
+    class _Graph:
+        created = []
+        renewed = []
+        deleted = []
+        renewable = True
+
+    async def _create(access_token, resource, notification_url, expiration, client_state):
+        _Graph.created.append(client_state)
+        return {"id": f"sub-{len(_Graph.created)}", "expirationDateTime": expiration}
+
+    async def _renew(access_token, subscription_id, expiration):
+        _Graph.renewed.append(subscription_id)
+        return {"id": subscription_id, "expirationDateTime": expiration} if _Graph.renewable else None
+
+    async def _delete(access_token, subscription_id):
+        _Graph.deleted.append(subscription_id)
+
+    monkeypatch.setattr(subscriptions_module, "NOTIFICATION_URL", "https://app.test.local/notifications")
+    monkeypatch.setattr(subscriptions_module, "create_subscription", _create)
+    monkeypatch.setattr(subscriptions_module, "renew_subscription", _renew)
+    monkeypatch.setattr(subscriptions_module, "delete_subscription", _delete)
+    yield _Graph
+    await close_db()
+
+
+def _manager(**kwargs) -> SubscriptionManager:
+    manager = SubscriptionManager(**kwargs)
+
+    async def _token(email):
+        return "access-token"
+
+    manager._token_provider = _token
+    return manager
+
+
+async def _subscribe(manager) -> GraphSubscription:
+    async with AsyncSessionLocal() as db:
+        return await manager.subscribe(db, EMAIL, "access-token")
+
+
+async def _expire_soon(subscription_id):
+    async with AsyncSessionLocal() as db:
+        await db.execute(update(GraphSubscription).where(GraphSubscription.id == subscription_id).values(expires_at=datetime.utcnow() + timedelta(minutes=1)))
+        await db.commit()
+
+
+async def _ids() -> list:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(GraphSubscription.id))).scalars().all()
+
+
+async def test_one_subscription_per_user(graph_subscriptions):
+    manager = _manager()
+    first = await _subscribe(manager)
+    assert (await _subscribe(manager)).id == first.id
+    assert len(graph_subscriptions.created) == 1
+
+    async with AsyncSessionLocal() as db:
+        assert await manager.unsubscribe(db, EMAIL, "access-token") == 1
+    assert graph_subscriptions.deleted == [first.id] and await _ids() == []
+
+
+async def test_renews_subscriptions_about_to_expire(graph_subscriptions):
+    manager = _manager(renew_before_seconds=600)
+    subscription = await _subscribe(manager)
+    assert await manager.run_once() == 0
+
+    await _expire_soon(subscription.id)
+    assert await manager.run_once() == 1
+    assert graph_subscriptions.renewed == [subscription.id] and manager.renewals == 1
+    async with AsyncSessionLocal() as db:
+        assert (await db.get(GraphSubscription, subscription.id)).expires_at > datetime.utcnow() + timedelta(minutes=10)
+
+
+async def test_dropped_subscription_is_replaced(graph_subscriptions, monkeypatch):
+    manager = _manager(renew_before_seconds=600, debounce_seconds=0)
+    synced = []
+    monkeypatch.setattr(manager, "_enqueue", synced.append)
+    subscription = await _subscribe(manager)
+    await _expire_soon(subscription.id)
+    graph_subscriptions.renewable = False
+
+    await manager.run_once()
+    assert await _ids() == ["sub-2"] and len(graph_subscriptions.created) == 2
+    # Changes made while there was no subscription are picked up by a sync
+    assert synced == [EMAIL]
+
+
+async def test_notifications_are_checked_and_debounced(graph_subscriptions, monkeypatch):
+    manager = _manager(debounce_seconds=0.05)
+    subscription = await _subscribe(manager)
+    syncs = []
+
+    async def _sync(email, access_token, start=None, end=None):
+        syncs.append(email)
+
+    monkeypatch.setattr(subscriptions_module.event_store, "has", lambda email: True)
+    monkeypatch.setattr(subscriptions_module.event_store, "sync", _sync)
+    # Known only from the database, as on a worker that did not subscribe
+    manager._known.clear()
+    good = {"subscriptionId": subscription.id, "clientState": subscription.client_state, "changeType": "updated"}
+    accepted = await manager.accept([good, good, {**good, "clientState": "forged"}, {**good, "subscriptionId": "unknown"}])
+    assert accepted == 2 and manager.notifications_rejected == 2
+
+    await manager._flush_task
+    assert syncs == [EMAIL] and manager.syncs == 1
+    await manager.stop()
@@ -0,0 +1,55 @@
+import pytest
+
+import app.telemetry as telemetry
+from app.telemetry import Histogram, render_prometheus, span
+
+
+@pytest.fixture
+def histograms(monkeypatch):
+    monkeypatch.setattr(telemetry, "_histograms", {})
+    monkeypatch.setattr(telemetry, "_span_hooks", [])
+    return telemetry._histograms
+
+
+def test_histogram_buckets():
+    histogram = Histogram()
+    for value in (0.0001, 0.0005, 0.003, 60.0):
+        histogram.observe(value)
+    # Bounds are inclusive; anything past the last one lands in +Inf
+    assert histogram.counts[0] == 2 and histogram.counts[3] == 1 and histogram.counts[-1] == 1
+    assert histogram.count == 4 and histogram.sum == pytest.approx(60.0036)
+
+
+def test_span_records_stage_and_calls_hooks(histograms):
+    seen = []
+    telemetry.add_span_hook(lambda name, duration, labels: seen.append((name, labels)))
+    with span("db_token_lookup", user="a"):
+        pass
+    assert seen == [("db_token_lookup", {"endpoint": "background", "user": "a"})]
+    ((metric, labels),) = histograms
+    assert metric == "stage_duration_seconds" and dict(labels) == {"stage": "db_token_lookup", "endpoint": "background"}
+
+
+def test_disabled_telemetry_records_nothing(histograms, monkeypatch):
+    monkeypatch.setattr(telemetry, "TELEMETRY_ENABLED", False)
+    assert span("a") is span("b")
+    with span("a"):
+        telemetry.observe("stage_duration_seconds", 1.0, stage="a")
+    assert histograms == {}
+
+
+def test_prometheus_exposition(histograms):
+    telemetry.observe("upstream_request_duration_seconds", 0.002, upstream="graph", route='say "hi"')
+    text = render_prometheus([("outbox_pending", "gauge", {}, 3), ("outbox_pending", "gauge", {"user": "a"}, 1)])
+    lines = text.splitlines()
+    assert "# TYPE upstream_request_duration_seconds histogram" in lines
+    assert 'upstream_request_duration_seconds_bucket{route="say \\"hi\\"",upstream="graph",le="0.001"} 0' in lines
+    # Buckets are cumulative
+    assert 'upstream_request_duration_seconds_bucket{route="say \\"hi\\"",upstream="graph",le="+Inf"} 1' in lines
+    assert lines[-3:] == ["# TYPE outbox_pending gauge", "outbox_pending 3", 'outbox_pending{user="a"} 1']
+
+
+def test_metrics_endpoint_labels_by_route(client, histograms):
+    client.get("/stats/graph")
+    text = client.get("/metrics").text
+    assert 'http_request_duration_seconds_count{method="GET",route="/stats/graph",status="200"} 1' in text.splitlines()
@@ -0,0 +1,219 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+
+import app.graph_api as graph_api
+import app.throttling as throttling
+from app import shared_state
+from app.throttling import CircuitBreaker, CircuitOpenError, RateLimiter, TokenBucket, parse_retry_after
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+def fake_graph(graph, monkeypatch):
+    """
+    Graph behind graph_api's client, without retry delays or shared breakers.
+    """
+    monkeypatch.setattr(graph_api, "_client", httpx.AsyncClient(transport=httpx.MockTransport(graph)))
+    monkeypatch.setattr(graph_api, "backoff_delay", lambda attempt: 0.0)
+    monkeypatch.setattr(throttling, "breakers", {})
+    return graph
+
+
+def test_token_bucket_admits_burst_then_paces():
+    bucket = TokenBucket(rate=10, capacity=2)
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == 0.0
+    assert bucket.reserve() == pytest.approx(0.1, abs=0.01)
+    assert bucket.reserve() == pytest.approx(0.2, abs=0.01)
+
+
+def test_token_bucket_block_for():
+    bucket = TokenBucket(rate=10, capacity=20)
+    bucket.block_for(3)
+    assert bucket.reserve() == pytest.approx(3.1, abs=0.01)
+
+
+async def test_rate_limiter_waits_once_user_burst_is_spent(monkeypatch):
+    monkeypatch.setattr(throttling, "GRAPH_USER_RATE", 100)
+    monkeypatch.setattr(throttling, "GRAPH_USER_BURST", 1)
+    limiter = RateLimiter()
+    assert await limiter.acquire("u1", "t1") == 0.0
+    assert await limiter.acquire("u1", "t1") > 0
+    # Other users have buckets of their own
+    assert await limiter.acquire("u2", "t1") == 0.0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2") == 2.0
+    assert parse_retry_after("-1") == 0.0
+    assert parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT") == 0.0
+    assert parse_retry_after("soon") is None
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("100000") == throttling.GRAPH_MAX_RETRY_AFTER
+
+
+def test_circuit_breaker_opens_and_recovers(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(throttling.time, "monotonic", lambda: clock[0])
+    breaker = CircuitBreaker(failure_threshold=2, recovery_seconds=30)
+    breaker.record_failure()
+    breaker.allow("r")
+    breaker.record_failure()
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.allow("r")
+    assert error.value.retry_after == pytest.approx(30)
+
+    clock[0] += 30
+    breaker.allow("r")
+    assert breaker.state == "half_open"
+    # Only the one trial request goes through
+    with pytest.raises(CircuitOpenError):
+        breaker.allow("r")
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_failed_trial_reopens_circuit(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(throttling.time, "monotonic", lambda: clock[0])
+    breaker = CircuitBreaker(failure_threshold=1, recovery_seconds=10)
+    breaker.record_failure()
+    clock[0] += 10
+    breaker.allow("r")
+    breaker.record_failure()
+    assert breaker.state == "open" and breaker.times_opened == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.allow("r")
+
+
+async def test_request_retries_throttled_responses(fake_graph):
+    responses = iter([httpx.Response(429, headers={"Retry-After": "0"}), httpx.Response(503), httpx.Response(200, json={"value": []})])
+    fake_graph.handler = lambda request: next(responses)
+    response = await graph_api._request("list_events", "GET", "https://graph.test/me/events", "access-token")
+    assert response.status_code == 200
+    assert len(fake_graph.requests) == 3
+
+
+async def test_request_gives_up_after_max_retries(fake_graph, monkeypatch):
+    monkeypatch.setattr(graph_api, "GRAPH_MAX_RETRIES", 2)
+    fake_graph.handler = lambda request: httpx.Response(503)
+    response = await graph_api._request("list_events", "GET", "https://graph.test/me/events", "access-token")
+    assert response.status_code == 503
+    assert len(fake_graph.requests) == 3
+
+
+async def test_open_circuit_rejects_without_calling_graph(fake_graph, monkeypatch):
+    monkeypatch.setattr(graph_api, "GRAPH_MAX_RETRIES", 0)
+    throttling.breakers["list_events"] = CircuitBreaker(failure_threshold=1, recovery_seconds=60)
+    fake_graph.handler = lambda request: httpx.Response(500)
+    await graph_api._request("list_events", "GET", "https://graph.test/me/events", "access-token")
+    with pytest.raises(CircuitOpenError):
+        await graph_api._request("list_events", "GET", "https://graph.test/me/events", "access-token")
+    assert len(fake_graph.requests) == 1
+
+
+async def test_retried_create_keeps_its_transaction_id(fake_graph):
+    responses = iter([httpx.Response(504), httpx.Response(201, json={"id": "e1"})])
+    fake_graph.handler = lambda request: next(responses)
+    assert (await graph_api.create_event("access-token", {"subject": "a"}))["id"] == "e1"
+    bodies = [json.loads(request.content) for request in fake_graph.requests]
+    assert len(bodies) == 2 and bodies[0]["transactionId"] and bodies[0] == bodies[1]
+
+
+async def test_create_keeps_callers_transaction_id(fake_graph):
+    fake_graph.handler = lambda request: httpx.Response(201, json={"id": "e1"})
+    await graph_api.create_event("access-token", {"subject": "a", "transactionId": "mine"})
+    assert json.loads(fake_graph.requests[0].content)["transactionId"] == "mine"
+
+
+async def test_batch_creates_carry_transaction_ids(fake_graph):
+    calls = []
+
+    def _handler(request):
+        body = json.loads(request.content)
+        calls.append(body["requests"])
+        status = 503 if len(calls) == 1 else 201
+        return httpx.Response(200, json={"responses": [{"id": sub["id"], "status": status, "body": {"id": "e"}} for sub in body["requests"]]})
+
+    fake_graph.handler = _handler
+    responses = await graph_api.batch("access-token", [
+        {"method": "POST", "url": "/me/events", "body": {"subject": "a"}},
+        {"method": "PATCH", "url": "/me/events/e2", "body": {"subject": "b"}},
+    ])
+    assert [response["status"] for response in responses] == [201, 201]
+    first, retried = calls
+    assert first[0]["body"]["transactionId"] == retried[0]["body"]["transactionId"]
+    assert "transactionId" not in first[1]["body"]
+
+
+async def test_shared_limiter_gives_back_rejected_slots(monkeypatch):
+    class _SharedState(shared_state.InProcessState):
+        distributed = True
+
+    state = _SharedState()
+    monkeypatch.setattr(shared_state, "state", state)
+    monkeypatch.setattr(throttling.time, "time", lambda: 1000.5)
+    monkeypatch.setattr(throttling, "GRAPH_USER_RATE", 1)
+    monkeypatch.setattr(throttling, "GRAPH_TENANT_RATE", 2)
+    limiter = RateLimiter()
+
+    assert await limiter.acquire("u1", "t1") == 0.0
+    waiting = asyncio.ensure_future(limiter.acquire("u1", "t1"))
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+    # u1's turned-away request left the tenant's second slot free
+    assert await limiter.acquire("u2", "t1") == 0.0
+    waiting.cancel()
+    assert await state.get("ratelimit:user:u1:1000") == "1"
+    assert await state.get("ratelimit:tenant:t1:1000") == "2"
+
+
+def test_unanswered_trial_expires(monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(throttling.time, "monotonic", lambda: clock[0])
+    breaker = CircuitBreaker(failure_threshold=1, recovery_seconds=10)
+    breaker.record_failure()
+    clock[0] += 10
+    breaker.allow("r")
+    clock[0] += 5
+    with pytest.raises(CircuitOpenError) as error:
+        breaker.allow("r")
+    assert error.value.retry_after == pytest.approx(5)
+    # The trial never reported back; another one may go
+    clock[0] += 5
+    breaker.allow("r")
+    assert breaker.state == "half_open"
+
+
+async def test_cancelled_trial_reopens_circuit(monkeypatch):
+    started = asyncio.Event()
+
+    async def _handler(request):
+        started.set()
+        await asyncio.sleep(10)
+        return httpx.Response(200, json={})
+
+    monkeypatch.setattr(graph_api, "_client", httpx.AsyncClient(transport=httpx.MockTransport(_handler)))
+    breaker = CircuitBreaker(failure_threshold=1, recovery_seconds=0.05)
+    monkeypatch.setitem(throttling.breakers, "get_event", breaker)
+    breaker.record_failure()
+    await asyncio.sleep(0.05)
+
+    trial = asyncio.ensure_future(graph_api.get_event("access-token", "e1"))
+    await started.wait()
+    assert breaker.state == "half_open"
+    trial.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await trial
+    assert breaker.state == "open"
+
+    # After the recovery period the next request is the new trial
+    await asyncio.sleep(0.05)
+    monkeypatch.setattr(graph_api, "_client", httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, json={"id": "e1"}))))
+    assert (await graph_api.get_event("access-token", "e1"))["id"] == "e1"
+    assert breaker.state == "closed"
@@ -0,0 +1,60 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from app.models import EventRequest
+from app.timezones import event_bounds, parse_graph_datetime, resolve_zone, to_graph_datetime, validate_zone
+
+
+def test_graph_seven_digit_fraction():
+    parsed = parse_graph_datetime("2030-01-01T09:00:00.1234567", "UTC")
+    assert parsed == datetime(2030, 1, 1, 9, 0, 0, 123456, tzinfo=timezone.utc)
+
+
+@pytest.mark.parametrize("value, micro", [
+    ("2030-01-01T09:00:00.000+05:30", 0),
+    ("2030-01-01T09:00:00.5+05:30", 500000),
+    ("2030-01-01T09:00:00.1234567+05:30", 123456),
+])
+def test_fraction_keeps_offset(value, micro):
+    parsed = parse_graph_datetime(value)
+    assert parsed.utcoffset() == timedelta(hours=5, minutes=30)
+    assert parsed.microsecond == micro
+
+
+def test_fraction_with_z():
+    assert parse_graph_datetime("2030-01-01T09:00:00.0000000Z").utcoffset() == timedelta(0)
+
+
+def test_naive_value_takes_zone():
+    parsed = parse_graph_datetime("2030-07-01T09:00:00", "Europe/Berlin")
+    assert parsed.utcoffset() == timedelta(hours=2)
+
+
+def test_to_graph_datetime_converts_offsets():
+    assert to_graph_datetime("2030-01-01T09:00:00.000+05:30", "UTC") == "2030-01-01T03:30:00"
+    assert to_graph_datetime("2030-01-01T09:00:00Z", "Asia/Kolkata") == "2030-01-01T14:30:00"
+    assert to_graph_datetime("2030-01-01T09:00:00", "Asia/Kolkata") == "2030-01-01T09:00:00"
+
+
+def test_windows_zone_names():
+    assert validate_zone("Pacific Standard Time") == "Pacific Standard Time"
+    assert resolve_zone("Pacific Standard Time").key == "America/Los_Angeles"
+    assert resolve_zone("Not/AZone") == timezone.utc
+    with pytest.raises(ValueError):
+        validate_zone("Not/AZone")
+
+
+def test_event_bounds():
+    start, end = event_bounds({
+        "start": {"dateTime": "2030-01-01T09:00:00.0000000", "timeZone": "UTC"},
+        "end": {"dateTime": "2030-01-01T10:00:00.0000000", "timeZone": "UTC"},
+    })
+    assert end - start == timedelta(hours=1)
+
+
+def test_event_request_checks_order_with_fraction_and_offset():
+    body = {"subject": "s", "content": "c", "start_time": "2030-01-01T09:00:00.5+05:30"}
+    EventRequest(**body, end_time="2030-01-01T09:00:00.000+05:00")
+    with pytest.raises(ValueError):
+        EventRequest(**body, end_time="2030-01-01T09:00:00.000+05:45")
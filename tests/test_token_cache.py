@@ -0,0 +1,30 @@
+from datetime import datetime, timedelta
+
+from app.token_cache import TokenCache
+
+
+def test_token_inside_refresh_buffer_is_not_served():
+    cache = TokenCache(ttl_seconds=3600, buffer_seconds=300)
+    cache.set("soon@test.local", "soon", datetime.utcnow() + timedelta(seconds=200))
+    cache.set("later@test.local", "later", datetime.utcnow() + timedelta(seconds=600))
+    # Expires in 200s: still valid, but inside the buffer, so the caller refreshes it
+    assert cache.get("soon@test.local") is None
+    assert cache.get("later@test.local") == "later"
+    assert cache.stats()["hits"] == 1 and cache.stats()["misses"] == 1
+
+
+def test_entries_expire_with_the_ttl():
+    cache = TokenCache(ttl_seconds=0, buffer_seconds=0)
+    cache.set("a@test.local", "a", datetime.utcnow() + timedelta(hours=1))
+    assert cache.get("a@test.local") is None
+
+
+def test_least_recently_used_is_evicted():
+    cache = TokenCache(max_size=2, ttl_seconds=3600, buffer_seconds=0)
+    expires_at = datetime.utcnow() + timedelta(hours=1)
+    cache.set("a", "a", expires_at)
+    cache.set("b", "b", expires_at)
+    assert cache.get("a") == "a"
+    cache.set("c", "c", expires_at)
+    assert cache.get("b") is None and cache.get("a") == "a" and cache.get("c") == "c"
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,120 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete, select
+
+import app.msal_cache as msal_cache
+import app.token_refresh as token_refresh
+from app.db import AsyncSessionLocal, MsalTokenCache, Token, close_db, init_db
+from app.token_cache import token_cache
+from app.token_refresh import TokenRefreshScheduler
+
+pytestmark = pytest.mark.anyio
+
+
+@pytest.fixture
+async def tokens():
+    await init_db()
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(Token))
+        await db.execute(delete(MsalTokenCache))
+        await db.commit()
+    yield
+    token_cache.clear()
+    msal_cache._blobs.clear()
+    await close_db()
+
+
+@pytest.fixture
+def azure_ad(monkeypatch):
+    """
+    Stands in for MSAL; `result` is what a refresh token redemption returns.
+    """
+    class _AzureAd:
+        result = {"access_token": "new-access", "refresh_token": "new-refresh", "expires_in": 3600}
+        calls = []
+
+    async def _silent(email, cache, min_validity_seconds=0):
+        return None
+
+    async def _refresh(refresh_token, cache=None):
+        _AzureAd.calls.append(refresh_token)
+        return _AzureAd.result
+
+    _AzureAd.calls = []
+    monkeypatch.setattr(token_refresh, "acquire_token_silent_async", _silent)
+    monkeypatch.setattr(token_refresh, "refresh_access_token_async", _refresh)
+    return _AzureAd
+
+
+async def _add_token(email, refresh_token="refresh", expires_in=60):
+    async with AsyncSessionLocal() as db:
+        db.add(Token(email=email, access_token="old-access", refresh_token=refresh_token, expires_at=datetime.utcnow() + timedelta(seconds=expires_in)))
+        await db.commit()
+
+
+async def _row(email) -> Token:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(Token).where(Token.email == email))).scalars().first()
+
+
+async def test_run_once_refreshes_expiring_tokens(tokens, azure_ad):
+    await _add_token("a@test.local")
+    await _add_token("b@test.local", expires_in=7200)
+    await _add_token("c@test.local", refresh_token=None)
+
+    assert await TokenRefreshScheduler(buffer_seconds=300).run_once() == 1
+    row = await _row("a@test.local")
+    assert row.access_token == "new-access" and row.refresh_token == "new-refresh"
+    assert azure_ad.calls == ["refresh"]
+
+
+async def test_refused_refresh_token_is_dropped(tokens, azure_ad):
+    await _add_token("a@test.local")
+    azure_ad.result = {"error": "invalid_grant", "error_description": "AADSTS50173: The provided grant has expired"}
+    scheduler = TokenRefreshScheduler(buffer_seconds=300)
+
+    assert await scheduler.run_once() == 1
+    assert (await _row("a@test.local")).refresh_token is None
+    # Not picked up again until the user signs in
+    assert await scheduler.run_once() == 0
+    assert azure_ad.calls == ["refresh"]
+
+
+async def test_transient_refresh_failure_keeps_refresh_token(tokens, azure_ad):
+    await _add_token("a@test.local")
+    azure_ad.result = {"error": "temporarily_unavailable"}
+    scheduler = TokenRefreshScheduler(buffer_seconds=300)
+
+    await scheduler.run_once()
+    assert (await _row("a@test.local")).refresh_token == "refresh"
+    await scheduler.run_once()
+    assert azure_ad.calls == ["refresh", "refresh"]
+
+
+async def test_scheduled_refresh_is_kept_until_done(tokens, azure_ad):
+    await _add_token("a@test.local")
+    token_refresh.schedule_refresh("a@test.local")
+    assert len(token_refresh._background) == 1
+    await asyncio.gather(*token_refresh._background)
+    await asyncio.sleep(0)
+    assert not token_refresh._background
+    assert (await _row("a@test.local")).access_token == "new-access"
+
+
+async def test_refresh_uses_the_msal_cache_first(tokens, azure_ad, monkeypatch):
+    await _add_token("a@test.local")
+
+    async def _silent(email, cache, min_validity_seconds=0):
+        cache.has_state_changed = True
+        return {"access_token": "cached-access", "expires_in": 3600}
+
+    monkeypatch.setattr(token_refresh, "acquire_token_silent_async", _silent)
+    assert await token_refresh.refresh_user_token("a@test.local") == "cached-access"
+    # The stored refresh token was not redeemed, and MSAL's updated cache was saved
+    assert azure_ad.calls == []
+    row = await _row("a@test.local")
+    assert row.access_token == "cached-access" and row.refresh_token == "refresh"
+    async with AsyncSessionLocal() as db:
+        assert (await db.execute(select(MsalTokenCache.email))).scalars().all() == ["a@test.local"]
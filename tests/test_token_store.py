@@ -0,0 +1,133 @@
+from datetime import datetime, timedelta
+
+import pytest
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
+from sqlalchemy import delete, select, text
+
+import app.crypto as crypto
+from app.db import AsyncSessionLocal, MsalTokenCache, Token, close_db, init_db
+from app.token_store import expiring_tokens, iter_expiring_tokens, reencrypt_tokens
+
+pytestmark = pytest.mark.anyio
+
+NOW = datetime(2026, 3, 2, 12)
+
+
+@pytest.fixture
+async def tokens():
+    await init_db()
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(Token))
+        await db.execute(delete(MsalTokenCache))
+        await db.commit()
+    yield
+    await close_db()
+
+
+@pytest.fixture
+def keys(monkeypatch):
+    """
+    Sets the encryption keys, newest first, as TOKEN_ENCRYPTION_KEYS would.
+    """
+    def _use(*keys):
+        monkeypatch.setattr(crypto, "_fernet", crypto._build_fernet(list(keys)))
+
+    return _use
+
+
+async def _add(email, minutes, tenant_id="t1", refresh_token="refresh"):
+    async with AsyncSessionLocal() as db:
+        db.add(Token(
+            email=email, tenant_id=tenant_id, access_token=f"access-{email}", refresh_token=refresh_token,
+            expires_at=NOW + timedelta(minutes=minutes),
+        ))
+        await db.commit()
+
+
+async def _row(email) -> Token:
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(select(Token).where(Token.email == email))).scalars().first()
+
+
+async def _raw(email, column="refresh_token"):
+    async with AsyncSessionLocal() as db:
+        return (await db.execute(text(f"SELECT {column} FROM tokens WHERE email = :email"), {"email": email})).scalar()
+
+
+async def test_keyset_scan_visits_each_row_once_in_order(tokens):
+    # Ties on expires_at are ordered by id
+    for index, minutes in enumerate([5, 1, 5, 3, 5, 9, 90]):
+        await _add(f"u{index}@test.local", minutes)
+    await _add("gone@test.local", 2, refresh_token=None)
+
+    pages = [[row.email for row in page] async for page in iter_expiring_tokens(NOW + timedelta(minutes=10), batch_size=2)]
+    assert pages == [
+        ["u1@test.local", "u3@test.local"], ["u0@test.local", "u2@test.local"], ["u4@test.local", "u5@test.local"],
+    ]
+
+
+async def test_scan_resumes_after_a_row(tokens):
+    await _add("a@test.local", 1)
+    await _add("b@test.local", 1)
+    await _add("c@test.local", 2)
+    async with AsyncSessionLocal() as db:
+        first = await expiring_tokens(db, NOW + timedelta(minutes=10), limit=1)
+        rest = await expiring_tokens(db, NOW + timedelta(minutes=10), after=(first[0].expires_at, first[0].id))
+    assert [row.email for row in first + rest] == ["a@test.local", "b@test.local", "c@test.local"]
+
+
+async def test_scan_by_tenant(tokens):
+    await _add("a@test.local", 1, tenant_id="t1")
+    await _add("b@test.local", 2, tenant_id="t2")
+    await _add("c@test.local", 3, tenant_id="t1")
+    pages = [page async for page in iter_expiring_tokens(NOW + timedelta(minutes=10), tenant_id="t1")]
+    assert [[row.email for row in page] for page in pages] == [["a@test.local", "c@test.local"]]
+
+
+def test_encrypt_round_trip(keys):
+    keys(Fernet.generate_key().decode())
+    encrypted = crypto.encrypt("secret")
+    assert encrypted.startswith(crypto.PREFIX) and "secret" not in encrypted
+    assert crypto.decrypt(encrypted) == "secret"
+    assert crypto.encrypt(None) is None and crypto.decrypt(None) is None
+    # Rows written before encryption was turned on are read as they are
+    assert crypto.decrypt("plain") == "plain"
+
+
+def test_encrypted_value_needs_a_key(keys):
+    keys(Fernet.generate_key().decode())
+    encrypted = crypto.encrypt("secret")
+    keys()
+    assert crypto.encrypt("secret") == "secret"
+    with pytest.raises(RuntimeError):
+        crypto.decrypt(encrypted)
+
+
+async def test_key_rotation(tokens, keys):
+    old, new = Fernet.generate_key().decode(), Fernet.generate_key().decode()
+    keys(old)
+    await _add("a@test.local", 1, refresh_token="refresh-a")
+    written_with_old = await _raw("a@test.local")
+
+    # New key first; rows under the old one still read
+    keys(new, old)
+    assert (await _row("a@test.local")).refresh_token == "refresh-a"
+    assert await reencrypt_tokens(batch_size=1) == 1
+
+    rewritten = await _raw("a@test.local")
+    assert rewritten != written_with_old and rewritten.startswith(crypto.PREFIX)
+    keys(new)
+    token = await _row("a@test.local")
+    assert (token.access_token, token.refresh_token) == ("access-a@test.local", "refresh-a")
+    with pytest.raises(InvalidToken):
+        MultiFernet([Fernet(old)]).decrypt(rewritten[len(crypto.PREFIX):].encode())
+
+
+async def test_turning_encryption_on(tokens, keys):
+    keys()
+    await _add("a@test.local", 1, refresh_token="refresh-a")
+    assert await _raw("a@test.local") == "refresh-a"
+    keys(Fernet.generate_key().decode())
+    await reencrypt_tokens()
+    assert (await _raw("a@test.local")).startswith(crypto.PREFIX)
+    assert (await _raw("a@test.local", "access_token")).startswith(crypto.PREFIX)